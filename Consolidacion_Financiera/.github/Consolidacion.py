@@ -1,29 +1,53 @@
 # scripts/finance_consolidation.py
 # Consolidación financiera multi-fuente:
-# - Stripe (opcional, si hay STRIPE_API_KEY)
+# - Stripe (opcional, si hay STRIPE_API_KEY): fees expandidos en la misma página, cargos y refunds en paralelo
 # - Fuente JSON genérica (opcional: GENERIC_JSON_URL)
-# - CSV locales (si existen en data/)
+# - CSV locales (si existen en data/): caché por huella de fichero y parseo en paralelo
+# - Conversión a moneda base con el tipo de cambio de la fecha de cada transacción (as-of),
+#   tipos persistidos en outputs/fx_store/ (sólo se piden los que faltan); sin tipo -> error
+# - Sincronización incremental: store local de transacciones (outputs/tx_store/) con marca por origen
+# - KPIs persistidos en outputs/kpi_store/: sólo se recalculan los días que cambian
+# - Esquema común de transacciones: category para texto repetido, importes Int64 en céntimos
+# - --engine duckdb (opcional): store, conversión y KPIs en DuckDB con memoria acotada
+# - --profile: JSON con tiempo y memoria por etapa (ingest, fx, consolidate, kpis, write)
 # Salidas:
 #   - outputs/transactions_consolidated.csv
 #   - outputs/kpi_daily.csv
 #   - outputs/kpi_by_source.csv
 #   - outputs/summary_YYYYMMDD.md
-# Requisitos: pandas, requests, pyyaml, python-dateutil, openpyxl
+# Requisitos: pandas, requests, pyyaml, python-dateutil, openpyxl (opcional: duckdb)
 
 import os
 import io
 import csv
 import json
 import math
+import codecs
+import re
+import sys
 import time
+import hashlib
 import argparse
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dateutil.parser import isoparse
 
+try:
+    import resource  # no existe en Windows: sin pico de RSS en el perfil
+except ImportError:
+    resource = None
+
 # --------------------
 # Utilidades/Helpers
 # --------------------
@@ -57,255 +81,1352 @@ def to_float(x):
     except Exception:
         return float("nan")
 
+def to_float_series(s: pd.Series) -> pd.Series:
+    # equivalente vectorizado de to_float (admite coma decimal en texto)
+    if s.dtype == object:
+        try:
+            # valores ya numéricos (p. ej. desde JSON): sin pasar por texto
+            return pd.to_numeric(s).astype("float64")
+        except (ValueError, TypeError):
+            pass
+    if s.dtype == object or pd.api.types.is_string_dtype(s):
+        s = s.astype("string").str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce").astype("float64")
+
+def duckdb_available() -> bool:
+    try:
+        import duckdb  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# columnas normalizadas de cualquier fuente (antes de FX)
+TX_COLUMNS = ["date","amount","currency","fee","source","type","status","reference"]
+
+# --------------------
+# Esquema de transacciones
+# --------------------
+# Las tres fuentes y el store comparten el mismo esquema en memoria:
+#   - date, reference: texto
+#   - currency (mayúsculas), source, type, status: category (pocas categorías)
+#   - amount, fee: Int64 en unidades menores de la moneda (céntimos); <NA> si falta
+# Los importes sólo pasan a float (unidades mayores) al consolidar y al escribir ficheros.
+
+TX_CATEGORIES = ["currency", "source", "type", "status"]
+TX_MINOR = ["amount", "fee"]
+# sube si cambia el esquema: invalida los frames guardados en csv_cache/
+TX_SCHEMA_VERSION = 2
+
+# decimales ISO 4217 de las monedas que no usan 2 (Stripe ya envía los importes en esta unidad)
+CURRENCY_DECIMALS = {
+    **{c: 0 for c in ("BIF", "CLP", "DJF", "GNF", "JPY", "KMF", "KRW", "MGA", "PYG", "RWF",
+                      "UGX", "VND", "VUV", "XAF", "XOF", "XPF")},
+    **{c: 3 for c in ("BHD", "IQD", "JOD", "KWD", "LYD", "OMR", "TND")},
+}
+
+def minor_scale(currency: pd.Series) -> np.ndarray:
+    """Unidades menores por unidad de cada fila (10 ** decimales de su moneda; 100 por defecto)."""
+    cat = currency.astype("category")
+    scales = np.array([10 ** CURRENCY_DECIMALS.get(str(c).upper(), 2) for c in cat.cat.categories] + [100],
+                      dtype="int64")
+    return scales[cat.cat.codes.to_numpy()]  # código -1 (sin moneda) -> último = 100
+
+def to_minor(values: pd.Series, currency: pd.Series) -> pd.Series:
+    """Importes en unidades mayores (número o texto, admite coma decimal) a Int64 en unidades menores."""
+    major = to_float_series(values).to_numpy(dtype="float64")
+    return pd.Series(np.rint(major * minor_scale(currency)), index=values.index).astype("Int64")
+
+def from_minor(minor: pd.Series, currency: pd.Series) -> np.ndarray:
+    """Int64 en unidades menores a float64 en unidades mayores (NaN si falta)."""
+    return minor.to_numpy(dtype="float64", na_value=np.nan) / minor_scale(currency)
+
+def tx_schema(df: pd.DataFrame, minor: bool = False) -> pd.DataFrame:
+    """
+    Frame con TX_COLUMNS en el esquema canónico. `amount`/`fee` llegan en unidades mayores
+    (float o texto) salvo con minor=True (enteros ya en unidades menores, p. ej. Stripe).
+    """
+    if df.empty:
+        return empty_tx()
+    currency = df["currency"].fillna("").astype(str).str.upper().astype("category")
+    out = {"date": df["date"].astype(str).where(df["date"].notna()),
+           "currency": currency}
+    for c in TX_MINOR:
+        out[c] = df[c].astype("Int64") if minor else to_minor(df[c], currency)
+    for c in ("source", "type", "status"):
+        out[c] = df[c].fillna("").astype(str).astype("category")
+    out["reference"] = df["reference"].fillna("").astype(str)
+    return pd.DataFrame(out, columns=TX_COLUMNS)
+
+def empty_tx() -> pd.DataFrame:
+    df = pd.DataFrame({c: pd.Series(dtype="Int64" if c in TX_MINOR else "category" if c in TX_CATEGORIES
+                                    else object) for c in TX_COLUMNS})
+    return df.astype({"date": str, "reference": str})
+
+def concat_tx(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """pd.concat que conserva las columnas category (unión de categorías) en lugar de pasar a object."""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return empty_tx()
+    if len(frames) > 1:
+        for c in frames[0].columns:
+            if all(isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames):
+                cats = union_categoricals([f[c] for f in frames]).categories
+                frames = [f.assign(**{c: f[c].cat.set_categories(cats)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def http_session(headers: Optional[Dict[str, str]] = None, pool_size: int = 4) -> requests.Session:
+    """
+    Sesión con keep-alive y pool de conexiones.
+    Los 429/5xx se reintentan respetando Retry-After.
+    """
+    s = requests.Session()
+    s.headers.update(headers or {})
+    retry = Retry(total=4, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
 # --------------------
 # FX (exchangerate.host)
 # --------------------
 
-def fetch_fx_timeseries(base: str, start: str, end: str, symbols: List[str]) -> Dict[str, float]:
+FX_COLUMNS = ["date", "currency", "rate"]
+
+# días hacia atrás que se acepta un tipo publicado (fines de semana, festivos)
+FX_MAX_STALENESS_DAYS = int(env("FX_MAX_STALENESS_DAYS", "7"))
+
+def fetch_fx_timeseries(base: str, start: str, end: str, symbols: List[str]) -> pd.DataFrame:
     """
-    Devuelve dict { 'USD': 1.09, 'GBP': 0.86, ... } para la fecha 'end' (último disponible).
-    Usamos exchangerate.host sin API key.
+    Serie diaria de tipos: DataFrame [date, currency, rate] con rate = valor de 1 unidad de
+    `currency` en la moneda base, para los días publicados entre `start` y `end`.
+    Usamos exchangerate.host sin API key. Los errores se propagan (nunca se inventa un tipo).
     """
     base = base.upper()
     url = f"{env('FX_API_URL','https://api.exchangerate.host')}/timeseries"
     params = {"base": base, "start_date": start, "end_date": end, "symbols": ",".join(sorted(set([s.upper() for s in symbols if s])))}
-    try:
-        r = requests.get(url, params=params, timeout=25)
-        r.raise_for_status()
-        data = r.json()
-        if not data.get("rates"):
-            return {}
-        last_day = sorted(data["rates"].keys())[-1]
-        rates = data["rates"][last_day]  # { 'USD': 1.09, ... } -> 1 BASE = rate * CURRENCY
-        # OJO: exchangerate.host devuelve tasas como "1 base = X currency"
-        # Para convertir MONEDA->BASE necesitamos 1 currency en base:
-        inv = {}
-        for ccy, rate in rates.items():
+    r = requests.get(url, params=params, timeout=25)
+    r.raise_for_status()
+    data = r.json()
+    if data.get("success") is False:
+        raise ValueError(f"respuesta de error de la API de FX: {data.get('error')}")
+    # OJO: exchangerate.host devuelve tasas como "1 base = X currency"
+    # Para convertir MONEDA->BASE necesitamos 1 currency en base: 1 / X
+    rows = [(day, ccy.upper(), rate)
+            for day, rates in (data.get("rates") or {}).items()
+            for ccy, rate in (rates or {}).items()]
+    fx = pd.DataFrame(rows, columns=FX_COLUMNS)
+    fx["date"] = pd.to_datetime(fx["date"], errors="coerce")
+    fx["rate"] = 1.0 / to_float_series(fx["rate"]).replace(0.0, np.nan)
+    return fx.dropna().reset_index(drop=True)
+
+def _day(d: str, delta: int = 0) -> str:
+    return (isoparse(d).date() + timedelta(days=delta)).isoformat()
+
+class FxStore:
+    """
+    Tipos de cambio persistidos en <outdir>/fx_store/:
+      - rates.csv: base, currency, date, rate (1 unidad de currency en la base)
+      - coverage.json: por base y moneda, rango de fechas ya consultado (incluye días sin publicación)
+    Sólo se piden a la API las fechas y monedas que faltan; sin red se trabaja con lo guardado.
+    El día de hoy nunca se da por cubierto (puede publicarse más tarde).
+    """
+    COLUMNS = ["base", "currency", "date", "rate"]
+
+    def __init__(self, root: str):
+        self.root = root
+        self.rates_path = os.path.join(root, "rates.csv")
+        self.coverage_path = os.path.join(root, "coverage.json")
+        self.rates = pd.DataFrame(columns=self.COLUMNS)
+        if os.path.exists(self.rates_path):
+            self.rates = pd.read_csv(self.rates_path, dtype={"base": str, "currency": str, "date": str},
+                                     float_precision="round_trip")
+        self.coverage: Dict[str, Dict[str, List[str]]] = {}
+        if os.path.exists(self.coverage_path):
+            with open(self.coverage_path, encoding="utf-8") as f:
+                self.coverage = json.load(f)
+
+    def missing(self, base: str, currencies: List[str], start: str, end: str) -> Dict[tuple, List[str]]:
+        """Rangos [desde, hasta] por pedir, con las monedas a las que les falta cada uno."""
+        out: Dict[tuple, List[str]] = {}
+        for ccy in currencies:
+            cov = self.coverage.get(base, {}).get(ccy)
+            if not cov:
+                ranges = [(start, end)]
+            else:
+                ranges = []
+                if start < cov[0]:
+                    ranges.append((start, _day(cov[0], -1)))
+                if end > cov[1]:
+                    ranges.append((max(start, _day(cov[1], 1)), end))
+            for rng in ranges:
+                out.setdefault(rng, []).append(ccy)
+        return out
+
+    def sync(self, base: str, currencies: List[str], start: str, end: str, offline: bool = False) -> int:
+        """Completa el store para [start, end]. Devuelve tipos nuevos descargados."""
+        currencies = sorted(set(c for c in currencies if c and c != base))
+        fetched = 0
+        today = utc_today_str()
+        for (s, e), ccys in sorted(self.missing(base, currencies, start, end).items()):
+            if offline:
+                continue
             try:
-                inv[ccy.upper()] = 1.0 / float(rate) if rate else float("nan")
-            except Exception:
-                inv[ccy.upper()] = float("nan")
-        inv[base] = 1.0
-        return inv
-    except Exception:
-        return {base: 1.0}
+                fx = fetch_fx_timeseries(base, s, e, ccys)
+            except Exception as ex:
+                print(f"[WARN] API de FX no disponible para {','.join(ccys)} {s} → {e} ({ex}); se usan los tipos guardados")
+                continue
+            self.add(base, fx)
+            fetched += len(fx)
+            covered_to = min(e, _day(today, -1))
+            if s <= covered_to:
+                for ccy in ccys:
+                    cov = self.coverage.setdefault(base, {}).get(ccy)
+                    # un único rango contiguo por moneda; si queda hueco se empieza de nuevo
+                    contiguous = cov and s <= _day(cov[1], 1) and covered_to >= _day(cov[0], -1)
+                    self.coverage[base][ccy] = [min(cov[0], s), max(cov[1], covered_to)] if contiguous \
+                        else [s, covered_to]
+        return fetched
+
+    def add(self, base: str, fx: pd.DataFrame):
+        if fx.empty:
+            return
+        new = pd.DataFrame({"base": base, "currency": fx["currency"].astype(str),
+                            "date": pd.to_datetime(fx["date"]).dt.strftime("%Y-%m-%d"), "rate": fx["rate"]})
+        df = pd.concat([f for f in (self.rates, new) if not f.empty], ignore_index=True)
+        self.rates = df.drop_duplicates(["base", "currency", "date"], keep="last").reset_index(drop=True)
+
+    def frame(self, base: str) -> pd.DataFrame:
+        """Tipos de una base en el formato de fx_asof: [date, currency, rate]."""
+        df = self.rates[self.rates["base"] == base]
+        return pd.DataFrame({"date": pd.to_datetime(df["date"]), "currency": df["currency"].astype(str),
+                             "rate": df["rate"].astype("float64")}, columns=FX_COLUMNS).reset_index(drop=True)
+
+    def asof(self, base: str, dates: pd.Series, currencies: pd.Series,
+             max_staleness_days: int = FX_MAX_STALENESS_DAYS) -> np.ndarray:
+        return fx_asof(dates, currencies, self.frame(base), base, max_staleness_days)
+
+    def save(self):
+        ensure_dirs(self.root)
+        tmp = self.rates_path + ".tmp"
+        self.rates.sort_values(["base", "currency", "date"]).to_csv(tmp, index=False)
+        os.replace(tmp, self.rates_path)
+        tmp = self.coverage_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.coverage, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.coverage_path)
 
 # --------------------
 # Stripe
 # --------------------
 
-def fetch_stripe_charges(api_key: str, start: str, end: str) -> pd.DataFrame:
+STRIPE_API_BASE = env("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_PAGE_SIZE = 100
+
+def stripe_session(api_key: str, pool_size: int = 4) -> requests.Session:
+    """Sesión compartida por los listados de Stripe (sustituye a las pausas fijas entre páginas)."""
+    return http_session({"Authorization": f"Bearer {api_key}"}, pool_size)
+
+def _stripe_list(session: requests.Session, url: str, params: Dict[str, Any]) -> List[dict]:
+    """Recorre un listado paginado de Stripe (starting_after) y devuelve todos los objetos."""
+    out: List[dict] = []
+    params = dict(params, limit=STRIPE_PAGE_SIZE)
+    while True:
+        r = session.get(url, params=params, timeout=25)
+        # un listado incompleto no debe darse por sincronizado: el error sube al llamador
+        r.raise_for_status()
+        data = r.json()
+        page = data.get("data", [])
+        out.extend(page)
+        if not data.get("has_more") or not page:
+            break
+        params["starting_after"] = page[-1]["id"]
+    return out
+
+def _stripe_fee(obj: dict) -> int:
+    # balance_transaction expandido (dict); si llega sólo el id no hay fee que leer
+    bt = obj.get("balance_transaction")
+    return bt.get("fee", 0) if isinstance(bt, dict) else 0
+
+def _stripe_rows(objs: List[dict], kind: str) -> pd.DataFrame:
+    if not objs:
+        return empty_tx()
+    df = pd.DataFrame({
+        "created": [o["created"] for o in objs],
+        "amount": [o.get("amount", 0) for o in objs],
+        "currency": [o.get("currency", "") for o in objs],
+        "fee": [_stripe_fee(o) for o in objs],
+        "status": [o.get("status", "") for o in objs],
+        "reference": [o.get("id", "") for o in objs],
+    })
+    # Stripe ya envía unidades menores de cada moneda (también en las de 0 o 3 decimales)
+    amount = df["amount"].astype("int64")
+    return tx_schema(pd.DataFrame({
+        "date": pd.to_datetime(df["created"], unit="s", utc=True).dt.strftime("%Y-%m-%d"),
+        "amount": amount if kind == "charge" else -amount.abs(),  # refunds en negativo
+        "currency": df["currency"],
+        "fee": df["fee"].astype("int64"),
+        "source": "stripe",
+        "type": kind,
+        "status": df["status"],
+        "reference": df["reference"],
+    }, columns=TX_COLUMNS), minor=True)
+
+def fetch_stripe_charges(api_key: str, start: str, end: str, api_base: str = "") -> pd.DataFrame:
     """
     Descarga cargos/refunds de Stripe entre fechas (UTC).
     Devuelve DF normalizado con columnas: date, amount, currency, fee, source, type, status, reference
+    Los fees vienen en la misma página (expand[]=data.balance_transaction) y cargos y refunds
+    se paginan en paralelo sobre una sesión compartida.
     """
     if not api_key:
-        return pd.DataFrame(columns=["date","amount","currency","fee","source","type","status","reference"])
+        return empty_tx()
 
     # Fechas a timestamps
     start_ts = int(datetime.fromisoformat(start).replace(tzinfo=timezone.utc).timestamp())
     end_dt = datetime.fromisoformat(end) + timedelta(days=1)  # inclusive
     end_ts = int(end_dt.replace(tzinfo=timezone.utc).timestamp())
+    created = {"created[gte]": start_ts, "created[lte]": end_ts}
+    api_base = (api_base or STRIPE_API_BASE).rstrip("/")
 
-    headers = {"Authorization": f"Bearer {api_key}"}
-    rows = []
+    with stripe_session(api_key) as session, ThreadPoolExecutor(max_workers=2) as pool:
+        charges = pool.submit(_stripe_list, session, f"{api_base}/v1/charges",
+                              dict(created, **{"expand[]": "data.balance_transaction"}))
+        refunds = pool.submit(_stripe_list, session, f"{api_base}/v1/refunds", created)
+        frames = [_stripe_rows(charges.result(), "charge"), _stripe_rows(refunds.result(), "refund")]
 
-    # 1) Charges
-    starting_after = None
-    while True:
-        params = {
-            "limit": 100,
-            "created[gte]": start_ts,
-            "created[lte]": end_ts
-        }
-        if starting_after:
-            params["starting_after"] = starting_after
-        r = requests.get("https://api.stripe.com/v1/charges", headers=headers, params=params, timeout=25)
-        if r.status_code >= 400:
-            break
-        data = r.json()
-        for ch in data.get("data", []):
-            amount = ch.get("amount", 0) / 100.0
-            fee = 0.0
-            # fees (si está balance_transaction)
-            bt = ch.get("balance_transaction")
-            if bt:
-                try:
-                    br = requests.get(f"https://api.stripe.com/v1/balance_transactions/{bt}", headers=headers, timeout=20)
-                    if br.status_code < 400:
-                        fee = br.json().get("fee", 0) / 100.0
-                except Exception:
-                    pass
-            rows.append({
-                "date": datetime.fromtimestamp(ch["created"], tz=timezone.utc).date().isoformat(),
-                "amount": amount,
-                "currency": str(ch.get("currency","")).upper(),
-                "fee": fee,
-                "source": "stripe",
-                "type": "charge",
-                "status": ch.get("status",""),
-                "reference": ch.get("id","")
-            })
-        if not data.get("has_more"):
-            break
-        starting_after = data["data"][-1]["id"]
-        time.sleep(0.3)
-
-    # 2) Refunds
-    starting_after = None
-    while True:
-        params = {"limit": 100, "created[gte]": start_ts, "created[lte]": end_ts}
-        if starting_after:
-            params["starting_after"] = starting_after
-        r = requests.get("https://api.stripe.com/v1/refunds", headers=headers, params=params, timeout=25)
-        if r.status_code >= 400:
-            break
-        data = r.json()
-        for rf in data.get("data", []):
-            rows.append({
-                "date": datetime.fromtimestamp(rf["created"], tz=timezone.utc).date().isoformat(),
-                "amount": -abs(rf.get("amount", 0)/100.0),  # negativo
-                "currency": str(rf.get("currency","")).upper(),
-                "fee": 0.0,
-                "source": "stripe",
-                "type": "refund",
-                "status": rf.get("status",""),
-                "reference": rf.get("id","")
-            })
-        if not data.get("has_more"):
-            break
-        starting_after = data["data"][-1]["id"]
-        time.sleep(0.3)
-
-    return pd.DataFrame(rows)
+    return concat_tx(frames)
 
 # --------------------
 # Fuente JSON genérica
 # --------------------
 
-def fetch_generic_json(url: str, bearer: str, start: str, end: str) -> pd.DataFrame:
+@dataclass
+class GenericJsonConfig:
+    """
+    Paginación de la fuente genérica (variables GENERIC_*):
+      - pagination: "" (una sola respuesta), "next" (enlace/cursor siguiente), "offset" o "page"
+      - items_key: clave con la lista si cada respuesta es un objeto ("" = la respuesta es la lista)
+      - next_key: clave del enlace/cursor siguiente en el cuerpo (también vale la cabecera Link rel="next");
+        si no es una URL se envía como `cursor_param`
+    """
+    pagination: str = ""
+    items_key: str = ""
+    next_key: str = "next"
+    cursor_param: str = "cursor"
+    offset_param: str = "offset"
+    page_param: str = "page"
+    limit_param: str = "limit"
+    page_size: int = 1000
+    max_pages: int = 10_000
+    since_param: str = ""
+
+    @classmethod
+    def from_env(cls) -> "GenericJsonConfig":
+        return cls(
+            pagination=env("GENERIC_PAGINATION").lower(),
+            items_key=env("GENERIC_ITEMS_KEY"),
+            next_key=env("GENERIC_NEXT_KEY", "next"),
+            cursor_param=env("GENERIC_CURSOR_PARAM", "cursor"),
+            offset_param=env("GENERIC_OFFSET_PARAM", "offset"),
+            page_param=env("GENERIC_PAGE_PARAM", "page"),
+            limit_param=env("GENERIC_LIMIT_PARAM", "limit"),
+            page_size=int(env("GENERIC_PAGE_SIZE", "1000")),
+            max_pages=int(env("GENERIC_MAX_PAGES", "10000")),
+            since_param=env("GENERIC_SINCE_PARAM"),
+        )
+
+# filas por lote al construir el DataFrame de la fuente genérica
+GENERIC_BATCH_ROWS = 50_000
+STREAM_CHUNK_SIZE = 64 * 1024
+_JSON_LEAD = re.compile(r"[\ufeff\s]*")
+_JSON_SEP = re.compile(r"[\s,]*")
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """
+    Objetos de un array JSON (`[{...}, {...}]`) según van llegando los bytes, sin cargar el documento entero.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf, pos, started, eof = "", 0, False, False
+
+    def more() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        piece = next(chunks, None)
+        if piece is None:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(piece)
+        pos = 0
+        return True
+
+    while True:
+        pos = (_JSON_SEP if started else _JSON_LEAD).match(buf, pos).end()
+        if pos >= len(buf):
+            if not more():
+                raise ValueError("JSON incompleto: falta el cierre del array")
+            continue
+        if started and buf[pos] == "]":
+            return
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("la respuesta no es un array JSON")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] != "{":
+            raise ValueError(f"elemento no esperado en el array: {buf[pos:pos + 20]!r}")
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # objeto partido entre bloques: se lee más y se reintenta
+            if not more():
+                raise
+            continue
+        pos = end
+        yield obj
+
+def _generic_frame(batch: Dict[str, list]) -> pd.DataFrame:
+    """Normaliza un lote de columnas de la fuente genérica (vectorizado)."""
+    df = pd.DataFrame(batch)
+    currency = df["currency"].fillna("").astype(str).str.upper()
+    return tx_schema(pd.DataFrame({
+        "date": df["date"],
+        "amount": df["amount"].astype(object),
+        "currency": currency.where(currency.ne(""), "EUR"),
+        "fee": df["fee"].astype(object),
+        "source": df["source"].fillna("generic"),
+        "type": df["type"].fillna("order"),
+        "status": df["status"],
+        "reference": df["reference"],
+    }, columns=TX_COLUMNS))
+
+class _Counted:
+    """Iterable que cuenta los elementos consumidos (para saber si una página vino incompleta)."""
+    def __init__(self, items: Iterable[dict]):
+        self.items = items
+        self.n = 0
+
+    def __iter__(self):
+        for o in self.items:
+            self.n += 1
+            yield o
+
+def _generic_pages(session: requests.Session, url: str, cfg: GenericJsonConfig,
+                   params: Dict[str, Any]) -> Iterator[Iterable[dict]]:
+    """Recorre las páginas; cada una se entrega como iterable de objetos (en streaming si es un array)."""
+    params = dict(params)
+    if cfg.pagination in ("offset", "page"):
+        params[cfg.limit_param] = cfg.page_size
+        params[cfg.offset_param if cfg.pagination == "offset" else cfg.page_param] = \
+            0 if cfg.pagination == "offset" else 1
+    for _ in range(cfg.max_pages):
+        with session.get(url, params=params, timeout=60, stream=True) as r:
+            r.raise_for_status()
+            if cfg.items_key:
+                body = r.json()
+                items = body.get(cfg.items_key) if isinstance(body, dict) else None
+                if not isinstance(items, list):
+                    raise ValueError(f"{url} no devolvió la lista '{cfg.items_key}'")
+                nxt = body.get(cfg.next_key)
+            else:
+                items = iter_json_array(r.iter_content(STREAM_CHUNK_SIZE))
+                nxt = None
+            counted = _Counted(items)
+            yield counted
+            link = r.links.get("next", {}).get("url")
+        if cfg.pagination == "next":
+            nxt = nxt or link
+            if not nxt:
+                return
+            if str(nxt).startswith(("http://", "https://")):
+                url, params = str(nxt), {}
+            else:
+                params[cfg.cursor_param] = nxt
+        elif cfg.pagination in ("offset", "page"):
+            if counted.n < cfg.page_size:
+                return
+            if cfg.pagination == "offset":
+                params[cfg.offset_param] += counted.n
+            else:
+                params[cfg.page_param] += 1
+        else:
+            return
+    raise ValueError(f"{url}: más de {cfg.max_pages} páginas (GENERIC_MAX_PAGES)")
+
+def fetch_generic_json(url: str, bearer: str, start: str, end: str, since: str = "",
+                       config: Optional[GenericJsonConfig] = None) -> pd.DataFrame:
     """
     Espera una lista de objetos tipo:
       { "date": "2024-07-01", "amount": 123.45, "currency": "USD",
         "fee": 2.1, "source": "shopify", "type": "order", "status":"paid", "reference":"A-1" }
-    Se filtra por rango de fechas en el cliente.
+    El array se parsea en streaming y se filtra por fecha según llega; las filas se normalizan
+    por lotes de columnas. Admite paginación (GenericJsonConfig). Con `since` y GENERIC_SINCE_PARAM
+    definido, se pide al servidor sólo lo creado/modificado desde esa fecha.
+    Los errores HTTP o de formato se propagan (el llamador decide si la sincronización avanza).
     """
     if not url:
-        return pd.DataFrame(columns=["date","amount","currency","fee","source","type","status","reference"])
+        return empty_tx()
+    cfg = config or GenericJsonConfig.from_env()
 
     headers = {"Accept": "application/json"}
     if bearer:
         headers["Authorization"] = f"Bearer {bearer}"
-    try:
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        arr = r.json()
-        if not isinstance(arr, list):
-            return pd.DataFrame()
-        norm = []
-        for o in arr:
-            d = {
-                "date": str(o.get("date",""))[:10],
-                "amount": to_float(o.get("amount")),
-                "currency": str(o.get("currency","")).upper() or "EUR",
-                "fee": to_float(o.get("fee")),
-                "source": str(o.get("source","generic")),
-                "type": str(o.get("type","order")),
-                "status": str(o.get("status","")),
-                "reference": str(o.get("reference",""))
-            }
-            # filtrar por fecha:
-            if d["date"] and start <= d["date"] <= end:
-                norm.append(d)
-        return pd.DataFrame(norm)
-    except Exception:
-        return pd.DataFrame()
+    params = {cfg.since_param: since} if since and cfg.since_param else {}
+
+    fields = TX_COLUMNS[1:]
+    batch: Dict[str, list] = {c: [] for c in TX_COLUMNS}
+    frames = []
+    with http_session(headers) as session:
+        for page in _generic_pages(session, url, cfg, params):
+            for o in page:
+                d = str(o.get("date", ""))[:10]
+                # filtrar por fecha antes de guardar nada
+                if not d or not (start <= d <= end):
+                    continue
+                batch["date"].append(d)
+                for c in fields:
+                    batch[c].append(o.get(c))
+                if len(batch["date"]) >= GENERIC_BATCH_ROWS:
+                    frames.append(_generic_frame(batch))
+                    batch = {c: [] for c in TX_COLUMNS}
+    if batch["date"]:
+        frames.append(_generic_frame(batch))
+    return concat_tx(frames)
 
 # --------------------
 # CSV locales
 # --------------------
 
-def load_local_csvs(data_dir: str, start: str, end: str) -> pd.DataFrame:
+# ficheros más grandes se leen por bloques de filas, filtrando fechas en cada bloque
+CSV_CHUNK_BYTES = int(env("CSV_CHUNK_MB", "64")) * 1024 * 1024
+CSV_CHUNK_ROWS = 500_000
+# bloques más pequeños cuando se leen en streaming hacia DuckDB (memoria acotada)
+CSV_STREAM_ROWS = 100_000
+# procesos para parsear CSV nuevos o modificados (0 = núcleos disponibles)
+CSV_WORKERS = int(env("CSV_WORKERS", "0")) or (os.cpu_count() or 1)
+
+def _file_signature(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def list_local_csvs(data_dir: str) -> List[str]:
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(n for n in os.listdir(data_dir) if n.lower().endswith(".csv"))
+
+def _normalize_csv(df: pd.DataFrame, cols: Dict[str, str], name: str, start: str, end: str) -> pd.DataFrame:
+    def pick(k): return df[cols[k]] if k in cols else None
+    out = pd.DataFrame({
+        "date": pd.to_datetime(pick("date")).dt.strftime("%Y-%m-%d"),
+        "amount": pick("amount"),
+        "currency": pick("currency"),
+        "fee": pick("fee") if "fee" in cols else 0.0,
+        "source": pick("source") if "source" in cols else name.replace(".csv",""),
+        "type": pick("type") if "type" in cols else "order",
+        "status": pick("status") if "status" in cols else "",
+        "reference": pick("reference") if "reference" in cols else "",
+    }, columns=TX_COLUMNS)
+    keep = out["date"] >= start
+    if end:
+        keep &= out["date"] <= end
+    return tx_schema(out[keep])
+
+def _csv_columns(path: str) -> Optional[Dict[str, str]]:
+    """Columna del fichero para cada columna normalizada; None sin date, amount y currency."""
+    header = pd.read_csv(path, nrows=0)
+    cols = {c.lower(): c for c in header.columns}
+    if not all(k in cols for k in ("date", "amount", "currency")):
+        return None
+    return {k: cols[k] for k in TX_COLUMNS if k in cols}
+
+def read_local_csv(path: str, start: str, end: str = "") -> Optional[pd.DataFrame]:
+    """
+    Un CSV con al menos columnas date, amount, currency (opcionales: fee, source, type, status, reference).
+    None si no tiene las columnas mínimas. Sin `end` no se acota por arriba.
+    Sólo se leen las columnas conocidas, con tipos explícitos (sin inferencia); los ficheros grandes por bloques.
+    """
+    name = os.path.basename(path)
+    cols = _csv_columns(path)
+    if cols is None:
+        return None
+    usecols = list(cols.values())
+    dtype = {c: str for c in usecols}
+    numeric = {cols[k]: "float64" for k in ("amount", "fee") if k in cols}
+    try:
+        # importes como float64 directamente; con coma decimal el parser falla y se leen como texto
+        return _read_csv_normalized(path, cols, name, start, end, usecols, {**dtype, **numeric})
+    except ValueError:
+        return _read_csv_normalized(path, cols, name, start, end, usecols, dtype)
+
+def _read_csv_normalized(path: str, cols: Dict[str, str], name: str, start: str, end: str,
+                         usecols: List[str], dtype: Dict[str, Any]) -> pd.DataFrame:
+    if os.path.getsize(path) > CSV_CHUNK_BYTES:
+        parts = [_normalize_csv(chunk, cols, name, start, end)
+                 for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=CSV_CHUNK_ROWS)]
+        return concat_tx(parts)
+    df = pd.read_csv(path, usecols=usecols, dtype=dtype)
+    return _normalize_csv(df, cols, name, start, end).reset_index(drop=True)
+
+def iter_local_csv(path: str, start: str, end: str = "",
+                   chunk_rows: int = CSV_STREAM_ROWS) -> Optional[Iterator[pd.DataFrame]]:
+    """
+    Como read_local_csv pero por bloques de `chunk_rows` filas ya normalizados, sin juntar
+    el fichero en memoria (motor DuckDB). None si no es un CSV de transacciones.
+    """
+    cols = _csv_columns(path)
+    if cols is None:
+        return None
+    name = os.path.basename(path)
+
+    def chunks():
+        # importes como texto: una coma decimal en un bloque tardío no obliga a releer el fichero
+        for chunk in pd.read_csv(path, usecols=list(cols.values()), dtype=str, chunksize=chunk_rows):
+            out = _normalize_csv(chunk, cols, name, start, end)
+            if not out.empty:
+                yield out.reset_index(drop=True)
+    return chunks()
+
+def file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _parse_csv_job(path: str, start: str):
+    # en un proceso aparte: devuelve (hash, frame | None) o la excepción para el llamador
+    try:
+        return file_hash(path), read_local_csv(path, start)
+    except Exception as e:
+        return None, e
+
+def parse_csv_files(paths: List[str], start: str, workers: int = CSV_WORKERS) -> Dict[str, tuple]:
+    """(hash, frame | None | excepción) por ruta; con varios ficheros se parsean en un pool de procesos."""
+    if len(paths) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            return dict(zip(paths, pool.map(_parse_csv_job, paths, [start] * len(paths))))
+    return {p: _parse_csv_job(p, start) for p in paths}
+
+class CsvCache:
+    """
+    Frames normalizados de cada CSV en <outdir>/csv_cache/ (pickle), con clave ruta + tamaño + mtime + hash
+    (y versión del esquema).
+    Si cambia el mtime pero no el contenido se reutiliza igual. Cada entrada guarda la fecha
+    mínima con que se leyó: sirve para cualquier ventana que empiece ese día o después.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.index: Dict[str, dict] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, path: str, start: str) -> Optional[pd.DataFrame]:
+        e = self.index.get(path)
+        if not e or e["start"] > start or e.get("schema") != TX_SCHEMA_VERSION:
+            return None
+        size, mtime = _file_signature(path)
+        if e["size"] != size:
+            return None
+        if e["mtime_ns"] != mtime:
+            if file_hash(path) != e["hash"]:
+                return None
+            e["mtime_ns"] = mtime
+        frame_path = os.path.join(self.root, e["file"])
+        if not os.path.exists(frame_path):
+            return None
+        df = pd.read_pickle(frame_path)
+        return df[df["date"] >= start].reset_index(drop=True)
+
+    def load(self, paths: List[str], start: str, workers: int = CSV_WORKERS) -> Dict[str, Any]:
+        """Frame (o None si no es un CSV de transacciones, o la excepción al leerlo) por ruta."""
+        out: Dict[str, Any] = {}
+        pending = []
+        for p in paths:
+            key = os.path.abspath(p)
+            df = self._lookup(key, start)
+            if df is not None:
+                out[p] = df
+                self.hits += 1
+            else:
+                pending.append(p)
+        self.misses += len(pending)
+        sigs = {p: _file_signature(p) for p in pending}
+        for p, (h, df) in parse_csv_files(pending, start, workers).items():
+            out[p] = df
+            if isinstance(df, pd.DataFrame):
+                ensure_dirs(self.root)
+                name = f"{h}.pkl"
+                df.to_pickle(os.path.join(self.root, name))
+                self.index[os.path.abspath(p)] = {"size": sigs[p][0], "mtime_ns": sigs[p][1], "hash": h,
+                                                  "start": start, "file": name, "schema": TX_SCHEMA_VERSION}
+        return out
+
+    def save(self):
+        # fuera las entradas de ficheros que ya no existen y los pickles huérfanos
+        self.index = {p: e for p, e in self.index.items() if os.path.exists(p)}
+        if not os.path.isdir(self.root):
+            return
+        used = {e["file"] for e in self.index.values()}
+        for name in os.listdir(self.root):
+            if name.endswith(".pkl") and name not in used:
+                os.remove(os.path.join(self.root, name))
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+def load_local_csvs(data_dir: str, start: str, end: str, cache: Optional[CsvCache] = None) -> pd.DataFrame:
     """
     Admite cualquier CSV que tenga al menos columnas:
       date, amount, currency
     Opcionales: fee, source, type, status, reference
     """
-    rows = []
-    if not os.path.isdir(data_dir):
-        return pd.DataFrame()
-    for name in os.listdir(data_dir):
-        if not name.lower().endswith(".csv"):
-            continue
-        path = os.path.join(data_dir, name)
+    paths = [os.path.join(data_dir, n) for n in list_local_csvs(data_dir)]
+    if cache is not None:
+        loaded = cache.load(paths, start)
+    else:
+        loaded = {p: df for p, (_, df) in parse_csv_files(paths, start).items()}
+    return concat_tx([df[df["date"] <= end] for df in loaded.values() if isinstance(df, pd.DataFrame)])
+
+# --------------------
+# Store de transacciones (sincronización incremental)
+# --------------------
+
+# días que se vuelven a pedir antes de la última marca (cambios de estado, llegadas tardías)
+SYNC_OVERLAP_DAYS = int(env("SYNC_OVERLAP_DAYS", "3"))
+# los CSV se guardan sin cota superior: un fichero sin cambios no hace falta releerlo
+OPEN_END = "9999-12-31"
+
+class TxStore:
+    """
+    Transacciones normalizadas (antes de FX) de todas las fuentes en <outdir>/tx_store/:
+      - transactions.csv: una fila por transacción, clave (source, reference), con su origen
+      - sync_state.json: por origen (stripe, generic, csv:<fichero>) el rango ya sincronizado
+        [from, through] y, para CSV, tamaño y mtime del fichero leído
+    Cada ejecución pide sólo el delta de cada origen y lo integra; las salidas salen del store.
+    """
+    # DuckTxStore recibe los CSV por bloques en lugar de frames completos
+    streaming = False
+
+    def __init__(self, root: str):
+        self.root = root
+        self.path = os.path.join(root, "transactions.csv")
+        self.state_path = os.path.join(root, "sync_state.json")
+        self.df = self._read()
+        self.state = self._read_state()
+
+    def _read_state(self) -> Dict[str, dict]:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read(self) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return empty_tx().assign(_origin=pd.Series(dtype="category"))
+        # en disco los importes van en unidades mayores (legible y estable entre versiones)
+        text = {c: str for c in ("date", "reference")}
+        text.update({c: "category" for c in TX_CATEGORIES + ["_origin"]})
+        df = pd.read_csv(self.path, dtype=text, keep_default_na=False, na_values={"amount": [""], "fee": [""]},
+                         float_precision="round_trip")
+        for c in TX_MINOR:
+            df[c] = to_minor(df[c], df["currency"])
+        return df[TX_COLUMNS + ["_origin"]]
+
+    def reset(self):
+        self.df = self.df.iloc[0:0]
+        self.state = {}
+
+    def plan(self, origin: str, start: str, overlap_days: int = SYNC_OVERLAP_DAYS) -> str:
+        """Fecha desde la que hay que volver a pedir `origin` (start si no hay nada sincronizado antes)."""
+        st = self.state.get(origin)
+        if not st or start < st["from"]:
+            return start
+        resume = (isoparse(st["through"]).date() - timedelta(days=overlap_days)).isoformat()
+        return max(start, resume)
+
+    def mark(self, origin: str, start: str, through: str, **extra):
+        st = self.state.get(origin)
+        contiguous = st and (isoparse(start).date() - timedelta(days=1)).isoformat() <= st["through"]
+        self.state[origin] = {
+            "from": min(st["from"], start) if contiguous else start,
+            "through": max(st["through"], through) if contiguous else through,
+            **extra,
+        }
+
+    def _merge(self, base: pd.DataFrame, rows: pd.DataFrame, origin: str):
+        # rows ya viene en el esquema canónico (tx_schema) desde cada fuente
+        rows = rows[TX_COLUMNS].assign(_origin=pd.Categorical([origin] * len(rows)))
+        df = concat_tx([base, rows]) if not rows.empty else base
+        # clave (source, reference): gana la última versión; sin reference no hay clave
+        dup = df["reference"].ne("") & df.duplicated(["source", "reference"], keep="last")
+        self.df = df[~dup].reset_index(drop=True)
+
+    def replace(self, origin: str, start: str, end: str, rows: pd.DataFrame):
+        """El origen devolvió todo lo de [start, end]: lo anterior de ese rango se sustituye."""
+        mine = self.df["_origin"].eq(origin) & self.df["date"].between(start, end)
+        self._merge(self.df[~mine], rows, origin)
+
+    def upsert(self, origin: str, rows: pd.DataFrame):
+        """El origen devolvió sólo lo nuevo o modificado: se inserta/actualiza por clave."""
+        self._merge(self.df, rows, origin)
+
+    def replace_origin(self, origin: str, start: str, end: str, rows: pd.DataFrame) -> int:
+        """Sustituye todo lo del origen (p. ej. un CSV que ha cambiado). Devuelve filas recibidas."""
+        self.drop_origin(origin)
+        self.replace(origin, start, end, rows)
+        return len(rows)
+
+    def drop_origin(self, origin: str):
+        self.df = self.df[self.df["_origin"].ne(origin)].reset_index(drop=True)
+        self.state.pop(origin, None)
+
+    def window(self, start: str, end: str) -> pd.DataFrame:
+        out = self.df[self.df["date"].between(start, end)]
+        return out.sort_values("date", kind="stable")[TX_COLUMNS].reset_index(drop=True)
+
+    def save(self):
+        ensure_dirs(self.root)
+        tmp = self.path + ".tmp"
+        self.df.assign(**{c: from_minor(self.df[c], self.df["currency"]) for c in TX_MINOR}).to_csv(tmp, index=False)
+        os.replace(tmp, self.path)
+        self._save_state()
+
+    def close(self):
+        pass
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+def sync_sources(store: TxStore, data_dir: str, start: str, end: str,
+                 csv_cache: Optional[CsvCache] = None) -> Dict[str, int]:
+    """
+    Trae el delta de cada origen al store. Si un origen falla, su marca no avanza
+    (se reintenta entero en la siguiente ejecución) y se sigue con los datos que ya había.
+    Devuelve filas recibidas por origen.
+    """
+    synced: Dict[str, int] = {}
+
+    def attempt(origin: str, fn):
         try:
-            df = pd.read_csv(path)
-            cols = {c.lower(): c for c in df.columns}
-            def pick(k): return cols.get(k, None)
-            date_col = pick("date")
-            amount_col = pick("amount")
-            currency_col = pick("currency")
-            if not date_col or not amount_col or not currency_col:
-                continue
-            df_out = pd.DataFrame({
-                "date": pd.to_datetime(df[date_col]).dt.date.astype(str),
-                "amount": df[amount_col].apply(to_float),
-                "currency": df[currency_col].astype(str).str.upper()
-            })
-            df_out["fee"] = df[pick("fee")] if pick("fee") else 0.0
-            df_out["source"] = df[pick("source")] if pick("source") else name.replace(".csv","")
-            df_out["type"] = df[pick("type")] if pick("type") else "order"
-            df_out["status"] = df[pick("status")] if pick("status") else ""
-            df_out["reference"] = df[pick("reference")] if pick("reference") else ""
-
-            df_out = df_out[(df_out["date"]>=start) & (df_out["date"]<=end)]
-            rows.append(df_out)
-        except Exception:
-            continue
-    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+            synced[origin] = fn()
+        except Exception as e:
+            print(f"[WARN] Sincronización de {origin} fallida ({e}); se usan los datos guardados")
+
+    # 1) Stripe: ventana completa la primera vez, luego desde la última marca menos el solape
+    stripe_key = env("STRIPE_API_KEY")
+    if stripe_key:
+        def stripe():
+            since = store.plan("stripe", start)
+            rows = fetch_stripe_charges(stripe_key, since, end)
+            store.replace("stripe", since, end, rows)
+            store.mark("stripe", since, end)
+            return len(rows)
+        attempt("stripe", stripe)
+
+    # 2) JSON genérico: con GENERIC_SINCE_PARAM sólo llega lo modificado desde la marca (upsert);
+    #    sin él el endpoint devuelve siempre la lista completa y se sustituye toda la ventana
+    gen_url = env("GENERIC_JSON_URL")
+    if gen_url:
+        def generic():
+            since = store.plan("generic", start) if GenericJsonConfig.from_env().since_param else start
+            rows = fetch_generic_json(gen_url, env("GENERIC_BEARER_TOKEN"), start, end,
+                                      since=since if since > start else "")
+            if since > start:
+                store.upsert("generic", rows)
+            else:
+                store.replace("generic", start, end, rows)
+            store.mark("generic", start, end)
+            return len(rows)
+        attempt("generic", generic)
+
+    # 3) CSV locales: sólo se releen los ficheros nuevos o modificados (caché + pool de procesos)
+    present, pending = set(), []
+    for name in list_local_csvs(data_dir):
+        origin = f"csv:{name}"
+        present.add(origin)
+        path = os.path.join(data_dir, name)
+        sig = _file_signature(path)
+        st = store.state.get(origin)
+        if st and st.get("signature") == sig and start >= st["from"]:
+            synced[origin] = 0
+        else:
+            pending.append((origin, path, sig))
+    if store.streaming:
+        loaded = {}  # cada fichero se lee por bloques dentro de su intento
+    elif csv_cache is not None:
+        loaded = csv_cache.load([p for _, p, _ in pending], start)
+    else:
+        loaded = {p: df for p, (_, df) in parse_csv_files([p for _, p, _ in pending], start).items()}
+    for origin, path, sig in pending:
+        def local(origin=origin, path=path, sig=sig):
+            rows = iter_local_csv(path, start) if store.streaming else loaded[path]
+            if isinstance(rows, Exception):
+                raise rows
+            if rows is None:
+                store.drop_origin(origin)
+                return 0
+            # el fichero cambió (o la ventana empieza antes): se sustituye todo lo suyo
+            n = store.replace_origin(origin, start, OPEN_END, rows)
+            store.mark(origin, start, OPEN_END, signature=sig)
+            return n
+        attempt(origin, local)
+    for origin in [o for o in store.state if o.startswith("csv:") and o not in present]:
+        store.drop_origin(origin)
+
+    return synced
 
 # --------------------
 # Consolidación + KPIs
 # --------------------
 
-def consolidate(transactions: pd.DataFrame, base_ccy: str, fx_rates: Dict[str,float]) -> pd.DataFrame:
-    df = transactions.copy()
-    if df.empty:
-        return df
-    df["fee"] = df.get("fee", 0.0).apply(to_float).fillna(0.0)
-    df["amount_base"] = df.apply(lambda r: r["amount"] * fx_rates.get(str(r["currency"]).upper(), float("nan")), axis=1)
-    df["fee_base"] = df["fee"] * df.apply(lambda r: fx_rates.get(str(r["currency"]).upper(), float("nan")), axis=1)
-    df["base_currency"] = base_ccy
-    return df
+def fx_asof(dates: pd.Series, currencies: pd.Series, fx: pd.DataFrame, base_ccy: str,
+            max_staleness_days: int = FX_MAX_STALENESS_DAYS) -> np.ndarray:
+    """
+    Tipo de cada transacción: el último publicado para su moneda en su fecha o antes
+    (como mucho `max_staleness_days` antes). La moneda base siempre vale 1.0. NaN si no hay tipo.
+    """
+    d = pd.to_datetime(dates, errors="coerce", format="mixed").to_numpy(dtype="datetime64[ns]")
+    ccy = currencies.astype("string").str.upper().to_numpy(dtype=object, na_value="")
+    rate = np.full(len(d), np.nan)
+    rate[ccy == base_ccy] = 1.0
+
+    need = np.flatnonzero((ccy != base_ccy) & ~np.isnat(d))
+    if len(need) and not fx.empty:
+        left = pd.DataFrame({"date": d[need], "currency": ccy[need], "_pos": need})
+        left = left.astype({"currency": str}).sort_values("date", kind="stable")
+        right = fx[FX_COLUMNS].astype({"date": "datetime64[ns]", "currency": str}).sort_values("date", kind="stable")
+        joined = pd.merge_asof(left, right, on="date", by="currency", direction="backward",
+                               tolerance=pd.Timedelta(days=max_staleness_days))
+        rate[joined["_pos"].to_numpy()] = joined["rate"].to_numpy(dtype="float64")
+    return rate
+
+def consolidate(transactions: pd.DataFrame, base_ccy: str, fx: pd.DataFrame) -> pd.DataFrame:
+    """Transacciones (esquema canónico) en la moneda base; aquí los importes pasan a float."""
+    if transactions.empty:
+        return transactions.copy()
+    df = transactions[TX_COLUMNS]
+    amount = from_minor(df["amount"], df["currency"])
+    fee = np.nan_to_num(from_minor(df["fee"], df["currency"]), nan=0.0)
+    # importe y fee con el mismo tipo (una sola búsqueda por transacción)
+    rate = fx_asof(df["date"], df["currency"], fx, base_ccy)
+    return df.assign(amount=amount, fee=fee, fx_rate=rate, amount_base=amount * rate, fee_base=fee * rate,
+                     base_currency=base_ccy)
+
+def missing_fx_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Monedas sin tipo de cambio aplicable: número de transacciones, importe afectado y rango de fechas.
+    """
+    if df.empty or "fx_rate" not in df:
+        return pd.DataFrame(columns=["currency", "transactions", "amount", "first_date", "last_date"])
+    miss = df[df["fx_rate"].isna()]
+    return (miss.groupby("currency", observed=True)
+                .agg(transactions=("amount", "size"), amount=("amount", "sum"),
+                     first_date=("date", "min"), last_date=("date", "max"))
+                .reset_index())
+
+KPI_SUMS = ["gross_sales_base", "refunds_base", "fees_base"]
+
+def _kpi_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # columnas separadas por signo: así todo se agrega con un único sum() vectorizado
+    amount = df["amount_base"]
+    out = pd.DataFrame({
+        "ds": pd.to_datetime(df["date"], errors="coerce", format="mixed").dt.normalize(),
+        "source": df["source"],
+        "gross_sales_base": amount.where(amount > 0, 0.0),
+        "refunds_base": (-amount).where(amount < 0, 0.0),  # positivo
+        "fees_base": df["fee_base"].fillna(0.0),
+    })
+    return out[out["ds"].notna()]
+
+def _aggregate_by_source(df: pd.DataFrame) -> pd.DataFrame:
+    # dropna=False: las filas sin fuente cuentan en el diario aunque no salgan en by_source
+    by_src = _kpi_frame(df).groupby(["ds", "source"], sort=True, dropna=False, observed=True)[KPI_SUMS].sum() \
+        .reset_index()
+    by_src["source"] = by_src["source"].astype(object)  # tabla pequeña: texto como la leída del store
+    by_src["net_revenue_base"] = by_src["gross_sales_base"] - by_src["refunds_base"] - by_src["fees_base"]
+    return by_src
+
+def _kpi_tables(by_src: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    if by_src.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    kpi = by_src.groupby("ds")[KPI_SUMS].sum()
+    # todos los días entre el primero y el último, también los que no tienen transacciones
+    kpi = kpi.reindex(pd.date_range(kpi.index.min(), kpi.index.max(), freq="D", name="ds"), fill_value=0.0)
+    kpi["net_revenue_base"] = kpi["gross_sales_base"] - kpi["refunds_base"] - kpi["fees_base"]
+    kpi = kpi.reset_index()
+    return kpi, by_src[by_src["source"].notna()].reset_index(drop=True)
 
 def compute_kpis(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
     if df.empty:
         return pd.DataFrame(), pd.DataFrame()
-    df["date"] = pd.to_datetime(df["date"])
-    # Cargos positivos (ventas), negativos = devoluciones
-    grp = df.groupby(pd.Grouper(key="date", freq="D"))
-    kpi = pd.DataFrame({
-        "gross_sales_base": grp["amount_base"].apply(lambda s: s[s>0].sum()),
-        "refunds_base": grp["amount_base"].apply(lambda s: -s[s<0].sum()),  # positivo
-        "fees_base": grp["fee_base"].sum()
-    }).fillna(0.0)
-    kpi["net_revenue_base"] = kpi["gross_sales_base"] - kpi["refunds_base"] - kpi["fees_base"]
-    kpi = kpi.reset_index().rename(columns={"date":"ds"})
+    return _kpi_tables(_aggregate_by_source(df))
 
-    by_src = df.groupby([pd.Grouper(key="date", freq="D"), "source"]).agg(
-        gross_sales_base=("amount_base", lambda s: s[s>0].sum()),
-        refunds_base=("amount_base", lambda s: -s[s<0].sum()),
-        fees_base=("fee_base","sum"),
-    ).fillna(0.0).reset_index().rename(columns={"date":"ds"})
+class KpiStore:
+    """
+    KPIs por día y fuente persistidos en <outdir>/kpi_store/:
+      - by_source.csv: sumas por (ds, source)
+      - days.csv: huella por día de las transacciones que lo forman (filas + hash)
+    En cada ejecución sólo se recalculan y sustituyen los días cuya huella ha cambiado
+    (transacciones nuevas, modificadas o desaparecidas); el resto se reutiliza.
+    """
+    DAY_COLUMNS = ["ds", "rows", "h1", "h2"]
 
-    by_src["net_revenue_base"] = by_src["gross_sales_base"] - by_src["refunds_base"] - by_src["fees_base"]
-    return kpi, by_src
+    def __init__(self, root: str):
+        self.root = root
+        self.by_source_path = os.path.join(root, "by_source.csv")
+        self.days_path = os.path.join(root, "days.csv")
+        self.by_source = self._read(self.by_source_path, ["ds", "source"] + KPI_SUMS + ["net_revenue_base"])
+        self.days = self._read(self.days_path, self.DAY_COLUMNS)
+
+    @staticmethod
+    def _read(path: str, columns: List[str]) -> pd.DataFrame:
+        if not os.path.exists(path):
+            df = pd.DataFrame(columns=columns)
+            df["ds"] = pd.to_datetime(df["ds"])
+            return df
+        df = pd.read_csv(path, float_precision="round_trip")
+        df["ds"] = pd.to_datetime(df["ds"])
+        return df
+
+    @staticmethod
+    def fingerprints(df: pd.DataFrame) -> pd.DataFrame:
+        """Por día: número de filas y suma de los hashes de fila (en dos mitades de 32 bits, sin desbordes)."""
+        frame = _kpi_frame(df)
+        h = pd.util.hash_pandas_object(frame[["ds", "source"] + KPI_SUMS], index=False).to_numpy()
+        parts = pd.DataFrame({"ds": frame["ds"].to_numpy(),
+                              "h1": (h >> np.uint64(32)).astype(np.int64),
+                              "h2": (h & np.uint64(0xFFFFFFFF)).astype(np.int64)})
+        return parts.groupby("ds").agg(rows=("h1", "size"), h1=("h1", "sum"), h2=("h2", "sum")).reset_index()
+
+    def touched_days(self, df: pd.DataFrame, start: str, end: str) -> pd.DatetimeIndex:
+        return self.touched_from(self.fingerprints(df) if not df.empty else None, start, end)
+
+    def touched_from(self, fingerprints: Optional[pd.DataFrame], start: str, end: str) -> pd.DatetimeIndex:
+        """Días de la ventana cuya huella difiere de la guardada (huellas ya calculadas, p. ej. en DuckDB)."""
+        new = fingerprints.set_index("ds") if fingerprints is not None and not fingerprints.empty else \
+            pd.DataFrame(columns=self.DAY_COLUMNS[1:], index=pd.DatetimeIndex([], name="ds"))
+        old = self.days[(self.days["ds"] >= start) & (self.days["ds"] <= end)].set_index("ds")
+        both = new.join(old, how="outer", rsuffix="_old")
+        changed = pd.Series(False, index=both.index)
+        for c in self.DAY_COLUMNS[1:]:
+            changed |= ~both[c].eq(both[f"{c}_old"])  # NaN en un lado = día nuevo o desaparecido
+        return pd.DatetimeIndex(both.index[changed])
+
+    def reset(self):
+        self.by_source = self.by_source.iloc[0:0]
+        self.days = self.days.iloc[0:0]
 
-def write_summary(path_md: str, start: str, end: str, base: str, kpi: pd.DataFrame, by_src: pd.DataFrame):
+    def upsert(self, df: pd.DataFrame, days: pd.DatetimeIndex):
+        """Recalcula sólo `days` a partir de las transacciones de esos días."""
+        if len(days) == 0:
+            return
+        ds = pd.to_datetime(df["date"], errors="coerce", format="mixed").dt.normalize() if not df.empty else None
+        rows = df[ds.isin(days)] if ds is not None else df
+        if rows.empty:
+            self.replace_days(None, None, days)
+        else:
+            self.replace_days(_aggregate_by_source(rows), self.fingerprints(rows), days)
+
+    def replace_days(self, by_source: Optional[pd.DataFrame], fingerprints: Optional[pd.DataFrame],
+                     days: pd.DatetimeIndex):
+        """Sustituye `days` por sumas y huellas ya agregadas (sólo de esos días)."""
+        keep_src = self.by_source[~self.by_source["ds"].isin(days)]
+        keep_days = self.days[~self.days["ds"].isin(days)]
+        frames_src = [keep_src]
+        frames_days = [keep_days]
+        if by_source is not None and not by_source.empty:
+            frames_src.append(by_source)
+            frames_days.append(fingerprints)
+        self.by_source = pd.concat([f for f in frames_src if not f.empty] or [keep_src], ignore_index=True) \
+            .sort_values(["ds", "source"], kind="stable", na_position="last").reset_index(drop=True)
+        self.days = pd.concat([f for f in frames_days if not f.empty] or [keep_days], ignore_index=True) \
+            .sort_values("ds", kind="stable").reset_index(drop=True)
+
+    def tables(self, start: str, end: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+        window = self.by_source[(self.by_source["ds"] >= start) & (self.by_source["ds"] <= end)]
+        return _kpi_tables(window.reset_index(drop=True))
+
+    def save(self):
+        ensure_dirs(self.root)
+        for df, path in ((self.by_source, self.by_source_path), (self.days, self.days_path)):
+            tmp = path + ".tmp"
+            df.to_csv(tmp, index=False, date_format="%Y-%m-%d")
+            os.replace(tmp, path)
+
+# --------------------
+# Motor DuckDB (fuera de memoria)
+# --------------------
+
+# memoria máxima del motor DuckDB; lo que no cabe se vuelca a disco
+DUCKDB_MEMORY_LIMIT = env("DUCKDB_MEMORY_LIMIT", "1GB")
+_TX_TEXT = ["date", "currency", "source", "type", "status", "reference"]
+
+def _sql_str(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _csv_select(columns: List[str], text: List[str], minor: Iterable[str] = ()) -> str:
+    # '' como campo vacío (DuckDB lo escribiría entre comillas) e importes `minor` en unidades mayores:
+    # mismo CSV que pandas
+    return ", ".join(f"NULLIF({c}, '') AS {c}" if c in text else
+                     f"{c} / {_minor_scale_sql()} AS {c}" if c in minor else c for c in columns)
+
+def _minor_scale_sql(col: str = "currency") -> str:
+    """minor_scale() en SQL."""
+    cases = " ".join(f"WHEN '{c}' THEN {10 ** d}" for c, d in sorted(CURRENCY_DECIMALS.items()))
+    return f"(CASE upper({col}) {cases} ELSE 100 END)"
+
+class DuckTxStore(TxStore):
+    """
+    TxStore sobre DuckDB para volúmenes que no caben en memoria (--engine duckdb).
+    Mismo formato en disco: transactions.csv se carga en una base de trabajo
+    (tx_store/.work.duckdb) con memoria limitada y se reescribe al guardar. Los CSV
+    se integran por bloques y la consolidación y los KPIs se calculan en SQL (DuckConsolidation).
+    """
+    streaming = True
+
+    def __init__(self, root: str, memory_limit: str = DUCKDB_MEMORY_LIMIT):
+        import duckdb
+        self.root = root
+        self.path = os.path.join(root, "transactions.csv")
+        self.state_path = os.path.join(root, "sync_state.json")
+        self.state = self._read_state()
+        self.work_path = os.path.join(root, ".work.duckdb")
+        ensure_dirs(root)
+        self._remove_work()
+        self.con = duckdb.connect(self.work_path, config={
+            "memory_limit": memory_limit,
+            "temp_directory": os.path.join(root, ".duckdb_tmp"),
+            "preserve_insertion_order": True,
+        })
+        self.con.execute("CREATE TABLE tx (date VARCHAR, amount BIGINT, currency VARCHAR, fee BIGINT, "
+                         "source VARCHAR, type VARCHAR, status VARCHAR, reference VARCHAR, "
+                         "_origin VARCHAR, _seq BIGINT)")
+        if os.path.exists(self.path):
+            types = ", ".join(f"'{c}': '{'DOUBLE' if c in ('amount', 'fee') else 'VARCHAR'}'"
+                              for c in TX_COLUMNS + ["_origin"])
+            # importes a unidades menores como to_minor (redondeo a par)
+            cols = ", ".join(f"COALESCE({c}, '')" if c in _TX_TEXT + ["_origin"] else
+                             f"CAST(round_even({c} * {_minor_scale_sql()}, 0) AS BIGINT)"
+                             for c in TX_COLUMNS + ["_origin"])
+            self.con.execute(f"INSERT INTO tx SELECT {cols}, NULL FROM read_csv({_sql_str(self.path)}, "
+                             f"header = true, delim = ',', quote = '\"', escape = '\"', "
+                             f"auto_detect = false, columns = {{{types}}})")
+            # orden del fichero = orden de llegada (desempate de "gana la última versión")
+            self.con.execute("UPDATE tx SET _seq = rowid")
+        self._next_seq = self.con.execute("SELECT COALESCE(max(_seq) + 1, 0) FROM tx").fetchone()[0]
+
+    def _remove_work(self):
+        for path in (self.work_path, self.work_path + ".wal"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _prepare(self, rows: pd.DataFrame, origin: str) -> pd.DataFrame:
+        # rows en el esquema canónico; importes tal cual (Int64 en unidades menores -> BIGINT)
+        rows = rows[TX_COLUMNS].reset_index(drop=True)
+        out = pd.DataFrame({
+            "date": rows["date"].astype("string"),
+            "amount": rows["amount"],
+            "currency": rows["currency"].astype(str),
+            "fee": rows["fee"],
+            **{c: rows[c].astype(str) for c in ("source", "type", "status", "reference")},
+            "_origin": origin,
+            "_seq": np.arange(self._next_seq, self._next_seq + len(rows), dtype="int64"),
+        })
+        self._next_seq += len(rows)
+        return out
+
+    def _merge(self, origin: str, rows, where: str = "") -> int:
+        """
+        En una transacción: borra lo del origen que cumpla `where`, añade `rows` (frame o bloques)
+        y deja una fila por (source, reference), la última en llegar.
+        """
+        chunks = [rows] if isinstance(rows, pd.DataFrame) else rows
+        con = self.con
+        # el delta se acumula fuera de la transacción: lo no confirmado no se vuelca a disco
+        con.execute("CREATE OR REPLACE TABLE _delta AS SELECT * FROM tx LIMIT 0")
+        try:
+            n = 0
+            for chunk in chunks:
+                if chunk is None or chunk.empty:
+                    continue
+                con.register("_chunk", self._prepare(chunk, origin))
+                con.execute("INSERT INTO _delta BY NAME SELECT * FROM _chunk")
+                con.unregister("_chunk")
+                n += len(chunk)
+            con.execute("DELETE FROM _delta USING (SELECT source, reference, max(_seq) AS last FROM _delta "
+                        "WHERE reference <> '' GROUP BY ALL HAVING count(*) > 1) k "
+                        "WHERE _delta.source = k.source AND _delta.reference = k.reference AND _delta._seq < k.last")
+            con.execute("BEGIN TRANSACTION")
+            try:
+                if where:
+                    con.execute(f"DELETE FROM tx WHERE _origin = {_sql_str(origin)} AND {where}")
+                con.execute("DELETE FROM tx USING _delta d WHERE tx.reference <> '' "
+                            "AND tx.source = d.source AND tx.reference = d.reference")
+                con.execute("INSERT INTO tx SELECT * FROM _delta")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        finally:
+            con.execute("DROP TABLE IF EXISTS _delta")
+        return n
+
+    def reset(self):
+        self.con.execute("DELETE FROM tx")
+        self.state = {}
+
+    def replace(self, origin: str, start: str, end: str, rows):
+        self._merge(origin, rows, f"date BETWEEN {_sql_str(start)} AND {_sql_str(end)}")
+
+    def upsert(self, origin: str, rows):
+        self._merge(origin, rows)
+
+    def replace_origin(self, origin: str, start: str, end: str, rows) -> int:
+        # borrar e insertar en la misma transacción: si el fichero falla a medias queda lo anterior
+        n = self._merge(origin, rows, "true")
+        self.state.pop(origin, None)
+        return n
+
+    def drop_origin(self, origin: str):
+        self.con.execute(f"DELETE FROM tx WHERE _origin = {_sql_str(origin)}")
+        self.state.pop(origin, None)
+
+    def window(self, start: str, end: str) -> pd.DataFrame:
+        df = self.con.execute(f"SELECT {', '.join(TX_COLUMNS)} FROM tx WHERE date BETWEEN ? AND ? "
+                              "ORDER BY date, _seq", [start, end]).df()
+        return tx_schema(df, minor=True)
+
+    def currencies(self, start: str, end: str) -> List[str]:
+        rows = self.con.execute("SELECT DISTINCT upper(currency) FROM tx WHERE date BETWEEN ? AND ? "
+                                "AND currency <> ''", [start, end]).fetchall()
+        return sorted(r[0] for r in rows)
+
+    def save(self):
+        ensure_dirs(self.root)
+        tmp = self.path + ".tmp"
+        cols = _csv_select(TX_COLUMNS + ["_origin"], _TX_TEXT + ["_origin"], TX_MINOR)
+        self.con.execute(f"COPY (SELECT {cols} FROM tx ORDER BY _seq) TO {_sql_str(tmp)} (HEADER, DELIMITER ',')")
+        os.replace(tmp, self.path)
+        self._save_state()
+
+    def close(self):
+        self.con.close()
+        self._remove_work()
+
+class DuckConsolidation:
+    """
+    consolidate() + KPIs en SQL sobre un DuckTxStore: la ventana no se carga en pandas.
+    Mismo resultado que el motor pandas (tipo as-of por moneda con antigüedad máxima,
+    moneda base a 1.0, fee ausente = 0); sólo salen a pandas los agregados por día y fuente.
+    """
+    def __init__(self, store: DuckTxStore, start: str, end: str, base_ccy: str, fx: pd.DataFrame,
+                 max_staleness_days: int = FX_MAX_STALENESS_DAYS):
+        self.con = store.con
+        self.base_ccy = base_ccy
+        self.con.register("_fx_frame", fx[FX_COLUMNS])
+        self.con.execute("CREATE OR REPLACE TABLE _fx AS SELECT CAST(date AS TIMESTAMP) AS date, "
+                         "CAST(currency AS VARCHAR) AS currency, CAST(rate AS DOUBLE) AS rate FROM _fx_frame")
+        self.con.unregister("_fx_frame")
+        self.con.execute(f"""
+            CREATE OR REPLACE VIEW cons AS
+            WITH t AS (
+                SELECT date, amount / {_minor_scale_sql()} AS amount, upper(currency) AS currency,
+                       COALESCE(fee, 0) / {_minor_scale_sql()} AS fee,
+                       source, type, status, reference, _seq, TRY_CAST(date AS TIMESTAMP) AS ts
+                FROM tx WHERE date BETWEEN {_sql_str(start)} AND {_sql_str(end)}
+            )
+            SELECT t.*,
+                   CASE WHEN t.currency = {_sql_str(base_ccy)} THEN 1.0
+                        WHEN t.ts - f.date <= INTERVAL {int(max_staleness_days)} DAY THEN f.rate END AS fx_rate
+            FROM t ASOF LEFT JOIN _fx f ON t.currency = f.currency AND t.ts >= f.date
+        """)
+        # columnas de _kpi_frame: importe separado por signo, sólo filas con fecha válida
+        self.con.execute("""
+            CREATE OR REPLACE VIEW cons_kpi AS
+            SELECT CAST(ts AS DATE) AS ds, source,
+                   CASE WHEN amount * fx_rate > 0 THEN amount * fx_rate ELSE 0.0 END AS gross_sales_base,
+                   CASE WHEN amount * fx_rate < 0 THEN -(amount * fx_rate) ELSE 0.0 END AS refunds_base,
+                   COALESCE(fee * fx_rate, 0.0) AS fees_base
+            FROM cons WHERE ts IS NOT NULL
+        """)
+
+    def __len__(self) -> int:
+        return self.con.execute("SELECT count(*) FROM cons").fetchone()[0]
+
+    def missing_fx_report(self) -> pd.DataFrame:
+        return self.con.execute("""
+            SELECT currency, count(*) AS transactions, COALESCE(sum(amount), 0.0) AS amount,
+                   min(date) AS first_date, max(date) AS last_date
+            FROM cons WHERE fx_rate IS NULL GROUP BY currency ORDER BY currency
+        """).df()
+
+    def fingerprints(self) -> pd.DataFrame:
+        """Huella por día como KpiStore.fingerprints (con el hash de DuckDB: no es comparable entre motores)."""
+        df = self.con.execute("""
+            SELECT strftime(ds, '%Y-%m-%d') AS ds, count(*) AS rows,
+                   CAST(sum(h >> 32) AS BIGINT) AS h1, CAST(sum(h & 4294967295) AS BIGINT) AS h2
+            FROM (SELECT ds, hash(ds, source, gross_sales_base, refunds_base, fees_base) AS h FROM cons_kpi)
+            GROUP BY ds ORDER BY ds
+        """).df()
+        df["ds"] = pd.to_datetime(df["ds"], format="%Y-%m-%d")
+        return df
+
+    def aggregate_by_source(self, days: pd.DatetimeIndex) -> pd.DataFrame:
+        """Sumas por (ds, source) de `days`, como _aggregate_by_source."""
+        self.con.register("_days", pd.DataFrame({"ds": days.strftime("%Y-%m-%d")}))
+        by_src = self.con.execute("""
+            SELECT strftime(ds, '%Y-%m-%d') AS ds, source, fsum(gross_sales_base) AS gross_sales_base,
+                   fsum(refunds_base) AS refunds_base, fsum(fees_base) AS fees_base
+            FROM cons_kpi WHERE ds IN (SELECT CAST(ds AS DATE) FROM _days)
+            GROUP BY ALL ORDER BY ds, source NULLS LAST
+        """).df()
+        self.con.unregister("_days")
+        by_src["ds"] = pd.to_datetime(by_src["ds"], format="%Y-%m-%d")
+        by_src["net_revenue_base"] = by_src["gross_sales_base"] - by_src["refunds_base"] - by_src["fees_base"]
+        return by_src
+
+    def update_kpis(self, kpi_store: KpiStore, start: str, end: str) -> pd.DatetimeIndex:
+        fps = self.fingerprints()
+        touched = kpi_store.touched_from(fps, start, end)
+        if len(touched):
+            kpi_store.replace_days(self.aggregate_by_source(touched), fps[fps["ds"].isin(touched)], touched)
+        return touched
+
+    def to_csv(self, path: str):
+        cols = _csv_select(TX_COLUMNS, _TX_TEXT)
+        self.con.execute(f"""
+            COPY (SELECT {cols}, fx_rate, amount * fx_rate AS amount_base, fee * fx_rate AS fee_base,
+                         {_sql_str(self.base_ccy)} AS base_currency
+                  FROM cons ORDER BY date, _seq)
+            TO {_sql_str(path)} (HEADER, DELIMITER ',')
+        """)
+
+def write_summary(path_md: str, start: str, end: str, base: str, kpi: pd.DataFrame, by_src: pd.DataFrame,
+                  missing_fx: pd.DataFrame = None):
     with open(path_md, "w", encoding="utf-8") as f:
         f.write(f"# Consolidación Financiera – {utc_today_str()}\n\n")
         f.write(f"- Ventana: **{start} → {end}**\n")
         f.write(f"- Moneda base: **{base}**\n\n")
+        if missing_fx is not None and not missing_fx.empty:
+            f.write("## Sin tipo de cambio (excluidas de los KPIs)\n")
+            for r in missing_fx.itertuples():
+                f.write(f"- **{r.currency}**: {r.transactions} transacciones · importe {r.amount:.2f} {r.currency} · "
+                        f"{r.first_date} → {r.last_date}\n")
+            f.write("\n")
         if kpi.empty:
             f.write("> No se encontraron transacciones en el rango indicado.\n")
             return
@@ -322,6 +1443,66 @@ def write_summary(path_md: str, start: str, end: str, base: str, kpi: pd.DataFra
             for s, val in top_src.items():
                 f.write(f"- **{s}**: {val:.2f}\n")
 
+# --------------------
+# Perfil por etapas (--profile)
+# --------------------
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _max_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)  # bytes en macOS, KB en Linux
+
+class StageProfile:
+    """
+    Tiempo y memoria de cada etapa: wall y CPU, RSS al terminar, pico de RSS del proceso hasta
+    ese momento y, con tracemalloc activo (python -X tracemalloc), pico de lo reservado por
+    Python/numpy dentro de la etapa (DuckDB no aparece ahí, sólo en el RSS).
+    """
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+        self.info: Dict[str, object] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            traced0 = tracemalloc.get_traced_memory()[0]
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            st = {"wall_s": time.perf_counter() - t0, "cpu_s": time.process_time() - c0,
+                  "rss_mb": _rss_mb(), "max_rss_mb": _max_rss_mb()}
+            if tracing:
+                st["py_peak_mb"] = round((tracemalloc.get_traced_memory()[1] - traced0) / 2**20, 1)
+            # una etapa medida en varios tramos: se suman los tiempos y se queda el pico mayor
+            prev = self.stages.get(name)
+            if prev:
+                st["wall_s"] += prev["wall_s"]
+                st["cpu_s"] += prev["cpu_s"]
+                if tracing and "py_peak_mb" in prev:
+                    st["py_peak_mb"] = max(st["py_peak_mb"], prev["py_peak_mb"])
+            st["wall_s"], st["cpu_s"] = round(st["wall_s"], 4), round(st["cpu_s"], 4)
+            self.stages[name] = st
+
+    def save(self, path: str, **extra):
+        out = {"wall_s": round(time.perf_counter() - self.started, 4), "max_rss_mb": _max_rss_mb(),
+               "stages": self.stages, **self.info, **extra}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(out, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
 # --------------------
 # Main
 # --------------------
@@ -330,53 +1511,105 @@ def main():
     parser = argparse.ArgumentParser(description="Financial Multi-Source Consolidation")
     parser.add_argument("--data-dir", default="data", help="Carpeta con CSV locales")
     parser.add_argument("--outdir", default="outputs", help="Carpeta de salida")
+    parser.add_argument("--rebuild-kpis", action="store_true", help="Recalcula todos los KPIs persistidos")
+    parser.add_argument("--full-sync", action="store_true",
+                        help="Ignora las marcas de sincronización y vuelve a pedir la ventana completa")
+    parser.add_argument("--offline-fx", action="store_true", help="No llama a la API de FX: sólo tipos guardados")
+    parser.add_argument("--allow-missing-fx", action="store_true",
+                        help="Continúa aunque falten tipos (las transacciones afectadas quedan sin convertir)")
+    parser.add_argument("--engine", choices=["pandas", "duckdb"], default=env("CONSOLIDATION_ENGINE", "pandas"),
+                        help="duckdb: store, consolidación y KPIs fuera de memoria (DUCKDB_MEMORY_LIMIT)")
+    parser.add_argument("--profile", default="",
+                        help="JSON con tiempo y memoria por etapa (ingest, fx, consolidate, kpis, write)")
     args = parser.parse_args()
 
+    if args.engine == "duckdb" and not duckdb_available():
+        raise SystemExit("[ERROR] --engine duckdb requiere el paquete duckdb (pip install duckdb)")
     ensure_dirs(args.outdir)
 
     start, end = daterange_default()
     base = env("BASE_CURRENCY", "EUR").upper()
 
-    frames = []
+    # Sincronización incremental: cada origen trae sólo su delta al store local
+    prof = StageProfile()
+    tx_root = os.path.join(args.outdir, "tx_store")
+    try:
+        with prof.stage("ingest"):
+            tx_store = DuckTxStore(tx_root) if args.engine == "duckdb" else TxStore(tx_root)
+        try:
+            run(args, tx_store, start, end, base, prof)
+        finally:
+            tx_store.close()
+    finally:
+        if args.profile:
+            prof.save(args.profile, engine=args.engine, window=[start, end])
 
-    # 1) Stripe
-    stripe_key = env("STRIPE_API_KEY")
-    df_stripe = fetch_stripe_charges(stripe_key, start, end)
-    if not df_stripe.empty:
-        frames.append(df_stripe)
+def run(args: argparse.Namespace, tx_store: TxStore, start: str, end: str, base: str, prof: StageProfile):
+    with prof.stage("ingest"):
+        if args.full_sync:
+            tx_store.reset()
+        # con DuckDB los CSV van por bloques al store: la caché de frames completos no aplica
+        csv_cache = None if tx_store.streaming else CsvCache(os.path.join(args.outdir, "csv_cache"))
+        synced = sync_sources(tx_store, args.data_dir, start, end, csv_cache)
+        tx_store.save()
+        if csv_cache is not None:
+            csv_cache.save()
+    for origin, n in synced.items():
+        print(f"[INFO] Sincronizado {origin}: {n} registros")
+    duck = isinstance(tx_store, DuckTxStore)
 
-    # 2) JSON genérico
-    gen_url = env("GENERIC_JSON_URL")
-    gen_token = env("GENERIC_BEARER_TOKEN")
-    df_generic = fetch_generic_json(gen_url, gen_token, start, end)
-    if not df_generic.empty:
-        frames.append(df_generic)
-
-    # 3) CSV locales
-    df_local = load_local_csvs(args.data_dir, start, end)
-    if not df_local.empty:
-        frames.append(df_local)
-
-    if frames:
-        tx = pd.concat(frames, ignore_index=True)
-    else:
-        tx = pd.DataFrame(columns=["date","amount","currency","fee","source","type","status","reference"])
-
-    # Monedas a convertir
-    currencies = sorted(set([c for c in tx.get("currency",[]).astype(str).str.upper().unique() if c]))
-    fx = fetch_fx_timeseries(base, start, end, currencies)
-    tx_cons = consolidate(tx, base, fx)
+    # Monedas a convertir: sólo se piden a la API los tipos que no están en el store
+    with prof.stage("fx"):
+        tx = None if duck else tx_store.window(start, end)
+        if duck:
+            currencies = tx_store.currencies(start, end)
+        else:
+            currencies = sorted(set([c for c in tx.get("currency",[]).astype(str).str.upper().unique() if c]))
+        fx_store = FxStore(os.path.join(args.outdir, "fx_store"))
+        fx_start = (isoparse(start).date() - timedelta(days=FX_MAX_STALENESS_DAYS)).isoformat()
+        fetched = fx_store.sync(base, currencies, fx_start, end, offline=args.offline_fx)
+        fx_store.save()
+    print(f"[INFO] Tipos de cambio descargados: {fetched}")
+    with prof.stage("consolidate"):
+        if duck:
+            tx_cons = DuckConsolidation(tx_store, start, end, base, fx_store.frame(base))
+            missing_fx = tx_cons.missing_fx_report()
+        else:
+            tx_cons = consolidate(tx, base, fx_store.frame(base))
+            missing_fx = missing_fx_report(tx_cons)
+    level = "WARN" if args.allow_missing_fx else "ERROR"
+    for r in missing_fx.itertuples():
+        print(f"[{level}] Sin tipo de cambio {r.currency}->{base}: {r.transactions} transacciones "
+              f"({r.first_date} → {r.last_date})")
+    if not missing_fx.empty and not args.allow_missing_fx:
+        # importes sin convertir falsearían los totales: no se escribe nada
+        raise SystemExit("[ERROR] Faltan tipos de cambio; no se generan salidas (--allow-missing-fx para continuar)")
 
-    # KPIs
-    kpi_daily, kpi_by_source = compute_kpis(tx_cons)
+    # KPIs: sólo se recalculan los días con transacciones nuevas o cambiadas
+    with prof.stage("kpis"):
+        kpi_store = KpiStore(os.path.join(args.outdir, "kpi_store"))
+        if args.rebuild_kpis:
+            kpi_store.reset()
+        if duck:
+            touched = tx_cons.update_kpis(kpi_store, start, end)
+        else:
+            touched = kpi_store.touched_days(tx_cons, start, end)
+            kpi_store.upsert(tx_cons, touched)
+        kpi_store.save()
+        kpi_daily, kpi_by_source = kpi_store.tables(start, end)
+    print(f"[INFO] KPIs recalculados para {len(touched)} días")
+    prof.info.update(rows=len(tx_cons), kpi_days=len(touched))
 
     # Guardar
-    tx_cons.to_csv(os.path.join(args.outdir, "transactions_consolidated.csv"), index=False)
-    kpi_daily.to_csv(os.path.join(args.outdir, "kpi_daily.csv"), index=False)
-    kpi_by_source.to_csv(os.path.join(args.outdir, "kpi_by_source.csv"), index=False)
-
     summary_path = os.path.join(args.outdir, f"summary_{utc_today_str().replace('-','')}.md")
-    write_summary(summary_path, start, end, base, kpi_daily, kpi_by_source)
+    with prof.stage("write"):
+        if duck:
+            tx_cons.to_csv(os.path.join(args.outdir, "transactions_consolidated.csv"))
+        else:
+            tx_cons.to_csv(os.path.join(args.outdir, "transactions_consolidated.csv"), index=False)
+        kpi_daily.to_csv(os.path.join(args.outdir, "kpi_daily.csv"), index=False)
+        kpi_by_source.to_csv(os.path.join(args.outdir, "kpi_by_source.csv"), index=False)
+        write_summary(summary_path, start, end, base, kpi_daily, kpi_by_source, missing_fx)
 
     print(f"[OK] Consolidación completada. Registros: {len(tx_cons)} | Moneda base: {base}")
     print(f" - transactions_consolidated.csv -> {os.path.join(args.outdir,'transactions_consolidated.csv')}")
@@ -0,0 +1,144 @@
+# benchmarks/api_standins.py
+# Servidores HTTP locales que imitan la fuente JSON genérica y la API de FX (sin red)
+# - GenericStandIn: GET / devuelve el array de transacciones; con offset/limit pagina
+# - FxStandIn: GET /timeseries?base&start_date&end_date&symbols como exchangerate.host
+#   ("1 base = X moneda"), sólo con los días publicados
+# - Latencia por petición configurable y contador de peticiones, como stripe_standin.py
+# Uso: python benchmarks/api_standins.py --generic-rows 50000 --latency-ms 40
+#      GENERIC_JSON_URL=http://127.0.0.1:8901/ FX_API_URL=http://127.0.0.1:8902 python .github/Consolidacion.py
+
+import json
+import time
+import argparse
+import threading
+import http.server
+from urllib.parse import urlsplit, parse_qs
+
+from synthetic import SyntheticConfig, generic_items, fx_rates
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # cabeceras y cuerpo van en escrituras separadas: sin esto Nagle + ACK diferido añaden ~40 ms por respuesta
+    disable_nagle_algorithm = True
+    latency_ms: float = 0.0
+    data = None
+    counts: dict = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        parts = urlsplit(self.path)
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        with self.lock:
+            self.counts[parts.path] = self.counts.get(parts.path, 0) + 1
+        status, payload = self.respond(parts.path, q)
+        self._send(status, payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8"))
+
+    def respond(self, path: str, q: dict) -> tuple:
+        return 404, {"error": f"Unrecognized request URL: {path}"}
+
+class _GenericHandler(_Handler):
+    def respond(self, path: str, q: dict) -> tuple:
+        if path not in ("", "/"):
+            return super().respond(path, q)
+        if "offset" in q or "limit" in q:
+            offset, limit = int(q.get("offset", 0)), int(q.get("limit", 1000))
+            return 200, self.data["items"][offset:offset + limit]
+        # sin paginar: el cuerpo completo se serializa una sola vez
+        return 200, self.data["body"]
+
+class _FxHandler(_Handler):
+    def respond(self, path: str, q: dict) -> tuple:
+        if path.rstrip("/") != "/timeseries":
+            return super().respond(path, q)
+        base = q.get("base", "EUR").upper()
+        symbols = [s for s in q.get("symbols", "").upper().split(",") if s]
+        start, end = q.get("start_date", ""), q.get("end_date", "")
+        rates = {}
+        for day, values in self.data.items():
+            if start <= day <= end and base in values:
+                rates[day] = {s: values[base] / values[s] for s in symbols if s in values}
+        return 200, {"success": True, "timeseries": True, "base": base, "rates": rates}
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class _StandIn:
+    """Servidor en un hilo daemon; `port=0` elige un puerto libre."""
+    handler_cls = _Handler
+
+    def __init__(self, data, latency_ms: float = 0.0, port: int = 0):
+        handler = type("Handler", (self.handler_cls,), {"latency_ms": latency_ms, "data": data, "counts": {}})
+        self.handler = handler
+        self.httpd = _QuietServer(("127.0.0.1", port), handler)
+        self.port = self.httpd.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def counts(self) -> dict:
+        with self.handler.lock:
+            return dict(self.handler.counts)
+
+    def reset_counts(self):
+        with self.handler.lock:
+            self.handler.counts.clear()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class GenericStandIn(_StandIn):
+    handler_cls = _GenericHandler
+
+    def __init__(self, cfg: SyntheticConfig, latency_ms: float = 0.0, port: int = 0):
+        items = generic_items(cfg)
+        super().__init__({"items": items, "body": json.dumps(items).encode("utf-8")}, latency_ms, port)
+        self.url = self.base_url + "/"
+
+class FxStandIn(_StandIn):
+    handler_cls = _FxHandler
+
+    def __init__(self, cfg: SyntheticConfig, latency_ms: float = 0.0, port: int = 0):
+        super().__init__(fx_rates(cfg), latency_ms, port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-ins locales de la fuente JSON genérica y de FX")
+    parser.add_argument("--generic-port", type=int, default=8901)
+    parser.add_argument("--fx-port", type=int, default=8902)
+    parser.add_argument("--generic-rows", type=int, default=20_000)
+    parser.add_argument("--currencies", default="EUR,USD,GBP,JPY")
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--end", default="2024-06-30")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    cfg = SyntheticConfig(generic_rows=args.generic_rows, currencies=tuple(args.currencies.split(",")),
+                          start=args.start, end=args.end, seed=args.seed)
+    generic = GenericStandIn(cfg, args.latency_ms, args.generic_port).start()
+    fx = FxStandIn(cfg, args.latency_ms, args.fx_port)
+    print(f"JSON genérico en {generic.url} ({args.generic_rows} filas) · FX en {fx.base_url}")
+    try:
+        fx.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generic.stop()
+
+if __name__ == "__main__":
+    main()
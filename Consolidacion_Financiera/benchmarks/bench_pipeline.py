@@ -0,0 +1,174 @@
+# benchmarks/bench_pipeline.py
+# Benchmark de la consolidación completa por etapas (ingest, fx, consolidate, kpis, write), sin red
+# - Datos sintéticos (synthetic.py): CSV locales, fuente JSON genérica y tipos de cambio
+# - Stand-ins locales de Stripe, JSON genérico y FX; cada caso ejecuta .github/Consolidacion.py
+#   en un proceso aparte con --profile (tiempo, CPU y memoria por etapa)
+# Casos: <motor>:<cold|warm>
+#   - cold : outputs vacíos (primera ejecución, todo se descarga y recalcula)
+#   - warm : segunda ejecución sobre los mismos outputs (sólo deltas)
+# Uso:
+#   python benchmarks/bench_pipeline.py --rows 1000000 --json bench_pipeline.json
+#   python benchmarks/bench_pipeline.py --cases pandas:cold,duckdb:cold --compare bench_anterior.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "..", ".github", "Consolidacion.py")
+
+from synthetic import SyntheticConfig, write_csvs  # noqa: E402
+from stripe_standin import StripeStandIn, StripeStandInConfig  # noqa: E402
+from api_standins import GenericStandIn, FxStandIn  # noqa: E402
+
+STAGES = ["ingest", "fx", "consolidate", "kpis", "write"]
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def run_case(engine: str, data_dir: str, outdir: str, env: dict, tracemalloc: bool) -> dict:
+    """Una ejecución de Consolidacion.py; devuelve el perfil que escribe con --profile."""
+    profile = os.path.join(outdir, "profile.json")
+    cmd = [sys.executable] + (["-X", "tracemalloc"] if tracemalloc else []) + [
+        SCRIPT, "--data-dir", data_dir, "--outdir", outdir, "--engine", engine, "--profile", profile]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"[ERROR] {engine} terminó con código {proc.returncode}:\n{proc.stdout}{proc.stderr}")
+    with open(profile, encoding="utf-8") as f:
+        return json.load(f)
+
+def summarize(runs: list) -> dict:
+    """Mediana de tiempos entre repeticiones; memoria: el máximo observado."""
+    out = {"wall_s": round(statistics.median(r["wall_s"] for r in runs), 4),
+           "max_rss_mb": max(r.get("max_rss_mb") or 0 for r in runs),
+           "rows": runs[-1].get("rows"), "kpi_days": runs[-1].get("kpi_days"), "stages": {}}
+    for name in STAGES:
+        st = [r["stages"][name] for r in runs if name in r["stages"]]
+        if not st:
+            continue
+        out["stages"][name] = {
+            "wall_s": round(statistics.median(s["wall_s"] for s in st), 4),
+            "cpu_s": round(statistics.median(s["cpu_s"] for s in st), 4),
+            "max_rss_mb": max(s.get("max_rss_mb") or 0 for s in st),
+        }
+        if any("py_peak_mb" in s for s in st):
+            out["stages"][name]["py_peak_mb"] = max(s.get("py_peak_mb", 0) for s in st)
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de la consolidación con datos sintéticos")
+    parser.add_argument("--rows", type=int, default=200_000, help="Filas en CSV locales")
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--generic-rows", type=int, default=20_000)
+    parser.add_argument("--charges", type=int, default=5000, help="Cargos en el stand-in de Stripe")
+    parser.add_argument("--currencies", default="EUR,USD,GBP,JPY")
+    parser.add_argument("--sources", default="shopify,pos,marketplace")
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--end", default="2024-06-30")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia de los stand-ins por petición")
+    parser.add_argument("--cases", default="pandas:cold,pandas:warm")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeticiones por caso (se reporta la mediana)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Ejecuta con -X tracemalloc: pico de Python por etapa (más lento)")
+    parser.add_argument("--workdir", default="", help="Carpeta de trabajo (por defecto, temporal)")
+    parser.add_argument("--json", default="", help="Guarda los resultados en JSON")
+    parser.add_argument("--compare", default="", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    for case in cases:
+        engine, _, mode = case.partition(":")
+        if engine not in ("pandas", "duckdb") or mode not in ("cold", "warm"):
+            raise SystemExit(f"[ERROR] Caso desconocido: {case} (motor:cold|warm)")
+
+    currencies = tuple(c.strip().upper() for c in args.currencies.split(",") if c.strip())
+    cfg = SyntheticConfig(rows=args.rows, files=args.files, generic_rows=args.generic_rows, currencies=currencies,
+                          sources=tuple(args.sources.split(",")), start=args.start, end=args.end, seed=args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    data_dir = os.path.join(workdir, "data")
+    if os.path.isdir(data_dir):
+        shutil.rmtree(data_dir)
+    t0 = time.perf_counter()
+    write_csvs(cfg, data_dir)
+    print(f"[INFO] Datos sintéticos en {data_dir} ({time.perf_counter() - t0:.1f} s)")
+
+    stripe = StripeStandIn(StripeStandInConfig(charges=args.charges, start=args.start, end=args.end,
+                                               currencies=tuple(c.lower() for c in currencies),
+                                               latency_ms=args.latency_ms, seed=args.seed)).start()
+    generic = GenericStandIn(cfg, args.latency_ms).start()
+    fx = FxStandIn(cfg, args.latency_ms).start()
+    env = dict(os.environ, START_DATE=args.start, END_DATE=args.end, BASE_CURRENCY="EUR",
+               STRIPE_API_BASE=stripe.base_url, STRIPE_API_KEY="sk_test_bench",
+               GENERIC_JSON_URL=generic.url, GENERIC_BEARER_TOKEN="bench", FX_API_URL=fx.base_url)
+
+    results = {}
+    try:
+        for case in cases:
+            engine, _, mode = case.partition(":")
+            runs = []
+            for i in range(max(1, args.repeat)):
+                outdir = os.path.join(workdir, f"out_{engine}_{mode}")
+                if mode == "cold" or not os.path.isdir(outdir):
+                    shutil.rmtree(outdir, ignore_errors=True)
+                    if mode == "warm":
+                        # la ejecución en caliente parte de una completa previa
+                        run_case(engine, data_dir, outdir, env, args.tracemalloc)
+                runs.append(run_case(engine, data_dir, outdir, env, args.tracemalloc))
+            results[case] = summarize(runs)
+    finally:
+        for server in (stripe, generic, fx):
+            server.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nFilas CSV: {args.rows} · JSON: {args.generic_rows} · Stripe: {args.charges} cargos · "
+          f"{args.start} → {args.end}\n")
+    print(f"{'caso':<14} {'filas':>9} {'total s':>8} " + " ".join(f"{s + ' s':>13}" for s in STAGES)
+          + f" {'RSS máx MB':>11}")
+    for name, r in results.items():
+        cells = " ".join(f"{r['stages'].get(s, {}).get('wall_s', 0):>13.3f}" for s in STAGES)
+        print(f"{name:<14} {r['rows'] or 0:>9} {r['wall_s']:>8.2f} {cells} {r['max_rss_mb']:>11.1f}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            prev = json.load(f)
+        print(f"\nComparación con {prev['meta'].get('git', '?')} (tiempo ahora / antes, <1 = más rápido ahora):")
+        same = ("rows", "files", "generic_rows", "charges", "currencies", "start", "end", "seed", "latency_ms")
+        diff = [k for k in same if prev["meta"].get("args", {}).get(k) != getattr(args, k)]
+        if diff:
+            print(f"[WARN] Datos distintos a la ejecución anterior ({', '.join(diff)}): las ratios no son comparables")
+        for name, r in results.items():
+            old = prev["cases"].get(name)
+            if not old:
+                continue
+            ratios = [f"total {r['wall_s'] / old['wall_s']:.2f}x"] if old["wall_s"] else []
+            for s in STAGES:
+                a, b = r["stages"].get(s, {}).get("wall_s"), old["stages"].get(s, {}).get("wall_s")
+                if a is not None and b:
+                    ratios.append(f"{s} {a / b:.2f}x")
+            if old.get("max_rss_mb"):
+                ratios.append(f"RSS {r['max_rss_mb'] / old['max_rss_mb']:.2f}x")
+            print(f"  {name:<14} " + " · ".join(ratios))
+
+    if args.json:
+        import pandas as pd
+        meta = {"git": git_rev(), "python": platform.python_version(), "pandas": pd.__version__,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "cpus": os.cpu_count(), "args": vars(args)}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "cases": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados: {args.json}")
+
+if __name__ == "__main__":
+    main()
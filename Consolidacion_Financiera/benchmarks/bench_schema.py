@@ -0,0 +1,88 @@
+# benchmarks/bench_schema.py
+# Memoria y exactitud del esquema canónico de transacciones frente al anterior
+# Casos:
+#   - legacy    : texto como object y importes float64 (unidades mayores)
+#   - canonical : cf.tx_schema (category + Int64 en unidades menores)
+# Uso:
+#   python benchmarks/bench_schema.py --rows 2000000 --json bench_schema.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", ".github"))
+
+import Consolidacion as cf  # noqa: E402
+
+def synthetic_legacy(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Transacciones como las dejaban los loaders antes del esquema: object + float64."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2024-01-01", periods=365).strftime("%Y-%m-%d").to_numpy(dtype=object)
+    df = pd.DataFrame({
+        "date": rng.choice(days, rows),
+        "amount": (rng.integers(-5_000, 50_000, rows) / 100.0),
+        "currency": rng.choice(np.array(["EUR", "USD", "GBP", "JPY"], dtype=object), rows),
+        "fee": (rng.integers(0, 500, rows) / 100.0),
+        "source": rng.choice(np.array(["stripe", "shopify", "pos", "marketplace"], dtype=object), rows),
+        "type": rng.choice(np.array(["charge", "refund", "order"], dtype=object), rows),
+        "status": rng.choice(np.array(["succeeded", "paid", ""], dtype=object), rows),
+        "reference": np.array([f"tx_{i:010d}" for i in range(rows)], dtype=object),
+    }, columns=cf.TX_COLUMNS)
+    # pandas >= 3 infiere str al construir: se fuerza object como en los loaders antiguos
+    text = ["date", "currency", "source", "type", "status", "reference"]
+    df[text] = df[text].astype(object)
+    # JPY no tiene decimales
+    jpy = df["currency"].eq("JPY")
+    df.loc[jpy, ["amount", "fee"]] = df.loc[jpy, ["amount", "fee"]].round(0)
+    return df
+
+def frame_mb(df: pd.DataFrame) -> dict:
+    usage = df.memory_usage(deep=True, index=False)
+    return {"total_mb": round(usage.sum() / 2**20, 1), **{c: round(v / 2**20, 1) for c, v in usage.items()}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria del esquema canónico de transacciones")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="Guarda los resultados en JSON")
+    args = parser.parse_args()
+
+    legacy = synthetic_legacy(args.rows, args.seed)
+    t0 = time.perf_counter()
+    canonical = cf.tx_schema(legacy)
+    convert_s = time.perf_counter() - t0
+
+    # suma de importes en unidades mayores: float acumulado frente a enteros exactos
+    exact = canonical.groupby("currency", observed=True)["amount"].sum()
+    drift = {}
+    for ccy, minor in exact.items():
+        scale = 10 ** cf.CURRENCY_DECIMALS.get(ccy, 2)
+        float_sum = float(legacy.loc[legacy["currency"].eq(ccy), "amount"].to_numpy().cumsum()[-1])
+        drift[ccy] = float_sum - int(minor) / scale
+
+    results = {"legacy": frame_mb(legacy), "canonical": frame_mb(canonical)}
+    print(f"Filas: {args.rows} · conversión al esquema: {convert_s:.2f} s\n")
+    print(f"{'columna':<12} {'legacy MB':>10} {'canónico MB':>12}")
+    for c in ["total_mb"] + cf.TX_COLUMNS:
+        print(f"{c:<12} {results['legacy'][c]:>10.1f} {results['canonical'][c]:>12.1f}")
+    print("\nDesviación de la suma float acumulada frente a la suma exacta en unidades menores:")
+    for ccy, d in drift.items():
+        print(f"  {ccy}: {d:+.3e}")
+
+    if args.json:
+        meta = {"python": platform.python_version(), "pandas": pd.__version__,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "memory": results, "convert_s": round(convert_s, 3), "sum_drift": drift},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\nResultados: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_stripe.py
+# Benchmark de la ingesta de Stripe contra stripe_standin.py, sin red
+# Casos:
+#   - current : fetch_stripe_charges (fees expandidos, cargos y refunds en paralelo, sesión con pool)
+#   - legacy  : el esquema anterior (una petición por balance_transaction, secuencial, pausa entre páginas)
+# Uso:
+#   python benchmarks/bench_stripe.py --charges 5000 --latency-ms 40 --json bench_stripe.json
+#   python benchmarks/bench_stripe.py --cases current,legacy --charges 1000 --legacy-sleep 0.3
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import requests
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", ".github"))
+
+import Consolidacion as cf  # noqa: E402
+from stripe_standin import StripeStandIn, StripeStandInConfig  # noqa: E402
+
+def legacy_fetch(api_base: str, api_key: str, start: str, end: str, sleep_s: float) -> pd.DataFrame:
+    """Réplica del camino anterior (N+1 sobre balance_transactions) como referencia."""
+    start_ts = int(pd.Timestamp(start, tz="UTC").timestamp())
+    end_ts = int((pd.Timestamp(end, tz="UTC") + pd.Timedelta(days=1)).timestamp())
+    headers = {"Authorization": f"Bearer {api_key}"}
+    rows = []
+    for kind in ("charges", "refunds"):
+        params = {"limit": 100, "created[gte]": start_ts, "created[lte]": end_ts}
+        while True:
+            data = requests.get(f"{api_base}/v1/{kind}", headers=headers, params=params, timeout=25).json()
+            for o in data.get("data", []):
+                fee = 0.0
+                if kind == "charges" and o.get("balance_transaction"):
+                    br = requests.get(f"{api_base}/v1/balance_transactions/{o['balance_transaction']}",
+                                      headers=headers, timeout=20)
+                    fee = br.json().get("fee", 0) / 100.0
+                rows.append({"reference": o["id"], "fee": fee})
+            if not data.get("has_more"):
+                break
+            params["starting_after"] = data["data"][-1]["id"]
+            time.sleep(sleep_s)
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la ingesta de Stripe contra un stand-in local")
+    parser.add_argument("--charges", type=int, default=5000)
+    parser.add_argument("--refund-rate", type=float, default=0.05)
+    parser.add_argument("--start", default="2024-06-01")
+    parser.add_argument("--end", default="2024-06-30")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--cases", default="current")
+    parser.add_argument("--legacy-sleep", type=float, default=0.3, help="Pausa entre páginas del modo legacy")
+    parser.add_argument("--json", default="", help="Guarda los resultados en JSON")
+    args = parser.parse_args()
+
+    cfg = StripeStandInConfig(charges=args.charges, refund_rate=args.refund_rate, start=args.start,
+                              end=args.end, latency_ms=args.latency_ms)
+    server = StripeStandIn(cfg).start()
+    results = {}
+    try:
+        for case in [c.strip() for c in args.cases.split(",") if c.strip()]:
+            server.reset_counts()
+            t0 = time.perf_counter()
+            if case == "current":
+                df = cf.fetch_stripe_charges("sk_test_bench", args.start, args.end, api_base=server.base_url)
+            elif case == "legacy":
+                df = legacy_fetch(server.base_url, "sk_test_bench", args.start, args.end, args.legacy_sleep)
+            else:
+                raise SystemExit(f"[ERROR] Caso desconocido: {case}")
+            wall = time.perf_counter() - t0
+            counts = server.counts
+            # el camino actual devuelve el esquema canónico (fees en unidades menores)
+            fees = cf.from_minor(df["fee"], df["currency"]) if case == "current" else df["fee"].to_numpy()
+            results[case] = {
+                "wall_s": round(wall, 4),
+                "rows": len(df),
+                "rows_per_s": round(len(df) / wall, 1) if wall > 0 else None,
+                "requests": sum(counts.values()),
+                "requests_by_endpoint": counts,
+                "fees_total": round(float(np.nansum(fees)), 2),
+            }
+    finally:
+        server.stop()
+
+    print(f"Cargos: {args.charges} · latencia: {args.latency_ms} ms\n")
+    print(f"{'caso':<10} {'wall s':>8} {'filas':>8} {'filas/s':>9} {'peticiones':>11} {'fees':>12}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['wall_s']:>8.2f} {r['rows']:>8} {r['rows_per_s'] or 0:>9.1f} "
+              f"{r['requests']:>11} {r['fees_total']:>12.2f}")
+
+    if args.json:
+        meta = {"python": platform.python_version(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "cases": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados: {args.json}")
+
+if __name__ == "__main__":
+    main()
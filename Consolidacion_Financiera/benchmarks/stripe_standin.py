@@ -0,0 +1,168 @@
+# benchmarks/stripe_standin.py
+# Servidor HTTP local que imita la API de Stripe usada por la consolidación (sin red ni claves)
+# - GET /v1/charges, /v1/refunds: listados paginados (limit, starting_after, created[gte|lte])
+# - expand[]=data.balance_transaction en charges; GET /v1/balance_transactions/<id> para el modo antiguo
+# - Datos sintéticos deterministas (semilla), del más reciente al más antiguo como en Stripe
+# - Latencia por petición configurable y contador de peticiones por endpoint
+# Uso: python benchmarks/stripe_standin.py --port 8900 --charges 20000 --latency-ms 60
+#      STRIPE_API_BASE=http://127.0.0.1:8900 STRIPE_API_KEY=sk_test_x python .github/Consolidacion.py
+
+import json
+import time
+import bisect
+import random
+import argparse
+import threading
+import http.server
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+@dataclass
+class StripeStandInConfig:
+    charges: int = 5000
+    refund_rate: float = 0.05
+    start: str = "2024-06-01"
+    end: str = "2024-06-30"
+    currencies: tuple = ("eur", "usd", "gbp")
+    latency_ms: float = 0.0
+    seed: int = 0
+
+def _ts(day: str) -> int:
+    return int(datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp())
+
+class _Listing:
+    """Objetos ordenados por created descendente con índice para filtros y cursor."""
+    def __init__(self, objs: list):
+        self.objs = sorted(objs, key=lambda o: (-o["created"], o["id"]))
+        self.neg_created = [-o["created"] for o in self.objs]
+        self.pos = {o["id"]: i for i, o in enumerate(self.objs)}
+
+    def page(self, gte: int, lte: int, starting_after: str, limit: int) -> tuple:
+        lo = bisect.bisect_left(self.neg_created, -lte)
+        hi = bisect.bisect_right(self.neg_created, -gte)
+        if starting_after:
+            lo = max(lo, self.pos.get(starting_after, hi) + 1)
+        items = self.objs[lo:min(hi, lo + limit)]
+        return items, lo + limit < hi
+
+def build_dataset(cfg: StripeStandInConfig) -> dict:
+    rng = random.Random(cfg.seed)
+    t0, t1 = _ts(cfg.start), _ts(cfg.end) + 86_399
+    charges, refunds, bts = [], [], {}
+    for i in range(cfg.charges):
+        created = rng.randint(t0, t1)
+        amount = rng.randint(500, 50_000)
+        ccy = rng.choice(cfg.currencies)
+        bt_id = f"txn_{i:08d}"
+        bts[bt_id] = {"id": bt_id, "object": "balance_transaction", "amount": amount,
+                      "fee": round(amount * 0.029) + 30, "currency": ccy, "created": created}
+        charges.append({"id": f"ch_{i:08d}", "object": "charge", "created": created, "amount": amount,
+                        "currency": ccy, "status": "succeeded", "balance_transaction": bt_id})
+        if rng.random() < cfg.refund_rate:
+            refunds.append({"id": f"re_{i:08d}", "object": "refund", "charge": f"ch_{i:08d}",
+                            "created": min(t1, created + rng.randint(3600, 5 * 86_400)),
+                            "amount": rng.randint(100, amount), "currency": ccy, "status": "succeeded"})
+    return {"charges": _Listing(charges), "refunds": _Listing(refunds), "balance_transactions": bts}
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # cabeceras y cuerpo van en escrituras separadas: sin esto Nagle + ACK diferido añaden ~40 ms por respuesta
+    disable_nagle_algorithm = True
+    config: StripeStandInConfig = StripeStandInConfig()
+    data: dict = {}
+    counts: dict = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.config.latency_ms > 0:
+            time.sleep(self.config.latency_ms / 1000.0)
+        parts = urlsplit(self.path)
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        expand = parse_qs(parts.query).get("expand[]", [])
+        segs = parts.path.strip("/").split("/")
+        endpoint = segs[1] if len(segs) > 1 else ""
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._send(401, {"error": {"message": "No API key provided"}})
+
+        if endpoint == "balance_transactions" and len(segs) == 3:
+            bt = self.data["balance_transactions"].get(segs[2])
+            return self._send(200, bt) if bt else self._send(404, {"error": {"message": "No such object"}})
+
+        if endpoint in ("charges", "refunds") and len(segs) == 2:
+            limit = max(1, min(100, int(q.get("limit", 10))))
+            items, has_more = self.data[endpoint].page(int(q.get("created[gte]", 0)),
+                                                       int(q.get("created[lte]", 2**62)),
+                                                       q.get("starting_after", ""), limit)
+            if endpoint == "charges" and "data.balance_transaction" in expand:
+                bts = self.data["balance_transactions"]
+                items = [dict(o, balance_transaction=bts[o["balance_transaction"]]) for o in items]
+            return self._send(200, {"object": "list", "url": parts.path, "has_more": has_more, "data": items})
+
+        self._send(404, {"error": {"message": f"Unrecognized request URL: {parts.path}"}})
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class StripeStandIn:
+    """Servidor en un hilo daemon; `port=0` elige un puerto libre."""
+    def __init__(self, config: StripeStandInConfig, port: int = 0):
+        handler = type("Handler", (_Handler,), {"config": config, "data": build_dataset(config), "counts": {}})
+        self.handler = handler
+        self.httpd = _QuietServer(("127.0.0.1", port), handler)
+        self.port = self.httpd.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def counts(self) -> dict:
+        with self.handler.lock:
+            return dict(self.handler.counts)
+
+    def reset_counts(self):
+        with self.handler.lock:
+            self.handler.counts.clear()
+
+    def start(self) -> "StripeStandIn":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in local de la API de Stripe")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--charges", type=int, default=5000)
+    parser.add_argument("--refund-rate", type=float, default=0.05)
+    parser.add_argument("--start", default="2024-06-01")
+    parser.add_argument("--end", default="2024-06-30")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    cfg = StripeStandInConfig(charges=args.charges, refund_rate=args.refund_rate, start=args.start,
+                              end=args.end, latency_ms=args.latency_ms, seed=args.seed)
+    server = StripeStandIn(cfg, args.port)
+    print(f"Stripe stand-in en {server.base_url} ({args.charges} cargos, {args.start} → {args.end})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/synthetic.py
+# Generador de datos sintéticos para los benchmarks de la consolidación
+# - Transacciones vectorizadas (numpy) configurables por filas, monedas, fuentes y rango de fechas
+# - CSV locales repartidos en varios ficheros, ítems para la fuente JSON genérica
+# - Tipos de cambio deterministas por día (paseo aleatorio por moneda, sólo días laborables)
+# - Misma semilla → mismos datos, para comparar ejecuciones entre commits
+# Uso: python benchmarks/synthetic.py --rows 1000000 --files 4 --out /tmp/bench_data
+
+import os
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# columnas de los CSV locales (mismo orden que TX_COLUMNS en Consolidacion.py)
+TX_COLUMNS = ["date", "amount", "currency", "fee", "source", "type", "status", "reference"]
+# decimales de las monedas sin céntimos o con milésimas que aparecen en los datos sintéticos
+DECIMALS = {"JPY": 0, "KRW": 0, "CLP": 0, "KWD": 3, "BHD": 3}
+# valor aproximado en USD de una unidad de cada moneda (punto de partida del paseo aleatorio)
+USD_VALUE = {"USD": 1.0, "EUR": 1.08, "GBP": 1.27, "CHF": 1.12, "JPY": 0.0067, "CAD": 0.73, "AUD": 0.66,
+             "MXN": 0.055, "SEK": 0.095, "KRW": 0.00075, "CLP": 0.0011, "KWD": 3.25, "BHD": 2.65}
+
+@dataclass
+class SyntheticConfig:
+    rows: int = 200_000
+    files: int = 2
+    generic_rows: int = 20_000
+    currencies: tuple = ("EUR", "USD", "GBP", "JPY")
+    sources: tuple = ("shopify", "pos", "marketplace")
+    start: str = "2024-01-01"
+    end: str = "2024-06-30"
+    refund_rate: float = 0.05
+    seed: int = 0
+
+    @property
+    def days(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, self.end, freq="D")
+
+def transactions(cfg: SyntheticConfig, rows: int, prefix: str = "tx", seed_offset: int = 0) -> pd.DataFrame:
+    """Transacciones en unidades mayores con el redondeo de cada moneda; referencias únicas por prefijo."""
+    rng = np.random.default_rng(cfg.seed + seed_offset)
+    days = cfg.days.strftime("%Y-%m-%d").to_numpy(dtype=object)
+    ccys = np.array([c.upper() for c in cfg.currencies], dtype=object)
+    ccy = rng.choice(ccys, rows)
+    refund = rng.random(rows) < cfg.refund_rate
+    # importes log-normales en USD (mediana ~40) pasados a cada moneda
+    usd = np.round(rng.lognormal(3.7, 1.0, rows), 2)
+    value = pd.Series(ccy).map(USD_VALUE).fillna(1.0).to_numpy()
+    scale = 10.0 ** pd.Series(ccy).map(DECIMALS).fillna(2).to_numpy()
+    amount = np.round(usd / value * scale) / scale
+    fee = np.round((amount * 0.029 + 0.30 / value) * scale) / scale
+    amount = np.where(refund, -amount, amount)
+    fee = np.where(refund, 0.0, fee)
+    return pd.DataFrame({
+        "date": rng.choice(days, rows),
+        "amount": amount,
+        "currency": ccy,
+        "fee": fee,
+        "source": rng.choice(np.array(cfg.sources, dtype=object), rows),
+        "type": np.where(refund, "refund", "order"),
+        "status": rng.choice(np.array(["paid", "paid", "paid", "pending"], dtype=object), rows),
+        "reference": [f"{prefix}_{i:010d}" for i in range(rows)],
+    }, columns=TX_COLUMNS)
+
+def write_csvs(cfg: SyntheticConfig, data_dir: str) -> list:
+    """Reparte cfg.rows transacciones en cfg.files CSV dentro de data_dir."""
+    os.makedirs(data_dir, exist_ok=True)
+    df = transactions(cfg, cfg.rows, prefix="csv")
+    paths = []
+    for i, part in enumerate(np.array_split(np.arange(len(df)), max(1, cfg.files))):
+        path = os.path.join(data_dir, f"transactions_{i:02d}.csv")
+        df.iloc[part].to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def generic_items(cfg: SyntheticConfig) -> list:
+    """Objetos de la fuente JSON genérica (mismo esquema que los CSV, referencias propias)."""
+    df = transactions(cfg, cfg.generic_rows, prefix="gen", seed_offset=1)
+    return df.to_dict("records")
+
+def fx_rates(cfg: SyntheticConfig, pad_days: int = 10) -> dict:
+    """
+    Valor en USD de una unidad de cada moneda por día laborable: {"YYYY-MM-DD": {"EUR": 1.08, ...}}.
+    Los fines de semana no hay publicación (la consolidación usa el último tipo publicado).
+    El rango se amplía `pad_days` antes del inicio para cubrir el margen de FX_MAX_STALENESS_DAYS.
+    """
+    rng = np.random.default_rng(cfg.seed + 2)
+    days = pd.date_range(pd.Timestamp(cfg.start) - pd.Timedelta(days=pad_days), cfg.end, freq="B")
+    ccys = sorted(set(USD_VALUE) | {c.upper() for c in cfg.currencies})
+    walk = np.exp(np.cumsum(rng.normal(0.0, 0.004, (len(days), len(ccys))), axis=0))
+    start_value = np.array([USD_VALUE.get(c, 1.0) for c in ccys])
+    values = walk * start_value
+    values[:, ccys.index("USD")] = 1.0
+    return {d.strftime("%Y-%m-%d"): dict(zip(ccys, row.tolist())) for d, row in zip(days, values)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera CSV sintéticos para la consolidación")
+    parser.add_argument("--out", default="data")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--currencies", default="EUR,USD,GBP,JPY")
+    parser.add_argument("--sources", default="shopify,pos,marketplace")
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--end", default="2024-06-30")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    cfg = SyntheticConfig(rows=args.rows, files=args.files, currencies=tuple(args.currencies.split(",")),
+                          sources=tuple(args.sources.split(",")), start=args.start, end=args.end, seed=args.seed)
+    for path in write_csvs(cfg, args.out):
+        print(f"[INFO] {path}")
+
+if __name__ == "__main__":
+    main()
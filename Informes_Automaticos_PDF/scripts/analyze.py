@@ -1,16 +1,304 @@
 # scripts/analyze.py
+# Motor de análisis multi-ticker
+# - Todos los tickers en un único frame ancho (fecha × ticker) leído del almacén de barras
+# - Indicadores configurables: retornos, retorno acumulado, SMA y EMA de varias ventanas,
+#   volatilidad anualizada y drawdown; cada ticker sobre sus propias barras (sin rellenar
+#   los días en que no cotizó, así las ventanas cuentan barras reales como antes)
+# - Incremental: los indicadores se guardan en data/analysis/ y sólo se recalcula la cola afectada
+#   por barras nuevas o modificadas (ventanas móviles con su margen, EMA/acumulados desde el último estado)
+# - Escribe data/<TICKER>_analyzed.csv con la ventana del periodo para visualize.py
+# Uso: python scripts/analyze.py --tickers AAPL,MSFT,AMZN --sma 10,50 --ema 12,26 --vol 20
 
-import pandas as pd
 import os
+import json
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
 
-def analyze_stock(ticker):
-    df = pd.read_csv(f"data/{ticker}.csv", parse_dates=["Date"], index_col="Date")
-    df["Return"] = df["Adj Close"].pct_change()
-    df["Cumulative Return"] = (1 + df["Return"]).cumprod()
-    df["SMA_10"] = df["Adj Close"].rolling(window=10).mean()
-    df.to_csv(f"data/{ticker}_analyzed.csv")
+import numpy as np
+import pandas as pd
+
+from bar_store import BarStore, parquet_available
+from defaults import DEFAULT_TICKERS
+from download_data import period_start
+
+@dataclass
+class IndicatorConfig:
+    sma: tuple = (10,)
+    ema: tuple = ()
+    volatility: tuple = ()
+    drawdown: bool = True
+    periods_per_year: int = 252
+    field: str = "Adj Close"
+
+    @property
+    def names(self) -> List[str]:
+        out = ["Return", "Cumulative Return"]
+        out += [f"SMA_{w}" for w in self.sma] + [f"EMA_{s}" for s in self.ema]
+        out += [f"Vol_{w}" for w in self.volatility]
+        if self.drawdown:
+            out += ["Peak", "Drawdown"]
+        return out
+
+    @property
+    def lookback(self) -> int:
+        """Barras propias anteriores necesarias para recalcular la cola de las ventanas móviles."""
+        return max([1] + [w - 1 for w in self.sma] + [w for w in self.volatility])
+
+# indicadores internos (estado del incremental) que no se exportan
+INTERNAL = {"Peak"}
+# cambiar al modificar el cálculo: invalida los indicadores guardados
+ANALYSIS_VERSION = 2
+
+def wide_prices(bars: Dict[str, pd.DataFrame], field: str = "Adj Close") -> pd.DataFrame:
+    """Frame fecha × ticker; NaN en las fechas en que un ticker no cotizó (festivos de otro mercado)."""
+    if not bars:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="Date"))
+    prices = pd.concat({t: df[field] for t, df in bars.items()}, axis=1).sort_index()
+    prices.index.name = "Date"
+    return prices
+
+def _last_valid(df: Optional[pd.DataFrame], col: str, before: pd.Timestamp) -> Optional[float]:
+    # estado del incremental: último valor guardado del ticker antes de la cola
+    if df is None or col not in df.columns:
+        return None
+    s = df[col][df.index < before].dropna()
+    return float(s.iloc[-1]) if len(s) else None
+
+def _series_indicators(ctx: pd.Series, tail_index: pd.Index, cfg: IndicatorConfig,
+                       seeds: Dict[str, Optional[float]]) -> Dict[str, pd.Series]:
+    """Indicadores de un ticker sobre sus propias barras (ctx = contexto previo + cola, sin NaN)."""
+    ret = ctx.pct_change(fill_method=None)
+    tail_ret = ret.loc[tail_index]
+    tail = ctx.loc[tail_index]
+    out = {"Return": tail_ret}
+    # acumulado: producto de (1 + retorno) desde el estado anterior
+    cum = (1 + tail_ret).cumprod()
+    s = seeds.get("Cumulative Return")
+    out["Cumulative Return"] = cum * (1.0 if s is None else s)
+    for w in cfg.sma:
+        out[f"SMA_{w}"] = ctx.rolling(w).mean().loc[tail_index]
+    for span in cfg.ema:
+        # adjust=False es recursiva: anteponer el último valor guardado reproduce el cálculo completo
+        s = seeds.get(f"EMA_{span}")
+        x = tail if s is None else pd.concat([pd.Series([s]), tail.reset_index(drop=True)])
+        out[f"EMA_{span}"] = pd.Series(x.ewm(span=span, adjust=False).mean().to_numpy()[-len(tail):],
+                                       index=tail_index)
+    for w in cfg.volatility:
+        out[f"Vol_{w}"] = ret.rolling(w).std().loc[tail_index] * np.sqrt(cfg.periods_per_year)
+    if cfg.drawdown:
+        s = seeds.get("Peak")
+        peak = tail.cummax() if s is None else tail.cummax().clip(lower=s)
+        out["Peak"] = peak
+        out["Drawdown"] = tail / peak - 1
+    return out
+
+def compute_indicators(prices: pd.DataFrame, cfg: IndicatorConfig, start_pos: int = 0,
+                       prev: Optional[Dict[str, pd.DataFrame]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Indicadores de las filas prices[start_pos:]. Cada ticker se calcula sobre sus propias barras
+    (las fechas en que no cotizó quedan en NaN y no cuentan en las ventanas). Con start_pos > 0,
+    el contexto son las últimas `cfg.lookback` barras del ticker anteriores a la cola y `prev`
+    aporta su último estado (EMA, acumulado, máximo).
+    """
+    out_index = prices.index[start_pos:]
+    start_date = out_index[0] if len(out_index) else None
+    per_ticker = {}
+    for t in prices.columns:
+        own = prices[t].dropna()
+        if start_date is None:
+            own_tail = own.iloc[:0]
+            ctx = own_tail
+        else:
+            k = int(own.index.searchsorted(start_date))
+            own_tail = own.iloc[k:]
+            ctx = own.iloc[max(0, k - cfg.lookback):] if start_pos > 0 else own_tail
+        seeds = {}
+        if start_pos > 0 and prev:
+            for n in ["Cumulative Return", "Peak"] + [f"EMA_{span}" for span in cfg.ema]:
+                seeds[n] = _last_valid(prev.get(n), t, start_date)
+        per_ticker[t] = _series_indicators(ctx, own_tail.index, cfg, seeds)
+    return {n: pd.DataFrame({t: per_ticker[t][n] for t in prices.columns}, index=out_index,
+                            columns=prices.columns, dtype="float64")
+            for n in cfg.names}
+
+def first_changed(new: pd.DataFrame, old: pd.DataFrame) -> Optional[int]:
+    """Posición de la primera fecha con precios distintos en los tickers comunes (None = sin cambios)."""
+    if not old.index.isin(new.index).all():
+        return 0
+    common = new.columns.intersection(old.columns)
+    n, o = new[common], old[common].reindex(new.index)
+    diff = (~((n == o) | (n.isna() & o.isna()))).any(axis=1).to_numpy()
+    return int(diff.argmax()) if diff.any() else None
+
+class IndicatorStore:
+    """
+    data/analysis/: prices y un fichero ancho por indicador (Parquet o CSV) + config.json.
+    Si cambia la configuración de indicadores se recalcula todo.
+    """
+    def __init__(self, root: str = "data/analysis", fmt: str = "auto"):
+        self.root = root
+        self.fmt = ("parquet" if parquet_available() else "csv") if fmt == "auto" else fmt
+        os.makedirs(self.root, exist_ok=True)
+        self.config_path = os.path.join(root, "config.json")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name.replace(' ', '_')}.{self.fmt}")
+
+    def _read(self, name: str) -> pd.DataFrame:
+        path = self._path(name)
+        if self.fmt == "parquet":
+            df = pd.read_parquet(path)
+        else:
+            # round_trip: los precios releídos son idénticos y first_changed no ve cambios falsos
+            df = pd.read_csv(path, parse_dates=["Date"], index_col="Date", float_precision="round_trip")
+        df.index.name = "Date"
+        return df
+
+    def _write(self, name: str, df: pd.DataFrame):
+        path = self._path(name)
+        tmp = path + ".tmp"
+        if self.fmt == "parquet":
+            df.to_parquet(tmp)
+        else:
+            df.to_csv(tmp)
+        os.replace(tmp, path)
+
+    def load(self, cfg: IndicatorConfig) -> tuple:
+        """(precios, indicadores) guardados con la misma configuración, o (None, None)."""
+        try:
+            with open(self.config_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved != json.loads(json.dumps({**asdict(cfg), "version": ANALYSIS_VERSION})):
+                return None, None
+            return self._read("prices"), {n: self._read(n) for n in cfg.names}
+        except (OSError, ValueError):
+            return None, None
+
+    def save(self, cfg: IndicatorConfig, prices: pd.DataFrame, frames: Dict[str, pd.DataFrame]):
+        self._write("prices", prices)
+        for name, df in frames.items():
+            self._write(name, df)
+        tmp = self.config_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**asdict(cfg), "version": ANALYSIS_VERSION}, f, indent=2)
+        os.replace(tmp, self.config_path)
+
+def update_indicators(prices: pd.DataFrame, store: IndicatorStore, cfg: IndicatorConfig,
+                      full: bool = False) -> Dict[str, pd.DataFrame]:
+    """Indicadores de todo el histórico; sólo se calcula lo que cambió desde la última ejecución."""
+    old_prices, old = (None, None) if full else store.load(cfg)
+    if old_prices is None:
+        frames = compute_indicators(prices, cfg)
+        print(f"[INFO] Indicadores completos: {prices.shape[1]} tickers × {len(prices)} fechas")
+        store.save(cfg, prices, frames)
+        return frames
+
+    common = [t for t in prices.columns if t in old_prices.columns]
+    added = [t for t in prices.columns if t not in old_prices.columns]
+    pos = first_changed(prices[common], old_prices) if common else None
+    if pos is None and not added and len(common) == len(old_prices.columns):
+        print("[INFO] Indicadores al día: sin barras nuevas")
+        return old
+
+    parts = []
+    if common:
+        p = prices[common]
+        if pos is None:
+            parts.append({n: old[n][common].reindex(p.index) for n in cfg.names})
+        else:
+            tail = compute_indicators(p, cfg, pos, {n: old[n][common] for n in cfg.names})
+            head = {n: old[n][common].reindex(p.index[:pos]) for n in cfg.names}
+            parts.append({n: pd.concat([head[n], tail[n]]) for n in cfg.names})
+    if added:
+        parts.append(compute_indicators(prices[added], cfg))
+    frames = {n: pd.concat([part[n] for part in parts], axis=1)[list(prices.columns)] for n in cfg.names}
+    recomputed = len(prices) - pos if pos is not None else 0
+    print(f"[INFO] Indicadores: {recomputed} fechas recalculadas en {len(common)} tickers, "
+          f"{len(added)} tickers nuevos")
+    store.save(cfg, prices, frames)
+    return frames
+
+def ticker_view(ticker: str, bars: pd.DataFrame, frames: Dict[str, pd.DataFrame],
+                first: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Barras + indicadores de un ticker en la ventana; el acumulado se rebasa al inicio de la ventana."""
+    df = bars if first is None else bars[bars.index >= first]
+    df = df.copy()
+    for name, wide in frames.items():
+        if name not in INTERNAL:
+            df[name] = wide[ticker].reindex(df.index)
+    if not df.empty:
+        cum = df["Cumulative Return"]
+        base = cum.iloc[0] if pd.notna(cum.iloc[0]) else 1.0
+        df["Cumulative Return"] = cum / base
+        df.iloc[0, df.columns.get_loc("Cumulative Return")] = np.nan
     return df
 
+def read_bars(tickers, data_dir: str = "data", interval: str = "1d") -> Dict[str, pd.DataFrame]:
+    bar_store = BarStore(os.path.join(data_dir, "bars", interval))
+    bars = {t: df for t in tickers if not (df := bar_store.read(t)).empty}
+    for t in tickers:
+        if t not in bars:
+            print(f"[WARN] {t}: sin barras en {bar_store}")
+    return bars
+
+def analyze_bars(bars: Dict[str, pd.DataFrame], data_dir: str = "data", period: str = "3mo",
+                 interval: str = "1d", cfg: Optional[IndicatorConfig] = None, full: bool = False,
+                 write_csv: bool = True) -> Dict[str, pd.DataFrame]:
+    """Indicadores de las barras ya cargadas; devuelve la ventana del periodo por ticker."""
+    cfg = cfg or IndicatorConfig()
+    prices = wide_prices(bars, cfg.field)
+    frames = update_indicators(prices, IndicatorStore(os.path.join(data_dir, "analysis", interval)), cfg, full)
+
+    first = period_start(period, prices.index.max()) if len(prices) else None
+    out = {}
+    for t in bars:
+        df = ticker_view(t, bars[t], frames, first)
+        if write_csv:
+            df.to_csv(os.path.join(data_dir, f"{t}_analyzed.csv"))
+        out[t] = df
+    return out
+
+def load_analysis(bars: Dict[str, pd.DataFrame], data_dir: str = "data", period: str = "3mo",
+                  interval: str = "1d", cfg: Optional[IndicatorConfig] = None) -> Dict[str, pd.DataFrame]:
+    """Ventanas por ticker con los indicadores guardados, sin recalcular nada."""
+    cfg = cfg or IndicatorConfig()
+    store = IndicatorStore(os.path.join(data_dir, "analysis", interval))
+    prices, frames = store.load(cfg)
+    if frames is None:
+        raise ValueError(f"No hay indicadores con esta configuración en {store.root}: ejecuta el análisis")
+    first = period_start(period, prices.index.max()) if len(prices) else None
+    out = {}
+    for t in bars:
+        if t not in prices.columns:
+            print(f"[WARN] {t}: sin indicadores guardados")
+            continue
+        out[t] = ticker_view(t, bars[t], frames, first)
+    return out
+
+def analyze_tickers(tickers, data_dir: str = "data", period: str = "3mo", interval: str = "1d",
+                    cfg: Optional[IndicatorConfig] = None, full: bool = False) -> Dict[str, pd.DataFrame]:
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t.strip()))
+    return analyze_bars(read_bars(tickers, data_dir, interval), data_dir, period, interval, cfg, full)
+
+def analyze_stock(ticker):
+    return analyze_tickers([ticker]).get(ticker.upper())
+
+def parse_windows(s: str) -> tuple:
+    return tuple(int(x) for x in s.split(",") if x.strip())
+
 if __name__ == "__main__":
-    for ticker in ["AAPL", "MSFT", "AMZN"]:
-        analyze_stock(ticker)
+    parser = argparse.ArgumentParser(description="Indicadores multi-ticker incrementales")
+    parser.add_argument("--tickers", default=",".join(DEFAULT_TICKERS))
+    parser.add_argument("--period", default="3mo", help="Ventana de los CSV analizados")
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--sma", default="10", help="Ventanas de medias simples, p. ej. 10,50")
+    parser.add_argument("--ema", default="", help="Spans de medias exponenciales, p. ej. 12,26")
+    parser.add_argument("--vol", default="", help="Ventanas de volatilidad anualizada, p. ej. 20")
+    parser.add_argument("--no-drawdown", action="store_true")
+    parser.add_argument("--full", action="store_true", help="Recalcula todos los indicadores")
+    args = parser.parse_args()
+    cfg = IndicatorConfig(sma=parse_windows(args.sma), ema=parse_windows(args.ema),
+                          volatility=parse_windows(args.vol), drawdown=not args.no_drawdown)
+    analyze_tickers(args.tickers.split(","), args.data_dir, args.period, args.interval, cfg, args.full)
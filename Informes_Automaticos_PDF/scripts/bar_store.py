@@ -0,0 +1,122 @@
+# scripts/bar_store.py
+# Almacén local de barras por ticker
+# - data/bars/<interval>/<TICKER>.parquet (o .csv si no hay pyarrow), columnas Date + BAR_COLUMNS
+# - last_date() sólo lee la columna Date para decidir desde dónde pedir el delta
+# - append() fusiona por fecha (la barra nueva gana) y reescribe el fichero de forma atómica
+# - _coverage.json: desde qué fecha se pidió cada ticker y cuál fue la primera barra devuelta
+#   (un histórico más corto que el periodo no se vuelve a pedir entero en cada ejecución)
+
+import os
+import json
+from typing import Optional
+
+import pandas as pd
+
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def normalize_bars(df: pd.DataFrame) -> pd.DataFrame:
+    """Índice Date (sin zona, ordenado, sin duplicados) y columnas BAR_COLUMNS en float64."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([], name="Date"), dtype="float64")
+    df = df.reindex(columns=BAR_COLUMNS).apply(pd.to_numeric, errors="coerce").astype("float64")
+    idx = pd.DatetimeIndex(df.index)
+    if idx.tz is not None:
+        idx = idx.tz_localize(None)
+    df.index = idx.rename("Date")
+    df = df.dropna(how="all")
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+class BarStore:
+    """Un fichero columnar por ticker; sólo se reescribe el de los tickers con barras nuevas."""
+    def __init__(self, root: str = "data/bars", fmt: str = "auto"):
+        self.root = root
+        if fmt == "auto":
+            fmt = "parquet" if parquet_available() else "csv"
+        if fmt not in ("parquet", "csv"):
+            raise ValueError(f"Formato de barras no soportado: {fmt}")
+        self.fmt = fmt
+        os.makedirs(self.root, exist_ok=True)
+        self._coverage = None
+
+    def path(self, ticker: str) -> str:
+        return os.path.join(self.root, f"{ticker.upper()}.{self.fmt}")
+
+    def _read(self, ticker: str, columns=None) -> pd.DataFrame:
+        path = self.path(ticker)
+        if self.fmt == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        return pd.read_csv(path, usecols=columns, parse_dates=["Date"])
+
+    def read(self, ticker: str, start: Optional[str] = None) -> pd.DataFrame:
+        if not os.path.exists(self.path(ticker)):
+            return normalize_bars(None)
+        df = normalize_bars(self._read(ticker).set_index("Date"))
+        return df[df.index >= pd.Timestamp(start)] if start else df
+
+    def date_range(self, ticker: str) -> Optional[tuple]:
+        """(primera, última) fecha guardada o None si el ticker no tiene barras."""
+        if not os.path.exists(self.path(ticker)):
+            return None
+        dates = pd.to_datetime(self._read(ticker, columns=["Date"])["Date"])
+        return (dates.min(), dates.max()) if len(dates) else None
+
+    def last_date(self, ticker: str) -> Optional[pd.Timestamp]:
+        rng = self.date_range(ticker)
+        return rng[1] if rng else None
+
+    def append(self, ticker: str, bars: pd.DataFrame) -> int:
+        """Añade o reemplaza barras por fecha. Devuelve cuántas fechas no estaban guardadas."""
+        bars = normalize_bars(bars)
+        if bars.empty:
+            return 0
+        old = self.read(ticker)
+        new_dates = int((~bars.index.isin(old.index)).sum())
+        merged = normalize_bars(pd.concat([old[~old.index.isin(bars.index)], bars]) if not old.empty else bars)
+        path = self.path(ticker)
+        tmp = path + ".tmp"
+        if self.fmt == "parquet":
+            merged.reset_index().to_parquet(tmp, index=False)
+        else:
+            merged.to_csv(tmp)
+        os.replace(tmp, path)
+        return new_dates
+
+    # --------------------
+    # Cobertura pedida al proveedor
+    # --------------------
+
+    def _coverage_path(self) -> str:
+        return os.path.join(self.root, "_coverage.json")
+
+    def coverage(self, ticker: str) -> Optional[dict]:
+        """
+        {"requested_from": fecha | None (sin límite), "first_returned": fecha} de la última descarga
+        completa del ticker, o None si no consta (almacenes anteriores a este fichero).
+        """
+        if self._coverage is None:
+            self._coverage = {}
+            if os.path.exists(self._coverage_path()):
+                with open(self._coverage_path(), encoding="utf-8") as f:
+                    self._coverage = json.load(f)
+        return self._coverage.get(ticker.upper())
+
+    def set_coverage(self, entries: dict):
+        """entries = {ticker: {"requested_from", "first_returned"}}; una sola escritura atómica."""
+        if not entries:
+            return
+        self.coverage("")  # carga lo guardado
+        self._coverage.update({t.upper(): v for t, v in entries.items()})
+        tmp = self._coverage_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._coverage, f, indent=2, sort_keys=True)
+        os.replace(tmp, self._coverage_path())
+
+    def __str__(self):
+        return self.root
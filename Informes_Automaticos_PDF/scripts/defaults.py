@@ -0,0 +1,4 @@
+# scripts/defaults.py
+# Valores por defecto compartidos por los scripts, sin dependencias: importarlo no carga pandas
+
+DEFAULT_TICKERS = ["AAPL", "MSFT", "AMZN"]
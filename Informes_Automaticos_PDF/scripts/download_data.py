@@ -1,17 +1,222 @@
 # scripts/download_data.py
+# Descarga incremental de barras de mercado
+# - Almacén local por ticker en data/bars/<interval>/ (bar_store.BarStore, Parquet o CSV)
+# - Tickers nuevos: una única petición por lotes con el periodo completo
+# - Tickers con histórico: una petición por lotes por cada última barra distinta (normalmente una),
+#   desde esa barra (se vuelve a pedir por si era parcial); un ticker parado no arrastra al resto
+# - Sólo se rellena hacia atrás si el periodo pedido va más allá de lo que ya se pidió al proveedor
+#   (cobertura en _coverage.json): un ticker con menos historia que el periodo no se repite entero
+# - Proveedor intercambiable: YFinanceProvider (red) o FixtureProvider (CSV locales, sin red)
+# - Escribe data/<TICKER>.csv con la ventana del periodo para los scripts siguientes
+# Uso: python scripts/download_data.py --tickers AAPL,MSFT,AMZN --period 3mo
+#      python scripts/download_data.py --fixtures tests_data/bars   (sin red)
+
+import os
+import argparse
+from typing import Dict, List, Optional
 
-import yfinance as yf
 import pandas as pd
-from datetime import datetime, timedelta
 
-def download_stock_data(tickers, period="3mo", interval="1d"):
+from bar_store import BarStore, normalize_bars
+from defaults import DEFAULT_TICKERS
+
+# periodos de yfinance expresados como desplazamiento hacia atrás
+PERIOD_OFFSETS = {
+    "1d": pd.DateOffset(days=1), "5d": pd.DateOffset(days=5), "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3), "6mo": pd.DateOffset(months=6), "1y": pd.DateOffset(years=1),
+    "2y": pd.DateOffset(years=2), "5y": pd.DateOffset(years=5), "10y": pd.DateOffset(years=10),
+}
+# si el periodo empieza antes de lo ya pedido al proveedor (p. ej. se pasa de 3mo a 1y), se rellena
+BACKFILL_SLACK = pd.Timedelta(days=7)
+# última barra tan por detrás de la más reciente: ticker parado o deslistado (se avisa)
+STALE_LAG = pd.Timedelta(days=7)
+
+def period_start(period: str, anchor: pd.Timestamp) -> Optional[pd.Timestamp]:
+    """Primera fecha del periodo que termina en `anchor` (None = sin límite, periodo "max")."""
+    anchor = pd.Timestamp(anchor).normalize()
+    if period == "max":
+        return None
+    if period == "ytd":
+        return anchor.replace(month=1, day=1)
+    if period not in PERIOD_OFFSETS:
+        raise ValueError(f"Periodo no soportado: {period}")
+    return anchor - PERIOD_OFFSETS[period]
+
+# --------------------
+# Proveedores de datos
+# --------------------
+
+class DataProvider:
+    """
+    Interfaz de los proveedores: una llamada = una petición por lotes para varios tickers.
+    Devuelve {ticker: barras} (índice Date, columnas BAR_COLUMNS); los tickers sin datos no aparecen.
+    """
+    name = "base"
+
+    def fetch(self, tickers: List[str], start: Optional[str] = None, period: Optional[str] = None,
+              interval: str = "1d") -> Dict[str, pd.DataFrame]:
+        raise NotImplementedError
+
+def split_batch(raw: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Separa la respuesta multi-ticker de yf.download (columnas (ticker, campo)) por ticker."""
+    if raw is None or raw.empty:
+        return {}
+    out = {}
+    if isinstance(raw.columns, pd.MultiIndex):
+        lvl = 0 if set(tickers) & set(raw.columns.get_level_values(0)) else 1
+        present = set(raw.columns.get_level_values(lvl))
+        for t in tickers:
+            if t in present:
+                out[t] = normalize_bars(raw.xs(t, axis=1, level=lvl))
+    elif len(tickers) == 1:
+        out[tickers[0]] = normalize_bars(raw)
+    return {t: df for t, df in out.items() if not df.empty}
+
+class YFinanceProvider(DataProvider):
+    name = "yfinance"
+
+    def fetch(self, tickers, start=None, period=None, interval="1d"):
+        import yfinance as yf  # sólo hace falta con red
+        kwargs = {"start": start} if start else {"period": period or "3mo"}
+        # auto_adjust=False: se conserva "Adj Close", que es la serie que usa el análisis
+        raw = yf.download(tickers, interval=interval, group_by="ticker", auto_adjust=False, actions=False,
+                          threads=True, progress=False, **kwargs)
+        return split_batch(raw, tickers)
+
+class FixtureProvider(DataProvider):
+    """
+    Barras desde <root>/<TICKER>.csv (columna Date + BAR_COLUMNS), sin red.
+    El periodo se cuenta desde la última barra de cada fichero. `calls` registra cada petición.
+    """
+    name = "fixtures"
+
+    def __init__(self, root: str):
+        self.root = root
+        self.calls: List[dict] = []
+
+    def fetch(self, tickers, start=None, period=None, interval="1d"):
+        self.calls.append({"tickers": list(tickers), "start": start, "period": period, "interval": interval})
+        out = {}
+        for t in tickers:
+            path = os.path.join(self.root, f"{t}.csv")
+            if not os.path.exists(path):
+                continue
+            df = normalize_bars(pd.read_csv(path, parse_dates=["Date"], index_col="Date"))
+            if start:
+                df = df[df.index >= pd.Timestamp(start)]
+            elif not df.empty:
+                first = period_start(period or "3mo", df.index.max())
+                df = df if first is None else df[df.index >= first]
+            if not df.empty:
+                out[t] = df
+        return out
+
+# --------------------
+# Descarga incremental
+# --------------------
+
+def needs_backfill(rng: tuple, coverage: Optional[dict], period: str) -> bool:
+    """¿Hay que pedir el periodo completo de un ticker que ya tiene barras (rng = (primera, última))?"""
+    first = period_start(period, rng[1])
+    if coverage is None:
+        # sin cobertura registrada (almacén anterior): se rellena una vez si el histórico es corto
+        return first is None or rng[0] > first + BACKFILL_SLACK
+    # el almacén empieza después de lo que devolvió el proveedor: faltan barras guardadas
+    if rng[0] > pd.Timestamp(coverage["first_returned"]) + BACKFILL_SLACK:
+        return True
+    requested = coverage.get("requested_from")
+    if requested is None:
+        return False
+    # sólo si el periodo llega más atrás que lo ya pedido (el proveedor no tenía más, no se repite)
+    return first is None or first < pd.Timestamp(requested) - BACKFILL_SLACK
+
+def _merge_coverage(old: Optional[dict], requested: Optional[pd.Timestamp], returned: pd.Timestamp) -> dict:
+    # append() conserva lo guardado: la cobertura es la unión de lo pedido
+    req = None if requested is None else requested.strftime("%Y-%m-%d")
+    ret = returned.strftime("%Y-%m-%d")
+    if old:
+        old_req = old.get("requested_from")
+        req = None if req is None or old_req is None else min(req, old_req)
+        ret = min(ret, old["first_returned"])
+    return {"requested_from": req, "first_returned": ret}
+
+def sync_bars(tickers: List[str], store: BarStore, provider: DataProvider, period: str = "3mo",
+              interval: str = "1d", full: bool = False) -> Dict[str, int]:
+    """Trae al store las barras que faltan. Devuelve las fechas nuevas por ticker."""
+    bootstrap, delta = [], {}
+    for t in tickers:
+        rng = None if full else store.date_range(t)
+        if rng is None or needs_backfill(rng, store.coverage(t), period):
+            bootstrap.append(t)
+        else:
+            delta[t] = rng[1]
+
+    added = {}
+    if bootstrap:
+        fetched = provider.fetch(bootstrap, period=period, interval=interval)
+        coverage = {}
+        for t in bootstrap:
+            if t in fetched:
+                bars = fetched[t]
+                added[t] = store.append(t, bars)
+                coverage[t] = _merge_coverage(store.coverage(t), period_start(period, bars.index.max()),
+                                              bars.index.min())
+            else:
+                print(f"[WARN] {t}: sin datos del proveedor {provider.name}")
+        store.set_coverage(coverage)
+
+    # una petición por lotes por cada última barra distinta (lo repetido se sustituye)
+    groups: Dict[pd.Timestamp, List[str]] = {}
+    for t, last in delta.items():
+        groups.setdefault(last, []).append(t)
+    newest = max(groups, default=None)
+    for last, group in sorted(groups.items()):
+        since = last.strftime("%Y-%m-%d")
+        if newest - last > STALE_LAG:
+            print(f"[WARN] {', '.join(group)}: última barra {since}, {(newest - last).days} días por detrás "
+                  f"(¿ticker parado o deslistado?)")
+        try:
+            fetched = provider.fetch(group, start=since, interval=interval)
+        except Exception as e:
+            print(f"[WARN] Delta desde {since} no disponible ({e}); se usan las barras guardadas")
+            fetched = {}
+        for t in group:
+            added[t] = store.append(t, fetched[t]) if t in fetched else 0
+    print(f"[INFO] Barras: {len(bootstrap)} tickers completos, {len(delta)} incrementales "
+          f"({len(groups)} peticiones), {sum(added.values())} fechas nuevas")
+    return added
+
+def download_stock_data(tickers, period="3mo", interval="1d", provider: Optional[DataProvider] = None,
+                        store: Optional[BarStore] = None, data_dir: str = "data", full: bool = False):
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t.strip()))
+    provider = provider or YFinanceProvider()
+    store = store or BarStore(os.path.join(data_dir, "bars", interval))
+    sync_bars(tickers, store, provider, period, interval, full)
+
+    # ventana del periodo contada desde la última barra disponible
+    bars = {t: store.read(t) for t in tickers}
+    last = max((df.index.max() for df in bars.values() if not df.empty), default=None)
+    first = period_start(period, last) if last is not None else None
     data = {}
-    for ticker in tickers:
-        df = yf.download(ticker, period=period, interval=interval)
-        df.to_csv(f"data/{ticker}.csv")
+    for ticker, df in bars.items():
+        if df.empty:
+            continue
+        if first is not None:
+            df = df[df.index >= first]
+        df.to_csv(os.path.join(data_dir, f"{ticker}.csv"))
         data[ticker] = df
     return data
 
 if __name__ == "__main__":
-    tickers = ["AAPL", "MSFT", "AMZN"]
-    download_stock_data(tickers)
+    parser = argparse.ArgumentParser(description="Descarga incremental de barras de mercado")
+    parser.add_argument("--tickers", default=",".join(DEFAULT_TICKERS))
+    parser.add_argument("--period", default="3mo")
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--fixtures", default="", help="Carpeta con <TICKER>.csv: proveedor local sin red")
+    parser.add_argument("--full", action="store_true", help="Ignora el histórico y pide el periodo completo")
+    args = parser.parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    provider = FixtureProvider(args.fixtures) if args.fixtures else YFinanceProvider()
+    download_stock_data(args.tickers.split(","), args.period, args.interval, provider=provider,
+                        data_dir=args.data_dir, full=args.full)
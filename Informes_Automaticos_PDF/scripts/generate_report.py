@@ -1,23 +1,302 @@
 # scripts/generate_report.py
+# Generación del PDF con WeasyPrint
+# - Importaciones perezosas: --help y las ejecuciones sin cambios no cargan WeasyPrint ni pandas
+# - Si el HTML y las imágenes no cambian desde el último PDF (clave en <pdf>.key) no se regenera
+# - ReportRenderer: WeasyPrint, fuentes y hoja de estilos compilada una sola vez por proceso
+# - Modo worker (--worker): proceso persistente que atiende trabajos de una carpeta de cola
+#   (--queue) o de un socket Unix (--socket); informa del arranque y del render de cada trabajo
+# Uso: python scripts/generate_report.py --format svg
+#      python scripts/generate_report.py --worker --queue reports/queue
+#      python scripts/generate_report.py --submit reports/cliente_a.html --output reports/cliente_a.pdf \
+#          --queue reports/queue
 
-from weasyprint import HTML
 import os
+import sys
+import json
+import time
+import uuid
+import base64
+import hashlib
+import argparse
 
-def create_html():
-    tickers = ["AAPL", "MSFT", "AMZN"]
+MIME = {"png": "image/png", "svg": "image/svg+xml"}
+CHARTS = ["price", "return"]
+
+REPORT_CSS = """
+@page { size: A4; margin: 1.5cm; }
+body { font-family: "DejaVu Sans", Arial, sans-serif; font-size: 10pt; }
+h1 { font-size: 18pt; }
+h2 { font-size: 13pt; margin-top: 0.6cm; }
+img { max-width: 100%; }
+hr { border: 0; border-top: 1px solid #ccc; }
+"""
+
+def create_html(tickers=None, fmt="png"):
+    if not tickers:
+        from defaults import DEFAULT_TICKERS
+        tickers = DEFAULT_TICKERS
     content = "<h1>Informe Semanal de Acciones</h1>"
     for ticker in tickers:
         content += f"<h2>{ticker}</h2>"
-        content += f'<img src="data/{ticker}_price.png" width="600"><br>'
-        content += f'<img src="data/{ticker}_return.png" width="600"><br><hr>'
+        content += f'<img src="data/{ticker}_price.{fmt}" width="600"><br>'
+        content += f'<img src="data/{ticker}_return.{fmt}" width="600"><br><hr>'
+    return content
+
+def data_uri(data: bytes, fmt: str) -> str:
+    return f"data:{MIME[fmt]};base64,{base64.b64encode(data).decode('ascii')}"
+
+def create_html_embedded(images, fmt="png"):
+    """Mismo informe con las imágenes incrustadas: images = {ticker: {"price": bytes, "return": bytes}}."""
+    content = "<h1>Informe Semanal de Acciones</h1>"
+    for ticker, charts in images.items():
+        content += f"<h2>{ticker}</h2>"
+        for kind in CHARTS:
+            if kind in charts:
+                content += f'<img src="{data_uri(charts[kind], fmt)}" width="600"><br>'
+        content += "<hr>"
     return content
 
-def generate_pdf():
-    html_content = create_html()
+# --------------------
+# Render (WeasyPrint caliente)
+# --------------------
+
+class ReportRenderer:
+    """WeasyPrint importado, fuentes configuradas y CSS compilado una vez; luego sólo se renderiza."""
+    def __init__(self, css: str = REPORT_CSS):
+        t0 = time.perf_counter()
+        from weasyprint import HTML, CSS
+        from weasyprint.text.fonts import FontConfiguration
+        t1 = time.perf_counter()
+        self._html = HTML
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(string=css, font_config=self.font_config)
+        # un documento mínimo carga Pango y las fuentes antes del primer trabajo real
+        self._html(string="<p>warm-up</p>").write_pdf(stylesheets=[self.stylesheet],
+                                                      font_config=self.font_config)
+        t2 = time.perf_counter()
+        self.startup = {"import_s": round(t1 - t0, 3), "warmup_s": round(t2 - t1, 3),
+                        "total_s": round(t2 - t0, 3)}
+
+    def render(self, html: str, output: str, base_url: str = ".") -> float:
+        t0 = time.perf_counter()
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        tmp = output + ".tmp"
+        self._html(string=html, base_url=base_url).write_pdf(tmp, stylesheets=[self.stylesheet],
+                                                             font_config=self.font_config)
+        os.replace(tmp, output)
+        return round(time.perf_counter() - t0, 3)
+
+_RENDERER = None
+
+def renderer() -> ReportRenderer:
+    global _RENDERER
+    if _RENDERER is None:
+        _RENDERER = ReportRenderer()
+        st = _RENDERER.startup
+        print(f"[TIME] Arranque de WeasyPrint: {st['total_s']:.3f} s "
+              f"(import {st['import_s']:.3f} s, fuentes y CSS {st['warmup_s']:.3f} s)")
+    return _RENDERER
+
+def report_key(html: str, files=()) -> str:
+    """Huella del HTML y de los ficheros que referencia (ruta, tamaño y fecha de modificación)."""
+    h = hashlib.sha1(REPORT_CSS.encode("utf-8"))
+    h.update(html.encode("utf-8"))
+    for path in files:
+        st = os.stat(path) if os.path.exists(path) else None
+        h.update(f"{path}|{st.st_size if st else -1}|{st.st_mtime_ns if st else -1}".encode("utf-8"))
+    return h.hexdigest()
+
+def _up_to_date(output: str, key: str) -> bool:
+    try:
+        with open(output + ".key", encoding="utf-8") as f:
+            return os.path.exists(output) and f.read().strip() == key
+    except OSError:
+        return False
+
+def write_pdf(html_content, output="reports/weekly_report.pdf", base_url=".", files=(), force=False) -> bool:
+    """Genera el PDF salvo que ya exista uno con la misma clave. Devuelve True si se ha renderizado."""
+    key = report_key(html_content, files)
+    if not force and _up_to_date(output, key):
+        print(f"[INFO] Informe al día: {output}")
+        return False
+    render_s = renderer().render(html_content, output, base_url)
+    with open(output + ".key", "w", encoding="utf-8") as f:
+        f.write(key)
+    print(f"[TIME] Render {output}: {render_s:.3f} s")
+    return True
+
+def generate_pdf(tickers=None, fmt="png", force=False):
+    if not tickers:
+        from defaults import DEFAULT_TICKERS
+        tickers = DEFAULT_TICKERS
+    html_content = create_html(tickers, fmt)
     with open("reports/report.html", "w") as f:
         f.write(html_content)
-    HTML("reports/report.html").write_pdf("reports/weekly_report.pdf")
+    files = [f"data/{t}_{kind}.{fmt}" for t in tickers for kind in CHARTS]
+    # las rutas de las imágenes son relativas a la raíz del proyecto, no a reports/
+    return write_pdf(html_content, "reports/weekly_report.pdf", base_url=".", files=files, force=force)
+
+# --------------------
+# Worker: cola en carpeta o socket Unix
+# --------------------
+
+def run_job(job) -> dict:
+    """
+    Trabajo: {"output", "html" | "html_file", "base_url"?}. Devuelve el resultado con render_s.
+    Nunca lanza: un trabajo mal formado o fallido devuelve {"ok": False, "error"} y el worker sigue.
+    """
+    if not isinstance(job, dict) or not job.get("output") or not ("html" in job or job.get("html_file")):
+        return {"output": job.get("output", "") if isinstance(job, dict) else "", "ok": False,
+                "error": "trabajo no válido: se esperaba {\"output\", \"html\" | \"html_file\"}"}
+    output = str(job["output"])
+    try:
+        if "html" in job:
+            html, base_url = job["html"], job.get("base_url", ".")
+        else:
+            with open(job["html_file"], encoding="utf-8") as f:
+                html = f.read()
+            base_url = job.get("base_url", os.path.dirname(os.path.abspath(job["html_file"])))
+        render_s = renderer().render(html, output, base_url)
+        return {"output": output, "ok": True, "render_s": render_s}
+    except Exception as e:
+        return {"output": output, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+def run_payload(payload) -> dict:
+    """Decodifica un trabajo en JSON (str o bytes) y lo ejecuta; el JSON inválido también es un resultado."""
+    try:
+        job = json.loads(payload)
+    except ValueError as e:
+        return {"output": "", "ok": False, "error": f"trabajo no válido: {e}"}
+    return run_job(job)
+
+def _write_json(path: str, obj: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def submit_job(queue_dir: str, output: str, html: str = "", html_file: str = "", base_url: str = "") -> str:
+    """Deja un trabajo en la cola (escritura atómica). Devuelve su id."""
+    os.makedirs(queue_dir, exist_ok=True)
+    job_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    job = {"output": os.path.abspath(output)}
+    if html_file:
+        job["html_file"] = os.path.abspath(html_file)
+    else:
+        job["html"] = html
+    if base_url or not html_file:
+        job["base_url"] = os.path.abspath(base_url or ".")
+    _write_json(os.path.join(queue_dir, f"{job_id}.json"), job)
+    return job_id
+
+def wait_result(queue_dir: str, job_id: str, timeout: float = 300.0, poll_s: float = 0.05) -> dict:
+    path = os.path.join(queue_dir, "done", f"{job_id}.json")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        time.sleep(poll_s)
+    raise TimeoutError(f"Sin respuesta del worker para {job_id} en {timeout:.0f} s")
+
+def serve_queue(queue_dir: str, poll_s: float = 0.2, once: bool = False):
+    """Atiende <queue>/*.json en orden; el resultado queda en <queue>/done/<id>.json."""
+    done_dir = os.path.join(queue_dir, "done")
+    os.makedirs(done_dir, exist_ok=True)
+    print(f"[INFO] Worker atendiendo la cola {queue_dir}")
+    while True:
+        names = sorted(n for n in os.listdir(queue_dir) if n.endswith(".json"))
+        for name in names:
+            claimed = os.path.join(queue_dir, name + ".working")
+            try:
+                # el renombrado reserva el trabajo aunque haya varios workers sobre la misma cola
+                os.replace(os.path.join(queue_dir, name), claimed)
+            except FileNotFoundError:
+                continue
+            # siempre hay respuesta en done/ (quien espera no se queda colgado) y se libera la reserva
+            try:
+                with open(claimed, encoding="utf-8") as f:
+                    result = run_payload(f.read())
+            except Exception as e:
+                result = {"output": "", "ok": False, "error": f"{type(e).__name__}: {e}"}
+            try:
+                _write_json(os.path.join(done_dir, name), result)
+            finally:
+                os.remove(claimed)
+            _log_result(name[:-len(".json")], result)
+        if once and not names:
+            return
+        time.sleep(0 if names else poll_s)
+
+def serve_socket(path: str):
+    """Una petición JSON por línea y conexión; la respuesta es el resultado en JSON."""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                result = run_payload(self.rfile.readline())
+            except Exception as e:
+                result = {"output": "", "ok": False, "error": f"{type(e).__name__}: {e}"}
+            _log_result(result.get("output") or "?", result)
+            self.wfile.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        print(f"[INFO] Worker atendiendo el socket {path}")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def _log_result(name: str, result: dict):
+    if result.get("ok"):
+        print(f"[TIME] {name}: render {result['render_s']:.3f} s -> {result['output']}")
+    else:
+        print(f"[ERROR] {name}: {result.get('error')}")
+    sys.stdout.flush()
 
 if __name__ == "__main__":
-    os.makedirs("reports", exist_ok=True)
-    generate_pdf()
+    t_start = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Genera el PDF del informe")
+    parser.add_argument("--tickers", default="", help="Por defecto, los del pipeline")
+    parser.add_argument("--format", choices=["png", "svg"], default="png", help="Formato de los gráficos")
+    parser.add_argument("--force", action="store_true", help="Regenera aunque el PDF esté al día")
+    parser.add_argument("--worker", action="store_true", help="Proceso persistente que atiende trabajos")
+    parser.add_argument("--queue", default="", help="Carpeta de cola de trabajos (worker y --submit)")
+    parser.add_argument("--socket", default="", help="Socket Unix del worker")
+    parser.add_argument("--once", action="store_true", help="Worker: procesa la cola pendiente y termina")
+    parser.add_argument("--submit", default="", help="HTML que se envía a la cola (con --output)")
+    parser.add_argument("--output", default="", help="PDF de salida de --submit")
+    args = parser.parse_args()
+
+    if args.worker:
+        if not (args.queue or args.socket):
+            parser.error("--worker necesita --queue o --socket")
+        # SIGTERM (parada del servicio) sale igual que Ctrl+C: se limpia el socket
+        import signal
+        signal.signal(signal.SIGTERM, _stop)
+        renderer()
+        try:
+            if args.socket:
+                serve_socket(args.socket)
+            else:
+                serve_queue(args.queue, once=args.once)
+        except KeyboardInterrupt:
+            print("[INFO] Worker detenido")
+    elif args.submit:
+        if not (args.queue and args.output):
+            parser.error("--submit necesita --queue y --output")
+        job_id = submit_job(args.queue, args.output, html_file=args.submit)
+        result = wait_result(args.queue, job_id)
+        _log_result(job_id, result)
+        sys.exit(0 if result.get("ok") else 1)
+    else:
+        os.makedirs("reports", exist_ok=True)
+        tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()]
+        generate_pdf(tickers, args.format, args.force)
+        print(f"[TIME] total: {time.perf_counter() - t_start:.3f} s")
@@ -0,0 +1,145 @@
+# scripts/pipeline.py
+# Pipeline completo del informe en un solo proceso
+# - Etapas: download → analyze → visualize → report; los datos pasan en memoria entre etapas
+#   (barras y ventanas analizadas como DataFrame, gráficos como bytes)
+# - Las imágenes se incrustan en el HTML (data URI) que recibe WeasyPrint: sin PNG/CSV intermedios
+# - --stages ejecuta cualquier subconjunto; lo que no se ejecuta se toma de lo persistido
+#   (almacén de barras, indicadores guardados y gráficos de data/)
+# - Tiempo por etapa en consola y, con --timings, en JSON
+# - Cada etapa importa sus librerías al ejecutarse (un subconjunto no paga matplotlib ni WeasyPrint)
+# - --report-queue delega el PDF en un worker persistente (generate_report.py --worker)
+# Uso: python scripts/pipeline.py --tickers AAPL,MSFT,AMZN --format svg
+#      python scripts/pipeline.py --stages visualize,report --timings timings.json
+
+import os
+import json
+import time
+import argparse
+from typing import Dict, List
+
+from defaults import DEFAULT_TICKERS
+
+STAGES = ["download", "analyze", "visualize", "report"]
+
+def stage_download(ctx: dict, args: argparse.Namespace):
+    from download_data import FixtureProvider, YFinanceProvider, sync_bars
+    from bar_store import BarStore
+    from analyze import read_bars
+    provider = FixtureProvider(args.fixtures) if args.fixtures else YFinanceProvider()
+    store = BarStore(os.path.join(args.data_dir, "bars", args.interval))
+    sync_bars(ctx["tickers"], store, provider, args.period, args.interval, args.full)
+    ctx["bars"] = read_bars(ctx["tickers"], args.data_dir, args.interval)
+
+def stage_analyze(ctx: dict, args: argparse.Namespace):
+    from analyze import analyze_bars, read_bars
+    bars = ctx.get("bars") or read_bars(ctx["tickers"], args.data_dir, args.interval)
+    ctx["analyzed"] = analyze_bars(bars, args.data_dir, args.period, args.interval, ctx["cfg"], args.full,
+                                   write_csv=args.write_csv)
+
+def stage_visualize(ctx: dict, args: argparse.Namespace):
+    from analyze import load_analysis, read_bars
+    from visualize import render_all
+    analyzed = ctx.get("analyzed")
+    if analyzed is None:
+        bars = read_bars(ctx["tickers"], args.data_dir, args.interval)
+        analyzed = load_analysis(bars, args.data_dir, args.period, args.interval, ctx["cfg"])
+    charts = render_all(ctx["tickers"], args.data_dir, args.format, args.workers, frames=analyzed, with_data=True)
+    images: Dict[str, dict] = {t: {} for t in ctx["tickers"] if t in analyzed}
+    for path, r in charts.items():
+        ticker = os.path.basename(path)[:-len(f"_{r['kind']}.{args.format}")]
+        images[ticker][r["kind"]] = r["data"]
+    ctx["images"] = images
+
+def stage_report(ctx: dict, args: argparse.Namespace):
+    from generate_report import create_html_embedded, write_pdf
+    from visualize import CHARTS, chart_path
+    images = ctx.get("images")
+    if images is None:
+        # sin la etapa visualize: los últimos gráficos generados
+        images = {}
+        for t in ctx["tickers"]:
+            for kind in CHARTS:
+                path = chart_path(t, kind, args.data_dir, args.format)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        images.setdefault(t, {})[kind] = f.read()
+    if not images:
+        raise SystemExit("[ERROR] No hay gráficos para el informe")
+    html = create_html_embedded(images, args.format)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.html:
+        with open(args.html, "w", encoding="utf-8") as f:
+            f.write(html)
+    if args.report_queue:
+        # el worker ya tiene WeasyPrint caliente: este proceso no lo importa
+        from generate_report import submit_job, wait_result
+        result = wait_result(args.report_queue, submit_job(args.report_queue, args.output, html=html))
+        if not result.get("ok"):
+            raise SystemExit(f"[ERROR] El worker no generó el informe: {result.get('error')}")
+        print(f"[TIME] Render en el worker: {result['render_s']:.3f} s")
+    else:
+        write_pdf(html, args.output)
+    print(f"[OK] Informe: {args.output} ({len(images)} tickers)")
+
+STAGE_FUNCS = {"download": stage_download, "analyze": stage_analyze,
+               "visualize": stage_visualize, "report": stage_report}
+
+def run_pipeline(args: argparse.Namespace, stages: List[str]) -> Dict[str, float]:
+    from analyze import IndicatorConfig, parse_windows
+    ctx = {
+        "tickers": list(dict.fromkeys(t.strip().upper() for t in args.tickers.split(",") if t.strip())),
+        "cfg": IndicatorConfig(sma=parse_windows(args.sma), ema=parse_windows(args.ema),
+                               volatility=parse_windows(args.vol), drawdown=not args.no_drawdown),
+    }
+    timings = {}
+    for name in STAGES:
+        if name not in stages:
+            continue
+        t0 = time.perf_counter()
+        STAGE_FUNCS[name](ctx, args)
+        timings[name] = round(time.perf_counter() - t0, 3)
+        print(f"[TIME] {name}: {timings[name]:.3f} s")
+    return timings
+
+def main():
+    t0 = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Pipeline del informe de acciones en memoria")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Subconjunto de {','.join(STAGES)}")
+    parser.add_argument("--tickers", default=",".join(DEFAULT_TICKERS))
+    parser.add_argument("--period", default="3mo")
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--fixtures", default="", help="Carpeta con <TICKER>.csv: proveedor local sin red")
+    parser.add_argument("--full", action="store_true", help="Descarga y recalcula todo el periodo")
+    parser.add_argument("--sma", default="10")
+    parser.add_argument("--ema", default="")
+    parser.add_argument("--vol", default="")
+    parser.add_argument("--no-drawdown", action="store_true")
+    parser.add_argument("--format", choices=["png", "svg"], default="png")
+    parser.add_argument("--workers", type=int, default=0, help="Procesos para los gráficos (0 = nº de CPUs)")
+    parser.add_argument("--output", default="reports/weekly_report.pdf")
+    parser.add_argument("--report-queue", default="",
+                        help="Cola de un worker de generate_report.py (--worker --queue) para el PDF")
+    parser.add_argument("--html", default="", help="Guarda también el HTML (autocontenido)")
+    parser.add_argument("--write-csv", action="store_true",
+                        help="Escribe también data/<TICKER>_analyzed.csv para los scripts sueltos")
+    parser.add_argument("--timings", default="", help="Guarda los tiempos por etapa en JSON")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"[ERROR] Etapas desconocidas: {', '.join(unknown)} (válidas: {', '.join(STAGES)})")
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    timings = run_pipeline(args, stages)
+    total = round(time.perf_counter() - t0, 3)
+    print(f"[TIME] total: {total:.3f} s")
+    if args.timings:
+        tmp = args.timings + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"stages": timings, "total_s": total}, f, indent=2)
+        os.replace(tmp, args.timings)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,176 @@
 # scripts/visualize.py
+# Gráficos del informe
+# - Cada <TICKER>_analyzed.csv se lee una sola vez para todos sus gráficos
+# - Backend Agg y una figura reutilizada por proceso (se limpia entre gráficos)
+# - Tickers repartidos en un pool de procesos (--workers; 1 = en serie)
+# - Caché por hash de los datos de cada gráfico (data/render_cache.json): si no cambian, no se redibuja
+# - --format svg: gráficos vectoriales (texto como texto), más ligeros en el PDF
+# Uso: python scripts/visualize.py --tickers AAPL,MSFT,AMZN --format svg --workers 4
 
-import pandas as pd
-import matplotlib.pyplot as plt
+import io
 import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+from defaults import DEFAULT_TICKERS  # noqa: E402
+
+# cambiar al modificar el dibujo: invalida la caché de gráficos
+RENDER_VERSION = 1
+CHARTS = ["price", "return"]
+FIGSIZE = (10, 4)
+# SVG con el texto como texto (no como trazos): menos peso y seleccionable en el PDF
+matplotlib.rcParams["svg.fonttype"] = "none"
+
+def load_analyzed(ticker: str, data_dir: str = "data") -> pd.DataFrame:
+    # round_trip: mismos float que en memoria, así el hash coincide con el del pipeline
+    return pd.read_csv(os.path.join(data_dir, f"{ticker}_analyzed.csv"), parse_dates=["Date"], index_col="Date",
+                       float_precision="round_trip")
+
+def chart_columns(kind: str, df: pd.DataFrame) -> List[str]:
+    if kind == "price":
+        return ["Adj Close"] + [c for c in df.columns if c.startswith(("SMA_", "EMA_"))]
+    return ["Cumulative Return"]
+
+def chart_path(ticker: str, kind: str, data_dir: str = "data", fmt: str = "png") -> str:
+    return os.path.join(data_dir, f"{ticker}_{kind}.{fmt}")
+
+def chart_hash(ticker: str, kind: str, df: pd.DataFrame, fmt: str) -> str:
+    h = hashlib.sha1(f"{RENDER_VERSION}|{ticker}|{kind}|{fmt}".encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df[chart_columns(kind, df)], index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+def _label(col: str) -> str:
+    kind, _, w = col.partition("_")
+    return f"{kind} {w} días" if kind == "SMA" else f"{kind} {w}"
+
+_AXES = None
+
+def _axes():
+    """Figura y ejes del proceso: se crean una vez y se limpian antes de cada gráfico."""
+    global _AXES
+    if _AXES is None:
+        fig, ax = plt.subplots(figsize=FIGSIZE)
+        _AXES = (fig, ax)
+    fig, ax = _AXES
+    ax.clear()
+    return fig, ax
+
+def draw_chart(kind: str, ticker: str, df: pd.DataFrame, path: str) -> bytes:
+    """Dibuja el gráfico, lo guarda en `path` y devuelve los bytes de la imagen."""
+    fig, ax = _axes()
+    if kind == "price":
+        ax.plot(df.index, df["Adj Close"], label="Adj Close")
+        for col in chart_columns(kind, df)[1:]:
+            ax.plot(df.index, df[col], label=_label(col))
+        ax.set_title(f"{ticker} - Precio y Media Móvil")
+    elif kind == "return":
+        ax.plot(df.index, df["Cumulative Return"], label="Retorno acumulado", color="green")
+        ax.set_title(f"{ticker} - Retorno acumulado")
+    else:
+        raise ValueError(f"Gráfico desconocido: {kind}")
+    ax.legend()
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=os.path.splitext(path)[1][1:])
+    data = buf.getvalue()
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+def render_ticker(ticker: str, data_dir: str = "data", fmt: str = "png",
+                  known: Optional[Dict[str, str]] = None, df: Optional[pd.DataFrame] = None,
+                  with_data: bool = False) -> Dict[str, dict]:
+    """
+    Gráficos de un ticker: {ruta: {"kind", "hash", "rendered"[, "data"]}}. Se salta lo que coincide
+    con `known`. Sin `df` se lee <TICKER>_analyzed.csv; con `with_data` se devuelven los bytes.
+    """
+    known = known or {}
+    df = load_analyzed(ticker, data_dir) if df is None else df
+    out = {}
+    for kind in CHARTS:
+        path = chart_path(ticker, kind, data_dir, fmt)
+        h = chart_hash(ticker, kind, df, fmt)
+        fresh = known.get(path) == h and os.path.exists(path)
+        data = None
+        if not fresh:
+            data = draw_chart(kind, ticker, df, path)
+        elif with_data:
+            with open(path, "rb") as f:
+                data = f.read()
+        out[path] = {"kind": kind, "hash": h, "rendered": not fresh}
+        if with_data:
+            out[path]["data"] = data
+    return out
+
+def _render_job(job: tuple) -> tuple:
+    ticker, data_dir, fmt, known, df, with_data = job
+    try:
+        return ticker, render_ticker(ticker, data_dir, fmt, known, df, with_data), ""
+    except Exception as e:
+        return ticker, {}, str(e)
+
+def render_all(tickers, data_dir: str = "data", fmt: str = "png", workers: int = 0,
+               force: bool = False, frames: Optional[Dict[str, pd.DataFrame]] = None,
+               with_data: bool = False) -> Dict[str, dict]:
+    """
+    Gráficos de todos los tickers. Con `frames` ({ticker: datos analizados}) no se lee ningún CSV;
+    con `with_data` cada resultado lleva los bytes de la imagen (para incrustarla en el informe).
+    """
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t.strip()))
+    cache_path = os.path.join(data_dir, "render_cache.json")
+    cache = {}
+    if not force and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+
+    t0 = time.perf_counter()
+    jobs = [(t, data_dir, fmt, {p: h for p, h in cache.items() if os.path.basename(p).startswith(f"{t}_")},
+             frames.get(t) if frames is not None else None, with_data)
+            for t in tickers if frames is None or t in frames]
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers <= 1:
+        results = [_render_job(j) for j in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_render_job, jobs))
+
+    charts = {}
+    for ticker, out, error in results:
+        if error:
+            print(f"[WARN] {ticker}: gráficos no generados ({error})")
+        charts.update(out)
+    cache.update({p: r["hash"] for p, r in charts.items()})
+    tmp = cache_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp, cache_path)
+
+    rendered = sum(r["rendered"] for r in charts.values())
+    print(f"[INFO] Gráficos: {rendered} generados, {len(charts) - rendered} sin cambios "
+          f"({time.perf_counter() - t0:.2f} s, {max(workers, 1)} procesos)")
+    return charts
+
+def plot_price(ticker, data_dir="data", fmt="png"):
+    draw_chart("price", ticker, load_analyzed(ticker, data_dir), chart_path(ticker, "price", data_dir, fmt))
 
-def plot_price(ticker):
-    df = pd.read_csv(f"data/{ticker}_analyzed.csv", parse_dates=["Date"], index_col="Date")
-    plt.figure(figsize=(10, 4))
-    plt.plot(df["Adj Close"], label="Adj Close")
-    plt.plot(df["SMA_10"], label="SMA 10 días")
-    plt.title(f"{ticker} - Precio y Media Móvil")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(f"data/{ticker}_price.png")
-    plt.close()
-
-def plot_return(ticker):
-    df = pd.read_csv(f"data/{ticker}_analyzed.csv", parse_dates=["Date"], index_col="Date")
-    plt.figure(figsize=(10, 4))
-    plt.plot(df["Cumulative Return"], label="Retorno acumulado", color="green")
-    plt.title(f"{ticker} - Retorno acumulado")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(f"data/{ticker}_return.png")
-    plt.close()
+def plot_return(ticker, data_dir="data", fmt="png"):
+    draw_chart("return", ticker, load_analyzed(ticker, data_dir), chart_path(ticker, "return", data_dir, fmt))
 
 if __name__ == "__main__":
-    for ticker in ["AAPL", "MSFT", "AMZN"]:
-        plot_price(ticker)
-        plot_return(ticker)
+    parser = argparse.ArgumentParser(description="Gráficos del informe")
+    parser.add_argument("--tickers", default=",".join(DEFAULT_TICKERS))
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--format", choices=["png", "svg"], default="png")
+    parser.add_argument("--workers", type=int, default=0, help="Procesos (0 = nº de CPUs)")
+    parser.add_argument("--force", action="store_true", help="Ignora la caché y redibuja todo")
+    args = parser.parse_args()
+    render_all(args.tickers.split(","), args.data_dir, args.format, args.workers, args.force)
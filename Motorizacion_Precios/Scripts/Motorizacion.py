@@ -2,25 +2,51 @@
 # Monitoreo de precios y alertas de competencia
 # - Lee config/targets.csv
 # - Hace scraping (requests + BeautifulSoup) con backoff
-# - Guarda histórico en outputs/price_history.csv
+# - Modo concurrente opcional (--workers) con límites de cortesía por dominio
+# - Caché HTTP condicional (ETag/Last-Modified + digest) en outputs/http_cache.json
+# - Circuit breaker por dominio y presupuesto global de tiempo de reintentos
+# - Agrupa targets por URL: cada página se descarga y parsea una sola vez
+# - Backend de extracción lxml con selectores CSS precompilados (o BeautifulSoup)
+# - Descarga en streaming opcional (--stream): corta la respuesta en cuanto casan los selectores
+# - Guarda histórico particionado por día en outputs/price_history/ (o el CSV único original)
+# - Evalúa reglas de alerta declarativas (config JSON) sobre hoy + histórico
 # - Genera alerts_YYYYMMDD.csv y summary_YYYYMMDD.md
 # - Envía alerta a Slack y/o Email si hay cambios relevantes
+# - Ejecución repartida: --shard i/N deja salidas parciales y `merge` las une
+# - Métricas por target (tiempos por fase, bytes, reintentos) en CSV y textfile de Prometheus
+# - Programador adaptativo (--schedule / --loop): sólo re-chequea lo que toca según su volatilidad
 
 import os
 import re
+import sys
+import json
+import hashlib
 import smtplib
 import argparse
 import random
 import time
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Optional, List, Dict
+from urllib.parse import urlparse
 
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import lxml.html
+import lxml.etree
+from tenacity import Retrying, wait_exponential, retry_if_exception
+
+from http_cache import ResponseCache, body_digest, selector_key
+from history_store import open_history_store, PartitionedHistoryStore
+from alert_rules import load_rules, evaluate_alerts
+from scheduler import RecheckScheduler, SchedulerConfig
+from metrics import MetricsRecorder, write_metrics_csv, write_prometheus
 
 USER_AGENTS = [
     # algunos UAs comunes para reducir bloqueos
@@ -30,6 +56,7 @@ USER_AGENTS = [
 ]
 
 PRICE_PATTERN = re.compile(r"(\d+[.,]?\d*)")
+OUT_OF_STOCK_KEYWORDS = ["out of stock", "agotado", "sin stock", "no disponible"]
 
 @dataclass
 class Target:
@@ -40,6 +67,60 @@ class Target:
     price_selector: str
     stock_selector: Optional[str] = None
 
+@dataclass
+class MonitorOptions:
+    # workers <= 1 -> modo serie original (pausa aleatoria tras cada target)
+    workers: int = 1
+    # cortesía por dominio en modo concurrente
+    per_domain: int = 2
+    min_interval: float = 1.0
+    # caché HTTP condicional (None = desactivada)
+    cache_path: Optional[str] = None
+    cache_max_entries: int = 5000
+    # backend de extracción: "auto" (lxml si hay cssselect), "lxml" o "bs4"
+    parser: str = "auto"
+    # histórico: "partitioned" (append-only por día) o "csv" (fichero único original)
+    history_backend: str = "partitioned"
+    history_format: str = "auto"
+    # reglas de alerta en JSON (None = criterios por defecto con PRICE_DELTA_PCT)
+    alert_rules: Optional[str] = None
+    # circuit breaker: se abre tras N URLs seguidas con fallo del dominio
+    breaker_threshold: int = 3
+    breaker_reset_after: float = 300.0
+    # segundos totales de espera entre reintentos para toda la ejecución
+    retry_budget: float = 300.0
+    # programador adaptativo (None = se chequean todos los targets en cada ejecución)
+    schedule: Optional[SchedulerConfig] = None
+    schedule_path: Optional[str] = None
+    # descarga en streaming con corte anticipado (requiere parser lxml) y tope de bytes por página
+    stream: bool = False
+    max_page_bytes: int = 10_000_000
+    # textfile de Prometheus (None = <outdir>/price_monitor.prom)
+    metrics_prom: Optional[str] = None
+
+@dataclass
+class Page:
+    url: str
+    status: int
+    text: str = ""
+    content: bytes = b""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # modo streaming: (price, stock_text) ya extraídos durante la descarga, alineados con los pares pedidos
+    extracted: Optional[List[tuple]] = None
+    truncated: bool = False
+    # instrumentación: conexión = DNS/connect + espera hasta cabeceras
+    connect_s: float = 0.0
+    download_s: float = 0.0
+    parse_s: float = 0.0
+    extract_s: float = 0.0
+    bytes: int = 0
+    attempts: int = 1
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
 def _headers():
     return {
         "User-Agent": random.choice(USER_AGENTS),
@@ -48,23 +129,208 @@ def _headers():
     }
 
 class FetchError(Exception):
-    pass
-
-@retry(
-    reraise=True,
-    retry=retry_if_exception_type(FetchError),
-    wait=wait_exponential(multiplier=1, min=1, max=16),
-    stop=stop_after_attempt(4),
-)
-def fetch_html(url: str, timeout: int = 20) -> str:
+    # domain_level: fallo atribuible al dominio (conexión, timeout, 5xx, 429), no a una página concreta
+    def __init__(self, message: str, domain_level: bool = True):
+        super().__init__(message)
+        self.domain_level = domain_level
+
+class CircuitOpenError(FetchError):
+    def __init__(self, host: str):
+        super().__init__(f"Circuit breaker abierto para {host}", domain_level=False)
+
+class CircuitBreaker:
+    """
+    Circuit breaker por dominio:
+    - closed: peticiones normales; cuenta URLs seguidas que fallan por causa del dominio
+    - open: tras `failure_threshold` fallos seguidos; el resto de URLs del dominio se omite
+    - half_open: pasados `reset_after` segundos se permite una única petición de prueba;
+      el resto de URLs del dominio se sigue omitiendo hasta conocer su resultado
+    """
+    def __init__(self, failure_threshold: int = 3, reset_after: float = 300.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_after = float(reset_after)
+        self._lock = threading.Lock()
+        self._state: Dict[str, dict] = {}
+
+    def _get(self, host: str) -> dict:
+        return self._state.setdefault(host, {
+            "state": "closed", "consecutive": 0, "failures": 0,
+            "short_circuited": 0, "opened_at": 0.0, "last_error": "", "probe_in_flight": False,
+        })
+
+    def is_open(self, url: str) -> bool:
+        with self._lock:
+            st = self._state.get(domain_of(url))
+            return bool(st) and st["state"] == "open"
+
+    def _blocked(self, st: dict) -> bool:
+        if st["state"] == "half_open":
+            return st["probe_in_flight"]
+        return st["state"] == "open" and time.monotonic() - st["opened_at"] < self.reset_after
+
+    def check(self, url: str):
+        """Como before_request pero sin reservar la prueba (p. ej. antes de esperar hueco del dominio)."""
+        host = domain_of(url)
+        with self._lock:
+            st = self._get(host)
+            if self._blocked(st):
+                st["short_circuited"] += 1
+                raise CircuitOpenError(host)
+
+    def before_request(self, url: str):
+        host = domain_of(url)
+        with self._lock:
+            st = self._get(host)
+            if self._blocked(st):
+                st["short_circuited"] += 1
+                raise CircuitOpenError(host)
+            if st["state"] == "open":
+                # esta petición es la prueba: las demás esperan a record_success/record_failure
+                st["state"] = "half_open"
+                st["probe_in_flight"] = True
+
+    def record_success(self, url: str):
+        with self._lock:
+            st = self._get(domain_of(url))
+            st["state"] = "closed"
+            st["consecutive"] = 0
+            st["probe_in_flight"] = False
+
+    def record_failure(self, url: str, error: Exception):
+        with self._lock:
+            st = self._get(domain_of(url))
+            if not getattr(error, "domain_level", True):
+                # el dominio respondió (p. ej. 404): la prueba vale como éxito
+                if st["probe_in_flight"]:
+                    st["state"] = "closed"
+                    st["consecutive"] = 0
+                    st["probe_in_flight"] = False
+                return
+            st["consecutive"] += 1
+            st["failures"] += 1
+            st["last_error"] = str(error)[:120]
+            if st["state"] == "half_open" or st["consecutive"] >= self.failure_threshold:
+                st["state"] = "open"
+                st["opened_at"] = time.monotonic()
+            st["probe_in_flight"] = False
+
+    def release(self, url: str):
+        """La prueba terminó sin resultado del dominio: vuelve a open y la siguiente petición prueba."""
+        with self._lock:
+            st = self._get(domain_of(url))
+            if st["probe_in_flight"]:
+                st["state"] = "open"
+                st["probe_in_flight"] = False
+
+    def report(self) -> List[dict]:
+        # sólo dominios con algún fallo
+        with self._lock:
+            return [{"domain": h, **{k: v for k, v in st.items() if k not in ("opened_at", "probe_in_flight")}}
+                    for h, st in sorted(self._state.items()) if st["failures"] or st["short_circuited"]]
+
+class RetryBudget:
+    """Segundos totales de espera entre reintentos que puede gastar una ejecución."""
+    def __init__(self, seconds: float = 300.0):
+        self.total = max(0.0, float(seconds))
+        self.spent = 0.0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        with self._lock:
+            return max(0.0, self.total - self.spent)
+
+    def exhausted(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def charge(self, seconds: float):
+        with self._lock:
+            self.spent += seconds
+            self.retries += 1
+
+_backoff = wait_exponential(multiplier=1, min=1, max=16)
+
+def _fetch_once(url: str, timeout: int, extra_headers: Optional[Dict[str, str]],
+                stream: Optional["StreamSpec"] = None) -> Page:
+    headers = _headers()
+    if extra_headers:
+        headers.update(extra_headers)
     try:
-        resp = requests.get(url, headers=_headers(), timeout=timeout)
+        if stream is not None:
+            return _fetch_streaming(url, headers, timeout, stream)
+        t0 = time.perf_counter()
+        resp = requests.get(url, headers=headers, timeout=timeout)
+        # requests mide `elapsed` hasta las cabeceras; el resto es la lectura del cuerpo
+        connect = resp.elapsed.total_seconds()
+        download = max(0.0, time.perf_counter() - t0 - connect)
         if resp.status_code >= 400:
-            raise FetchError(f"HTTP {resp.status_code} on {url}")
-        return resp.text
+            raise FetchError(f"HTTP {resp.status_code} on {url}",
+                             domain_level=resp.status_code >= 500 or resp.status_code == 429)
+        if resp.status_code == 304:
+            return Page(url=url, status=304, connect_s=connect)
+        return Page(
+            url=url,
+            status=resp.status_code,
+            text=resp.text,
+            content=resp.content,
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+            connect_s=connect,
+            download_s=download,
+            bytes=len(resp.content),
+        )
     except requests.RequestException as e:
         raise FetchError(str(e))
 
+def fetch_page(url: str, timeout: int = 20, extra_headers: Optional[Dict[str, str]] = None,
+               breaker: Optional[CircuitBreaker] = None, budget: Optional[RetryBudget] = None,
+               stream: Optional["StreamSpec"] = None) -> Page:
+    """
+    Hasta 4 intentos con backoff exponencial (1-16 s). Se deja de reintentar si se agota
+    el presupuesto global de reintentos o si el breaker del dominio se abre entre medias.
+    """
+    if breaker is not None:
+        breaker.before_request(url)
+
+    def stop(rs) -> bool:
+        return (rs.attempt_number >= 4
+                or (budget is not None and budget.exhausted())
+                or (breaker is not None and breaker.is_open(url)))
+
+    def wait(rs) -> float:
+        w = _backoff(rs)
+        return min(w, budget.remaining()) if budget is not None else w
+
+    def before_sleep(rs):
+        if budget is not None:
+            budget.charge(rs.next_action.sleep)
+
+    retrying = Retrying(
+        reraise=True,
+        retry=retry_if_exception(lambda e: isinstance(e, FetchError) and not isinstance(e, CircuitOpenError)),
+        wait=wait,
+        stop=stop,
+        before_sleep=before_sleep,
+    )
+    try:
+        page = retrying(_fetch_once, url, timeout, extra_headers, stream)
+    except FetchError as e:
+        e.attempts = retrying.statistics.get("attempt_number", 1)
+        if breaker is not None:
+            breaker.record_failure(url, e)
+        raise
+    except BaseException:
+        if breaker is not None:
+            breaker.release(url)
+        raise
+    if breaker is not None:
+        breaker.record_success(url)
+    page.attempts = retrying.statistics.get("attempt_number", 1)
+    return page
+
+def fetch_html(url: str, timeout: int = 20) -> str:
+    return fetch_page(url, timeout).text
+
 def parse_price(text: str) -> Optional[float]:
     # extrae primer número tipo 1.234,56 o 1234.56
     m = PRICE_PATTERN.search(text.replace("\xa0", " "))
@@ -83,16 +349,310 @@ def parse_price(text: str) -> Optional[float]:
         return None
 
 def extract_price_and_stock(html: str, price_selector: str, stock_selector: Optional[str]) -> tuple[Optional[float], Optional[str]]:
+    return _bs4_extract(html, [(price_selector, stock_selector)])[0]
+
+# --------------------
+# Extracción (parseo único por documento)
+# --------------------
+
+# tags cuyo texto BeautifulSoup no incluye en get_text()
+_SKIP_TEXT_TAGS = {"script", "style", "template"}
+
+def _bs4_extract(html: str, pairs: List[tuple], timings: Optional[Dict[str, float]] = None) -> List[tuple]:
+    t0 = time.perf_counter()
     soup = BeautifulSoup(html, "lxml")
-    price_el = soup.select_one(price_selector)
-    price = parse_price(price_el.get_text(strip=True)) if price_el else None
+    t1 = time.perf_counter()
+    out = []
+    for price_selector, stock_selector in pairs:
+        price_el = soup.select_one(price_selector)
+        price = parse_price(price_el.get_text(strip=True)) if price_el else None
+        stock_text = None
+        if stock_selector:
+            st_el = soup.select_one(stock_selector)
+            if st_el:
+                stock_text = st_el.get_text(" ", strip=True).lower()
+        out.append((price, stock_text))
+    _record_timings(timings, t1 - t0, time.perf_counter() - t1)
+    return out
+
+def _record_timings(timings: Optional[Dict[str, float]], parse: float, extract: float):
+    if timings is not None:
+        timings["parse"] = timings.get("parse", 0.0) + parse
+        timings["extract"] = timings.get("extract", 0.0) + extract
+
+def _lxml_strings(el):
+    # equivalente a Tag.strings de bs4: sin comentarios ni script/style
+    if not isinstance(el.tag, str) or el.tag.lower() in _SKIP_TEXT_TAGS:
+        return
+    if el.text:
+        yield el.text
+    for child in el:
+        yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
 
-    stock_text = None
-    if stock_selector:
-        st_el = soup.select_one(stock_selector)
-        if st_el:
-            stock_text = st_el.get_text(" ", strip=True).lower()
-    return price, stock_text
+def _lxml_text(el, sep: str = "") -> str:
+    return sep.join(s.strip() for s in _lxml_strings(el) if s.strip())
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: str):
+    from lxml.cssselect import CSSSelector
+    return CSSSelector(selector)
+
+def lxml_available() -> bool:
+    try:
+        import cssselect  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def precompile_selectors(targets: List["Target"]) -> bool:
+    """
+    Compila una vez por ejecución todos los selectores CSS.
+    Devuelve False si alguno no es compatible con cssselect (se usará bs4 en ese caso).
+    """
+    ok = True
+    for t in targets:
+        for sel in (t.price_selector, t.stock_selector):
+            if not sel:
+                continue
+            try:
+                compile_selector(sel)
+            except Exception:
+                ok = False
+    return ok
+
+def _lxml_extract(html: str, pairs: List[tuple], timings: Optional[Dict[str, float]] = None) -> List[tuple]:
+    if not html.strip():
+        return [(None, None) for _ in pairs]
+    t0 = time.perf_counter()
+    try:
+        doc = lxml.html.fromstring(html)
+    except ValueError:
+        # XHTML con declaración de encoding: lxml sólo la acepta en bytes
+        doc = lxml.html.fromstring(html.encode("utf-8"))
+    t1 = time.perf_counter()
+    out = []
+    for price_selector, stock_selector in pairs:
+        found = compile_selector(price_selector)(doc)
+        price = parse_price(_lxml_text(found[0])) if found else None
+        stock_text = None
+        if stock_selector:
+            found = compile_selector(stock_selector)(doc)
+            if found:
+                stock_text = _lxml_text(found[0], " ").lower()
+        out.append((price, stock_text))
+    _record_timings(timings, t1 - t0, time.perf_counter() - t1)
+    return out
+
+def extract_many(html: str, pairs: List[tuple], parser: str = "bs4",
+                 timings: Optional[Dict[str, float]] = None) -> List[tuple]:
+    """
+    Evalúa todos los pares (price_selector, stock_selector) sobre un único árbol.
+    """
+    if parser == "lxml":
+        try:
+            for price_selector, stock_selector in pairs:
+                compile_selector(price_selector)
+                if stock_selector:
+                    compile_selector(stock_selector)
+        except Exception:
+            # selector no soportado por cssselect (p. ej. pseudo-clases de soupsieve)
+            return _bs4_extract(html, pairs, timings)
+        return _lxml_extract(html, pairs, timings)
+    return _bs4_extract(html, pairs, timings)
+
+# --------------------
+# Descarga en streaming con corte anticipado
+# --------------------
+
+STREAM_CHUNK_SIZE = 32 * 1024
+
+# selectores cuyo primer resultado puede cambiar con contenido posterior: no permiten cortar
+_NON_STREAMABLE = re.compile(r":(?:nth-)?(?:last|only)-")
+
+def streamable(pairs: List[tuple]) -> bool:
+    for pair in pairs:
+        for sel in pair:
+            if not sel:
+                continue
+            if _NON_STREAMABLE.search(sel):
+                return False
+            try:
+                compile_selector(sel)
+            except Exception:
+                return False
+    return True
+
+@dataclass
+class StreamSpec:
+    pairs: List[tuple]
+    max_bytes: int
+    stats: Optional["StreamStats"] = None
+    chunk_size: int = STREAM_CHUNK_SIZE
+
+class StreamMatcher:
+    """
+    Parser HTML incremental (lxml) sobre los bytes que van llegando.
+    Un selector queda resuelto cuando su primer resultado en el árbol parcial ya está cerrado:
+    el contenido posterior sólo añade nodos detrás en orden de documento, así que
+    el resultado es el mismo que parseando la página entera.
+    """
+    def __init__(self, pairs: List[tuple], encoding: Optional[str] = None):
+        self.pairs = pairs
+        self._parser = lxml.etree.HTMLPullParser(events=("end",), encoding=encoding)
+        self._root = None
+        self._ended = set()
+        self._found: Dict[str, object] = {}
+        self._pending = list(dict.fromkeys(sel for pair in pairs for sel in pair if sel))
+        # tiempo de CPU en el parser/selectores, descontado de la descarga
+        self.parse_s = 0.0
+
+    def _consume_events(self):
+        new = False
+        for _, el in self._parser.read_events():
+            self._ended.add(el)
+            new = True
+            if self._root is None:
+                self._root = el.getroottree().getroot()
+        return new
+
+    def feed(self, chunk: bytes) -> bool:
+        """Devuelve True cuando todos los selectores están resueltos."""
+        t0 = time.perf_counter()
+        try:
+            return self._feed(chunk)
+        finally:
+            self.parse_s += time.perf_counter() - t0
+
+    def _feed(self, chunk: bytes) -> bool:
+        self._parser.feed(chunk)
+        if self._consume_events() and self._root is not None:
+            for sel in list(self._pending):
+                found = compile_selector(sel)(self._root)
+                if found and found[0] in self._ended:
+                    self._found[sel] = found[0]
+                    self._pending.remove(sel)
+        return not self._pending
+
+    def finish(self):
+        # respuesta completa o recortada por el tope: cerramos el árbol y resolvemos lo pendiente
+        t0 = time.perf_counter()
+        try:
+            self._parser.close()
+        except lxml.etree.XMLSyntaxError:
+            pass  # cuerpo vacío
+        self._consume_events()
+        for sel in self._pending:
+            found = compile_selector(sel)(self._root) if self._root is not None else []
+            self._found[sel] = found[0] if found else None
+        self._pending = []
+        self.parse_s += time.perf_counter() - t0
+
+    def results(self) -> List[tuple]:
+        out = []
+        for price_selector, stock_selector in self.pairs:
+            el = self._found.get(price_selector)
+            price = parse_price(_lxml_text(el)) if el is not None else None
+            stock_text = None
+            if stock_selector:
+                el = self._found.get(stock_selector)
+                if el is not None:
+                    stock_text = _lxml_text(el, " ").lower()
+            out.append((price, stock_text))
+        return out
+
+class StreamStats:
+    """Bytes y tiempo ahorrados por el corte anticipado en toda la ejecución."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.early = 0
+        self.capped = 0
+        self.bytes_read = 0
+        self.bytes_saved = 0
+        self.time_saved = 0.0
+        self.unknown_length = 0
+
+    def record(self, read: int, total: Optional[int], elapsed: float, early: bool, capped: bool):
+        with self._lock:
+            self.pages += 1
+            self.early += int(early)
+            self.capped += int(capped)
+            self.bytes_read += read
+            if early or capped:
+                if total is None:
+                    self.unknown_length += 1
+                elif total > read and read > 0:
+                    saved = total - read
+                    self.bytes_saved += saved
+                    # estimación al ritmo de descarga observado en esa misma respuesta
+                    self.time_saved += elapsed * saved / read
+
+    def report(self) -> dict:
+        return {
+            "pages": self.pages,
+            "early": self.early,
+            "capped": self.capped,
+            "bytes_read": self.bytes_read,
+            "bytes_saved": self.bytes_saved,
+            "time_saved": round(self.time_saved, 3),
+            "unknown_length": self.unknown_length,
+        }
+
+def _fetch_streaming(url: str, headers: Dict[str, str], timeout: int, spec: StreamSpec) -> Page:
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+        # desde la llegada de las cabeceras: sólo cuenta el tiempo de descarga del cuerpo
+        t0 = time.perf_counter()
+        connect = resp.elapsed.total_seconds()
+        if resp.status_code >= 400:
+            raise FetchError(f"HTTP {resp.status_code} on {url}",
+                             domain_level=resp.status_code >= 500 or resp.status_code == 429)
+        if resp.status_code == 304:
+            return Page(url=url, status=304, connect_s=connect)
+        matcher = StreamMatcher(spec.pairs, resp.encoding)
+        chunks, size = [], 0
+        early = capped = False
+        for chunk in resp.iter_content(spec.chunk_size):
+            chunks.append(chunk)
+            size += len(chunk)
+            if matcher.feed(chunk):
+                early = True
+                break
+            if size >= spec.max_bytes:
+                capped = True
+                break
+        # bytes en la red (comprimidos si hay Content-Encoding), comparables con Content-Length
+        wire = resp.raw.tell() if hasattr(resp.raw, "tell") else size
+        length = resp.headers.get("Content-Length")
+        total = int(length) if length and length.isdigit() else None
+        elapsed = time.perf_counter() - t0
+        feed_parse = matcher.parse_s
+        if not early:
+            matcher.finish()
+        if total is not None and wire >= total:
+            # el cuerpo entero cabía en lo ya leído: no hubo corte real
+            early = capped = False
+        if spec.stats is not None:
+            spec.stats.record(wire, total, elapsed, early, capped)
+        content = b"".join(chunks)
+        t1 = time.perf_counter()
+        extracted = matcher.results()
+        return Page(
+            url=url,
+            status=resp.status_code,
+            text=content.decode(resp.encoding or "utf-8", errors="replace"),
+            content=content,
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+            extracted=extracted,
+            truncated=early or capped,
+            connect_s=connect,
+            download_s=max(0.0, elapsed - feed_parse),
+            parse_s=matcher.parse_s,
+            extract_s=time.perf_counter() - t1,
+            bytes=wire,
+        )
 
 def post_to_slack(webhook_url: str, text: str):
     try:
@@ -128,85 +688,383 @@ def load_targets(path: str) -> List[Target]:
 def ensure_dirs(outdir: str):
     os.makedirs(outdir, exist_ok=True)
 
-def monitor(config_path: str, outdir: str, delta_pct: float):
-    ensure_dirs(outdir)
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    history_path = os.path.join(outdir, "price_history.csv")
-    alerts_path  = os.path.join(outdir, f"alerts_{today.replace('-','')}.csv")
-    summary_path = os.path.join(outdir, f"summary_{today.replace('-','')}.md")
+def domain_of(url: str) -> str:
+    # host (y puerto si es explícito): unidad de cortesía y de circuit breaker
+    u = urlparse(url)
+    host = (u.hostname or "").lower()
+    return f"{host}:{u.port}" if u.port else host
 
-    targets = load_targets(config_path)
-    rows = []
-    alerts = []
+class DomainLimiter:
+    """
+    Cortesía por dominio para el modo concurrente:
+    - como mucho `max_concurrency` peticiones simultáneas al mismo host
+    - al menos `min_interval` segundos entre inicios de petición al mismo host
+    """
+    def __init__(self, max_concurrency: int = 2, min_interval: float = 1.0):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_interval = max(0.0, float(min_interval))
+        self._lock = threading.Lock()
+        self._slots: Dict[str, threading.Semaphore] = {}
+        self._next_start: Dict[str, float] = {}
 
-    for t in targets:
+    @contextmanager
+    def slot(self, url: str):
+        host = domain_of(url)
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.Semaphore(self.max_concurrency))
+        with sem:
+            # reservamos el siguiente hueco del host bajo lock y esperamos fuera de él
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+@dataclass
+class FetchContext:
+    cache: Optional[ResponseCache] = None
+    parser: str = "bs4"
+    breaker: Optional[CircuitBreaker] = None
+    budget: Optional[RetryBudget] = None
+    # None = descarga completa
+    stream: Optional[StreamStats] = None
+    max_page_bytes: int = 10_000_000
+    metrics: Optional[MetricsRecorder] = None
+
+    def record(self, url: str, page: Optional[Page] = None, **values):
+        if self.metrics is None:
+            return
+        if page is not None:
+            self.metrics.add(url, status=page.status, streamed=page.extracted is not None,
+                             truncated=page.truncated, retries=page.attempts - 1, bytes=page.bytes,
+                             connect_s=page.connect_s, download_s=page.download_s,
+                             parse_s=page.parse_s, extract_s=page.extract_s)
+        # tiempos y contadores se acumulan sobre los de la página
+        self.metrics.add(url, **values)
+
+    def fetch(self, url: str, extra_headers: Optional[Dict[str, str]] = None,
+              pairs: Optional[List[tuple]] = None) -> Page:
+        spec = None
+        if self.stream is not None and pairs and self.parser == "lxml" and streamable(pairs):
+            spec = StreamSpec(pairs, self.max_page_bytes, self.stream)
+        return fetch_page(url, extra_headers=extra_headers, breaker=self.breaker, budget=self.budget, stream=spec)
+
+def group_by_url(targets: List[Target]) -> Dict[str, List[int]]:
+    # índices de targets por URL, en orden de primera aparición
+    groups: Dict[str, List[int]] = {}
+    for i, t in enumerate(targets):
+        groups.setdefault(t.url, []).append(i)
+    return groups
+
+def scrape_url(url: str, group: List[Target], ctx: Optional[FetchContext] = None) -> List[tuple]:
+    """
+    Descarga `url` una vez y devuelve (price, stock_text) para cada target del grupo.
+    """
+    ctx = ctx or FetchContext()
+    cache, parser = ctx.cache, ctx.parser
+    pairs = [(t.price_selector, t.stock_selector) for t in group]
+    if cache is None:
+        page = ctx.fetch(url, pairs=pairs)
+        if page.extracted is not None:
+            ctx.record(url, page)
+            return page.extracted
+        timings: Dict[str, float] = {}
+        values = extract_many(page.text, pairs, parser, timings)
+        ctx.record(url, page, parse_s=timings.get("parse", 0.0), extract_s=timings.get("extract", 0.0))
+        return values
+
+    keys = [selector_key(*p) for p in pairs]
+    page = ctx.fetch(url, extra_headers=cache.conditional_headers(url, keys), pairs=pairs)
+    if page.not_modified:
+        cached = [cache.get_extracted(url, k) for k in keys]
+        if all(c is not None for c in cached):
+            cache.record(hit=True)
+            ctx.record(url, page, cache="hit")
+            return cached
+        # 304 sin nada que reutilizar (p. ej. expulsado por LRU entre medias): descarga completa
+        ctx.record(url, page)
+        page = ctx.fetch(url, pairs=pairs)
+
+    digest = body_digest(page.content)
+    cached = [cache.get_extracted(url, k, digest) for k in keys]
+    missing = [j for j, c in enumerate(cached) if c is None]
+    if not missing:
+        # cuerpo idéntico aunque el servidor no soporte validadores
+        cache.store(url, digest, page.etag, page.last_modified, {})
+        cache.record(hit=True)
+        ctx.record(url, page, cache="hit")
+        return cached
+
+    timings = {}
+    if page.extracted is not None:
+        # en streaming el digest es el del prefijo leído, que contiene todo lo extraído
+        extracted = [page.extracted[j] for j in missing]
+    else:
+        extracted = extract_many(page.text, [pairs[j] for j in missing], parser, timings)
+    ctx.record(url, page, cache="miss", **{f"{k}_s": v for k, v in timings.items()})
+    for j, value in zip(missing, extracted):
+        cached[j] = value
+    cache.store(url, digest, page.etag, page.last_modified,
+                {keys[j]: value for j, value in zip(missing, extracted)})
+    cache.record(hit=False)
+    return cached
+
+def scrape_target(t: Target, cache: Optional[ResponseCache] = None) -> tuple[Optional[float], Optional[str]]:
+    return scrape_url(t.url, [t], FetchContext(cache=cache))[0]
+
+def _interleave_by_domain(urls: List[str]) -> List[str]:
+    # reparto round-robin por dominio: así el pool mantiene muchos hosts distintos en vuelo
+    # en lugar de bloquearse en el semáforo de un único dominio
+    buckets: Dict[str, List[str]] = {}
+    for u in urls:
+        buckets.setdefault(domain_of(u), []).append(u)
+    order = []
+    queues = list(buckets.values())
+    while queues:
+        for q in queues:
+            order.append(q.pop(0))
+        queues = [q for q in queues if q]
+    return order
+
+def build_fetch_context(options: MonitorOptions, targets: List[Target]) -> FetchContext:
+    parser = options.parser
+    if parser == "auto":
+        parser = "lxml" if lxml_available() else "bs4"
+    if parser == "lxml":
+        precompile_selectors(targets)
+    elif options.stream:
+        print("[WARN] --stream requiere el parser lxml (cssselect): las páginas se descargan completas")
+    cache = ResponseCache(options.cache_path, options.cache_max_entries) if options.cache_path else None
+    return FetchContext(
+        cache=cache,
+        parser=parser,
+        breaker=CircuitBreaker(options.breaker_threshold, options.breaker_reset_after),
+        budget=RetryBudget(options.retry_budget),
+        stream=StreamStats() if options.stream else None,
+        max_page_bytes=options.max_page_bytes,
+        metrics=MetricsRecorder(),
+    )
+
+def scrape_all(targets: List[Target], options: MonitorOptions, ctx: FetchContext) -> List[object]:
+    """
+    Devuelve, en el mismo orden que `targets`, (price, stock_text) o la excepción capturada.
+    Cada URL se descarga y parsea una sola vez aunque la compartan varios SKUs.
+    En modo concurrente (workers > 1) se respetan los límites por dominio.
+    """
+    results: List[object] = [None] * len(targets)
+    groups = group_by_url(targets)
+
+    def run(url: str, limiter: Optional[DomainLimiter] = None):
+        idx = groups[url]
+        t0 = time.perf_counter()
+        t1 = t0
         try:
-            html = fetch_html(t.url)
-            price, stock_text = extract_price_and_stock(html, t.price_selector, t.stock_selector)
-            comp_price = price if price is not None else float("nan")
-            in_stock = None
-            if stock_text is not None:
-                # heurística simple
-                in_stock = not any(k in stock_text for k in ["out of stock", "agotado", "sin stock", "no disponible"])
-
-            diff_abs = comp_price - t.our_price if pd.notna(comp_price) else float("nan")
-            diff_pct = (diff_abs / t.our_price * 100.0) if pd.notna(comp_price) else float("nan")
-
-            rows.append({
-                "date": today,
-                "sku": t.sku,
-                "name": t.name,
-                "our_price": t.our_price,
-                "competitor_price": comp_price,
-                "diff_abs": diff_abs,
-                "diff_pct": diff_pct,
-                "in_stock": in_stock,
-                "url": t.url,
-            })
-
-            # criterio de alerta: competidor más barato que nosotros por más del delta_pct
-            if pd.notna(comp_price) and diff_pct < -abs(delta_pct):
-                alerts.append({
-                    "date": today,
-                    "sku": t.sku,
-                    "name": t.name,
-                    "our_price": t.our_price,
-                    "competitor_price": comp_price,
-                    "delta_pct": round(diff_pct, 2),
-                    "reason": f"Competidor más barato {abs(round(diff_pct,2))}%"
-                })
-
-            # criterio de oportunidad: competidor sin stock y nosotros sí vendemos
-            if in_stock is False:
-                alerts.append({
-                    "date": today,
-                    "sku": t.sku,
-                    "name": t.name,
-                    "our_price": t.our_price,
-                    "competitor_price": comp_price,
-                    "delta_pct": round(diff_pct, 2) if pd.notna(diff_pct) else "",
-                    "reason": "Competidor sin stock (o no disponible)"
-                })
-
-            # pausas pequeñas para no saturar
-            time.sleep(random.uniform(0.8, 1.8))
+            if limiter is None:
+                values = scrape_url(url, [targets[i] for i in idx], ctx)
+            else:
+                if ctx.breaker is not None:
+                    # no ocupamos hueco del dominio si ya sabemos que está caído
+                    # (la prueba de half_open se reserva después, en fetch_page)
+                    ctx.breaker.check(url)
+                with limiter.slot(url):
+                    t1 = time.perf_counter()
+                    values = scrape_url(url, [targets[i] for i in idx], ctx)
+            for i, v in zip(idx, values):
+                results[i] = v
+            ctx.record(url, wait_s=t1 - t0, total_s=time.perf_counter() - t0)
+            return True
+        except Exception as e:
+            for i in idx:
+                results[i] = e
+            ctx.record(url, wait_s=t1 - t0, total_s=time.perf_counter() - t0,
+                       retries=getattr(e, "attempts", 1) - 1, error=str(e))
+            return False
+
+    if options.workers > 1:
+        limiter = DomainLimiter(options.per_domain, options.min_interval)
+        with ThreadPoolExecutor(max_workers=options.workers) as pool:
+            list(pool.map(lambda u: run(u, limiter), _interleave_by_domain(list(groups))))
+    else:
+        for url in groups:
+            if run(url):
+                # pausas pequeñas para no saturar
+                time.sleep(random.uniform(0.8, 1.8))
+    return results
+
+def build_row(t: Target, today: str, price: Optional[float], stock_text: Optional[str]) -> dict:
+    comp_price = price if price is not None else float("nan")
+    in_stock = None
+    if stock_text is not None:
+        # heurística simple
+        in_stock = not any(k in stock_text for k in OUT_OF_STOCK_KEYWORDS)
+
+    diff_abs = comp_price - t.our_price if pd.notna(comp_price) else float("nan")
+    diff_pct = (diff_abs / t.our_price * 100.0) if pd.notna(comp_price) else float("nan")
+
+    return {
+        "date": today,
+        "sku": t.sku,
+        "name": t.name,
+        "our_price": t.our_price,
+        "competitor_price": comp_price,
+        "diff_abs": diff_abs,
+        "diff_pct": diff_pct,
+        "in_stock": in_stock,
+        "url": t.url,
+    }
+
+def error_row(t: Target, today: str, e: Exception) -> dict:
+    return {
+        "date": today, "sku": t.sku, "name": t.name, "our_price": t.our_price,
+        "competitor_price": float("nan"), "diff_abs": float("nan"), "diff_pct": float("nan"),
+        "in_stock": None, "url": t.url, "error": str(e)[:200]
+    }
+
+# --------------------
+# Resultados, resumen y notificaciones
+# --------------------
 
+def run_stats(ctx: FetchContext, n_targets: int) -> dict:
+    budget = ctx.budget
+    return {
+        "targets": n_targets,
+        "budget": {"spent": budget.spent, "total": budget.total,
+                   "retries": budget.retries, "exhausted": budget.exhausted()},
+        "breakers": ctx.breaker.report(),
+        "cache": ctx.cache.stats() if ctx.cache is not None else None,
+        "stream": ctx.stream.report() if ctx.stream is not None else None,
+    }
+
+def merge_stats(parts: List[dict]) -> dict:
+    caches = [p["cache"] for p in parts if p.get("cache")]
+    streams = [p["stream"] for p in parts if p.get("stream")]
+    return {
+        "targets": sum(p["targets"] for p in parts),
+        "budget": {
+            "spent": sum(p["budget"]["spent"] for p in parts),
+            "total": sum(p["budget"]["total"] for p in parts),
+            "retries": sum(p["budget"]["retries"] for p in parts),
+            "exhausted": any(p["budget"]["exhausted"] for p in parts),
+        },
+        # shards en paralelo: la duración es la del más lento
+        "elapsed": max(p.get("elapsed", 0.0) for p in parts),
+        # con reparto por dominio cada dominio aparece en un único shard
+        "breakers": sorted((b for p in parts for b in p["breakers"]), key=lambda b: b["domain"]),
+        "cache": {k: sum(c[k] for c in caches) for k in caches[0]} if caches else None,
+        "stream": {k: sum(st[k] for st in streams) for k in streams[0]} if streams else None,
+    }
+
+def write_run_stats(f, stats: dict):
+    sc = stats.get("schedule")
+    if sc is not None:
+        f.write("\n## Programador\n")
+        f.write(f"- URLs vencidas: **{sc['due_urls']}** · chequeadas: **{sc['selected_urls']}** · "
+                f"aplazadas por presupuesto: {sc['deferred_urls']}\n")
+        f.write(f"- Series: {sc['series']} · intervalo mediano: {sc['median_interval_h']:.1f} h · "
+                f"peticiones disponibles: {sc['tokens_left']}\n")
+    ss = stats.get("stream")
+    if ss is not None:
+        f.write("\n## Streaming\n")
+        f.write(f"- Páginas: {ss['pages']} · cortadas al casar selectores: **{ss['early']}** · "
+                f"recortadas por tope de bytes: {ss['capped']}\n")
+        f.write(f"- Leído: {ss['bytes_read'] / 1e6:.2f} MB · ahorrado: **{ss['bytes_saved'] / 1e6:.2f} MB** · "
+                f"tiempo ahorrado (estimado): {ss['time_saved']:.1f} s\n")
+        if ss["unknown_length"]:
+            f.write(f"- Cortes sin Content-Length (ahorro no medible): {ss['unknown_length']}\n")
+    cs = stats.get("cache")
+    if cs is not None:
+        f.write("\n## Caché HTTP\n")
+        f.write(f"- Hits: **{cs['hits']}** · Misses: **{cs['misses']}** · "
+                f"Entradas: {cs['entries']} · Expulsadas (LRU): {cs['evictions']}\n")
+    budget = stats["budget"]
+    f.write("\n## Circuit breakers\n")
+    f.write(f"- Presupuesto de reintentos: {budget['spent']:.1f} s de {budget['total']:.0f} s "
+            f"({budget['retries']} reintentos){' · **agotado**' if budget['exhausted'] else ''}\n")
+    if not stats["breakers"]:
+        f.write("- Sin fallos de dominio\n")
+    for b in stats["breakers"]:
+        f.write(f"- **{b['domain']}**: {b['state']} · fallos seguidos {b['consecutive']} · "
+                f"fallos {b['failures']} · omitidas {b['short_circuited']} · {b['last_error']}\n")
+
+def print_run_stats(stats: dict):
+    if stats["breakers"]:
+        print("Circuit breakers: " + ", ".join(f"{b['domain']}={b['state']} ({b['short_circuited']} omitidas)"
+                                               for b in stats["breakers"]))
+    sc = stats.get("schedule")
+    if sc is not None:
+        print(f"Programador: {sc['selected_urls']}/{sc['due_urls']} URLs vencidas chequeadas | "
+              f"{sc['deferred_urls']} aplazadas | {sc['tokens_left']} peticiones disponibles")
+    ss = stats.get("stream")
+    if ss is not None:
+        print(f"Streaming: {ss['early']}/{ss['pages']} páginas cortadas | "
+              f"{ss['bytes_saved'] / 1e6:.2f} MB y ~{ss['time_saved']:.1f} s ahorrados")
+    cs = stats.get("cache")
+    if cs is not None:
+        print(f"Caché HTTP: {cs['hits']} hits | {cs['misses']} misses | "
+              f"{cs['entries']} entradas | {cs['evictions']} expulsadas")
+
+def open_store(outdir: str, options: MonitorOptions):
+    store = open_history_store(outdir, options.history_backend, options.history_format)
+    legacy_history_path = os.path.join(outdir, "price_history.csv")
+    if isinstance(store, PartitionedHistoryStore) and store.is_empty() and os.path.exists(legacy_history_path):
+        n = store.migrate_from_csv(legacy_history_path)
+        print(f"[INFO] Histórico migrado desde {legacy_history_path}: {n} filas")
+    return store
+
+def collect(targets: List[Target], options: MonitorOptions, today: str, delta_pct: float, store):
+    """
+    Fase de descarga + evaluación de alertas. No escribe nada salvo la caché HTTP.
+    Devuelve (df_today, alerts, stats, metrics); cada alerta lleva `_pos`/`_rule` para poder reordenar
+    y `metrics` tiene una fila por target con los tiempos de su URL.
+    """
+    t0 = time.perf_counter()
+    ctx = build_fetch_context(options, targets)
+    results = scrape_all(targets, options, ctx)
+    elapsed = time.perf_counter() - t0
+
+    rows = []
+    for i, t in enumerate(targets):
+        try:
+            if isinstance(results[i], Exception):
+                raise results[i]
+            price, stock_text = results[i]
+            rows.append(build_row(t, today, price, stock_text))
         except Exception as e:
-            rows.append({
-                "date": today, "sku": t.sku, "name": t.name, "our_price": t.our_price,
-                "competitor_price": float("nan"), "diff_abs": float("nan"), "diff_pct": float("nan"),
-                "in_stock": None, "url": t.url, "error": str(e)[:200]
-            })
+            rows.append(error_row(t, today, e))
 
     df_today = pd.DataFrame(rows)
 
-    # Actualiza histórico
-    if os.path.exists(history_path):
-        hist = pd.read_csv(history_path)
-        hist = pd.concat([hist, df_today], ignore_index=True)
-    else:
-        hist = df_today.copy()
-    hist.to_csv(history_path, index=False)
+    if ctx.cache is not None:
+        ctx.cache.save()
+
+    # Alertas: reglas vectorizadas sobre el lote de hoy + histórico (antes de añadir hoy)
+    rules = load_rules(options.alert_rules, delta_pct)
+    alerts = evaluate_alerts(df_today, today, rules, store, with_order=True)
+    metrics = ctx.metrics.frame(today, ((t.sku, t.url) for t in targets), domain_of)
+    stats = run_stats(ctx, len(targets))
+    stats["elapsed"] = elapsed
+    return df_today, alerts, stats, metrics
+
+def publish(outdir: str, today: str, df_today: pd.DataFrame, alerts: List[dict], stats: dict, store,
+            run_tag: str = "", metrics: Optional[pd.DataFrame] = None, prom_path: Optional[str] = None):
+    """
+    Histórico, alerts_YYYYMMDD.csv, summary_YYYYMMDD.md, métricas y un único lote de notificaciones.
+    `run_tag` distingue varias ejecuciones el mismo día (modo programado: _HHMM).
+    """
+    alerts_path  = os.path.join(outdir, f"alerts_{today.replace('-','')}{run_tag}.csv")
+    summary_path = os.path.join(outdir, f"summary_{today.replace('-','')}{run_tag}.md")
+    metrics_path = os.path.join(outdir, f"metrics_{today.replace('-','')}{run_tag}.csv")
+    alerts = [{k: v for k, v in a.items() if not k.startswith("_")} for a in alerts]
+
+    # Actualiza histórico (sólo se añade la partición de hoy)
+    store.append(df_today)
+
+    # Métricas por target + textfile de Prometheus
+    if metrics is not None:
+        write_metrics_csv(metrics_path, metrics)
+        write_prometheus(prom_path or os.path.join(outdir, "price_monitor.prom"), metrics, stats, len(alerts))
 
     # Guarda alertas y resumen
     if alerts:
@@ -215,13 +1073,14 @@ def monitor(config_path: str, outdir: str, delta_pct: float):
 
     with open(summary_path, "w", encoding="utf-8") as f:
         f.write(f"# Price Monitor – {today}\n\n")
-        f.write(f"- Targets: **{len(targets)}**\n")
+        f.write(f"- Targets: **{stats['targets']}**\n")
         f.write(f"- Cambios relevantes: **{len(alerts)}**\n\n")
         if alerts:
             f.write("## Alertas\n")
             for a in alerts:
                 f.write(f"- **{a['sku']} – {a['name']}**: {a['reason']} · "
                         f"Nuestro: {a['our_price']} · Comp: {a['competitor_price']} · {a['delta_pct']}%  \n")
+        write_run_stats(f, stats)
 
     # Notificaciones (Slack / Email)
     slack_url = os.getenv("SLACK_WEBHOOK_URL", "")
@@ -250,19 +1109,339 @@ def monitor(config_path: str, outdir: str, delta_pct: float):
             pass
 
     print(f"[OK] Monitor finalizado. Rows: {len(df_today)} | Alerts: {len(alerts)}")
-    print(f"Histórico: {history_path}")
+    print(f"Histórico: {store}")
     if alerts:
         print(f"Alertas:   {alerts_path}")
     print(f"Resumen:   {summary_path}")
+    if metrics is not None:
+        print(f"Métricas:  {metrics_path}")
+    print_run_stats(stats)
+
+# --------------------
+# Ejecución repartida (shards) + merge
+# --------------------
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    # "i/N" con i en 1..N
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"--shard debe tener el formato i/N (p. ej. 1/4), no {spec!r}")
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError(f"Shard fuera de rango: {spec}")
+    return i, n
+
+def shard_of(t: Target, n: int, by: str = "domain") -> int:
+    """
+    Shard (1..n) de un target por hash estable (md5, no depende de PYTHONHASHSEED).
+    Por defecto por dominio: todas las URLs de un competidor van al mismo shard y
+    los límites de cortesía siguen siendo globales.
+    """
+    key = domain_of(t.url) if by == "domain" else t.sku
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16) % n + 1
+
+def shard_dir(outdir: str, today: str, i: int, n: int) -> str:
+    return os.path.join(outdir, "shards", today.replace("-", ""), f"shard-{i}-of-{n}")
+
+def _json_default(o):
+    # escalares numpy/pandas que lleguen en las filas o alertas
+    if hasattr(o, "item"):
+        return o.item()
+    if o is pd.NA:
+        return None
+    raise TypeError(f"No serializable: {type(o)}")
+
+def _write_jsonl(path: str, records: List[dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False, default=_json_default) + "\n")
+
+def _read_jsonl(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def write_shard(outdir: str, today: str, i: int, n: int, positions: List[int],
+                df_today: pd.DataFrame, alerts: List[dict], stats: dict,
+                metrics: Optional[pd.DataFrame] = None) -> str:
+    """
+    Salidas parciales de un shard. Se guardan en JSON Lines para que el merge reproduzca
+    exactamente los valores (NaN, None, floats) de una ejecución sin shards.
+    `_target_idx` es la posición del target en targets.csv.
+    """
+    d = shard_dir(outdir, today, i, n)
+    if os.path.exists(os.path.join(os.path.dirname(d), "merged.json")):
+        print(f"[WARN] Los shards de {today} ya se fusionaron: este shard no llegará al histórico")
+    os.makedirs(d, exist_ok=True)
+    rows = [{**{k: v for k, v in r.items() if not (k == "error" and pd.isna(v))}, "_target_idx": positions[j]}
+            for j, r in enumerate(df_today.to_dict("records"))]
+    _write_jsonl(os.path.join(d, "rows.jsonl"), rows)
+    _write_jsonl(os.path.join(d, "alerts.jsonl"),
+                 [{**a, "_target_idx": positions[a["_pos"]]} for a in alerts])
+    with open(os.path.join(d, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump({**stats, "shard": i, "of": n, "date": today}, f, ensure_ascii=False, default=_json_default)
+    if metrics is not None:
+        metrics.assign(_target_idx=positions).to_csv(os.path.join(d, "metrics.csv"), index=False)
+    return d
+
+def merge(outdir: str, options: Optional[MonitorOptions] = None, today: Optional[str] = None,
+          expected: Optional[int] = None, allow_partial: bool = False):
+    """
+    Une las salidas de todos los shards de `today` en histórico, alertas, resumen y
+    un único lote de notificaciones, en el mismo orden que una ejecución sin shards.
+    Idempotente: <shards>/<fecha>/merged.json marca el día como fusionado y un segundo
+    merge (p. ej. un paso de CI reintentado) no vuelve a añadir histórico ni a notificar.
+    Devuelve False si el día ya estaba fusionado.
+    """
+    options = options or MonitorOptions()
+    today = today or datetime.utcnow().strftime("%Y-%m-%d")
+    base = os.path.join(outdir, "shards", today.replace("-", ""))
+    marker = os.path.join(base, "merged.json")
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            done = json.load(f)
+        print(f"[OK] Los shards de {today} ya se fusionaron ({done.get('merged_at', '?')}, "
+              f"shards {done.get('shards', '?')}); no se repite el merge")
+        return False
+    dirs = sorted(d for d in (os.listdir(base) if os.path.isdir(base) else []) if d.startswith("shard-"))
+    if not dirs:
+        raise FileNotFoundError(f"No hay salidas de shards en {base}")
+    counts = {int(d.rsplit("-of-", 1)[1]) for d in dirs}
+    if len(counts) != 1:
+        raise ValueError(f"Shards con distinto N en {base}: {sorted(counts)}")
+    n = expected or counts.pop()
+    found = {int(d.split("-")[1]) for d in dirs}
+    missing = sorted(set(range(1, n + 1)) - found)
+    if missing and not allow_partial:
+        raise RuntimeError(f"Faltan shards {missing} de {n} en {base} (usa --allow-partial para continuar)")
+    if missing:
+        print(f"[WARN] Merge parcial: faltan shards {missing} de {n}")
+
+    rows, alerts, stats, metrics = [], [], [], []
+    for d in dirs:
+        path = os.path.join(base, d)
+        rows.extend(_read_jsonl(os.path.join(path, "rows.jsonl")))
+        alerts.extend(_read_jsonl(os.path.join(path, "alerts.jsonl")))
+        with open(os.path.join(path, "stats.json"), encoding="utf-8") as f:
+            stats.append(json.load(f))
+        if os.path.exists(os.path.join(path, "metrics.csv")):
+            m = pd.read_csv(os.path.join(path, "metrics.csv"), dtype={"sku": str, "url": str})
+            metrics.append(m.assign(error=m["error"].fillna("")))
+
+    rows.sort(key=lambda r: r["_target_idx"])
+    alerts.sort(key=lambda a: (a["_target_idx"], a["_rule"]))
+    df_today = pd.DataFrame([{k: v for k, v in r.items() if k != "_target_idx"} for r in rows])
+
+    if metrics:
+        metrics = pd.concat(metrics, ignore_index=True).sort_values("_target_idx", kind="stable")
+        metrics = metrics.drop(columns=["_target_idx"]).reset_index(drop=True)
+    else:
+        metrics = None
 
-def main():
-    parser = argparse.ArgumentParser(description="Competitor price monitoring")
-    parser.add_argument("--config", required=True, help="Ruta a config/targets.csv")
+    store = open_store(outdir, options)
+    publish(outdir, today, df_today, alerts, merge_stats(stats), store,
+            metrics=metrics, prom_path=options.metrics_prom)
+    tmp = marker + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"date": today, "shards": [int(d.split("-")[1]) for d in dirs], "of": n,
+                   "rows": len(df_today), "alerts": len(alerts),
+                   "merged_at": datetime.utcnow().isoformat(timespec="seconds")}, f, ensure_ascii=False)
+    os.replace(tmp, marker)
+    return True
+
+def monitor(config_path: str, outdir: str, delta_pct: float, options: Optional[MonitorOptions] = None,
+            shard: Optional[tuple[int, int]] = None, shard_by: str = "domain"):
+    options = options or MonitorOptions()
+    ensure_dirs(outdir)
+    now = datetime.utcnow()
+    today = now.strftime("%Y-%m-%d")
+
+    targets = load_targets(config_path)
+    positions = list(range(len(targets)))
+    if shard is not None:
+        i, n = shard
+        positions = [p for p in positions if shard_of(targets[p], n, shard_by) == i]
+        targets = [targets[p] for p in positions]
+
+    store = open_store(outdir, options)
+
+    if options.schedule is not None:
+        sched = RecheckScheduler(options.schedule_path or os.path.join(outdir, "schedule.json"), options.schedule)
+        series = pd.DataFrame({"sku": [t.sku for t in targets], "url": [t.url for t in targets]})
+        due = sched.select_due(series, store, now)
+        targets = [targets[p] for p in due]
+        if not targets:
+            sched.save()
+            sc = sched.last_selection
+            print(f"[OK] Nada que chequear ({sc['due_urls']} URLs vencidas, "
+                  f"{sc['tokens_left']} peticiones disponibles)")
+            return
+        df_today, alerts, stats, metrics = collect(targets, options, today, delta_pct, store)
+        # sólo cuenta como chequeado lo que se descargó bien; los fallos se reintentan pronto
+        errors = df_today["error"] if "error" in df_today else pd.Series(index=df_today.index, dtype=object)
+        failed = (errors.notna() & errors.astype(str).ne("")).to_numpy()
+        checked = series.iloc[due]
+        sched.mark_checked(checked[~failed], now)
+        sched.mark_failed(checked[failed], now)
+        sched.save()
+        stats["schedule"] = sched.last_selection
+        publish(outdir, today, df_today, alerts, stats, store, run_tag=now.strftime("_%H%M"),
+                metrics=metrics, prom_path=options.metrics_prom)
+        return
+
+    df_today, alerts, stats, metrics = collect(targets, options, today, delta_pct, store)
+
+    if shard is None:
+        publish(outdir, today, df_today, alerts, stats, store, metrics=metrics, prom_path=options.metrics_prom)
+        return
+
+    d = write_shard(outdir, today, shard[0], shard[1], positions, df_today, alerts, stats, metrics)
+    print(f"[OK] Shard {shard[0]}/{shard[1]} finalizado. Rows: {len(df_today)} | Alerts: {len(alerts)}")
+    print(f"Salidas parciales: {d}")
+    print_run_stats(stats)
+
+def run_loop(config_path: str, outdir: str, delta_pct: float, options: MonitorOptions, every_minutes: float):
+    """
+    Proceso de larga duración: cada `every_minutes` se chequea lo que ha vencido.
+    El presupuesto por hora del programador limita el trabajo entre iteraciones.
+    """
+    while True:
+        t0 = time.monotonic()
+        try:
+            monitor(config_path, outdir, delta_pct, options)
+        except Exception as e:
+            print(f"[ERROR] Iteración fallida: {e}")
+        time.sleep(max(0.0, every_minutes * 60 - (time.monotonic() - t0)))
+
+def merge_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="Motorizacion.py merge",
+                                     description="Une las salidas de los shards del monitor de precios")
+    parser.add_argument("--outdir", default="outputs", help="Directorio de salida (con shards/)")
+    parser.add_argument("--date", default=None, help="Fecha de los shards (YYYY-MM-DD, por defecto hoy UTC)")
+    parser.add_argument("--shards", type=int, default=None, help="Número de shards esperado")
+    parser.add_argument("--allow-partial", action="store_true", help="Continúa aunque falte algún shard")
+    parser.add_argument("--history", choices=["partitioned", "csv"], default=os.getenv("PRICE_HISTORY", "partitioned"))
+    parser.add_argument("--history-format", choices=["auto", "parquet", "csv"],
+                        default=os.getenv("PRICE_HISTORY_FORMAT", "auto"))
+    parser.add_argument("--metrics-prom", default=os.getenv("PRICE_METRICS_PROM", ""),
+                        help="Textfile de Prometheus (por defecto <outdir>/price_monitor.prom)")
+    args = parser.parse_args(argv)
+    options = MonitorOptions(history_backend=args.history, history_format=args.history_format,
+                             metrics_prom=args.metrics_prom or None)
+    merge(args.outdir, options, args.date, args.shards, args.allow_partial)
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "merge":
+        merge_main(argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(description="Competitor price monitoring "
+                                                 "(subcomando: merge para unir shards)")
+    parser.add_argument("--config", help="Ruta a config/targets.csv")
     parser.add_argument("--outdir", default="outputs", help="Directorio de salida")
-    args = parser.parse_args()
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PRICE_WORKERS", "1")),
+                        help="Hilos de descarga en paralelo (1 = modo serie)")
+    parser.add_argument("--per-domain", type=int, default=int(os.getenv("PRICE_PER_DOMAIN", "2")),
+                        help="Máximo de peticiones simultáneas por dominio")
+    parser.add_argument("--min-interval", type=float, default=float(os.getenv("PRICE_MIN_INTERVAL", "1.0")),
+                        help="Segundos mínimos entre peticiones al mismo dominio")
+    parser.add_argument("--http-cache", default=os.getenv("PRICE_HTTP_CACHE", ""),
+                        help="Ruta de la caché HTTP (por defecto <outdir>/http_cache.json)")
+    parser.add_argument("--no-http-cache", action="store_true", help="Desactiva la caché HTTP condicional")
+    parser.add_argument("--cache-max-entries", type=int, default=int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "5000")),
+                        help="Máximo de URLs en caché (expulsión LRU)")
+    parser.add_argument("--parser", choices=["auto", "lxml", "bs4"], default=os.getenv("PRICE_PARSER", "auto"),
+                        help="Backend de extracción (auto = lxml+cssselect si está instalado)")
+    parser.add_argument("--history", choices=["partitioned", "csv"], default=os.getenv("PRICE_HISTORY", "partitioned"),
+                        help="Backend del histórico (partitioned = una partición por día, csv = fichero único)")
+    parser.add_argument("--history-format", choices=["auto", "parquet", "csv"],
+                        default=os.getenv("PRICE_HISTORY_FORMAT", "auto"),
+                        help="Formato de las particiones (auto = parquet si hay pyarrow)")
+    parser.add_argument("--migrate-history", action="store_true",
+                        help="Migra <outdir>/price_history.csv al histórico particionado y termina")
+    parser.add_argument("--alert-rules", default=os.getenv("PRICE_ALERT_RULES", ""),
+                        help="JSON con reglas de alerta (por defecto: más barato que PRICE_DELTA_PCT y sin stock)")
+    parser.add_argument("--breaker-threshold", type=int, default=int(os.getenv("PRICE_BREAKER_THRESHOLD", "3")),
+                        help="URLs seguidas con fallo del dominio que abren su circuit breaker")
+    parser.add_argument("--retry-budget", type=float, default=float(os.getenv("PRICE_RETRY_BUDGET", "300")),
+                        help="Segundos totales de espera en reintentos por ejecución")
+    parser.add_argument("--shard", default=os.getenv("PRICE_SHARD", ""),
+                        help="Ejecuta sólo el shard i/N (p. ej. 2/4) y deja salidas parciales para 'merge'")
+    parser.add_argument("--shard-by", choices=["domain", "sku"], default=os.getenv("PRICE_SHARD_BY", "domain"),
+                        help="Clave del reparto entre shards (domain mantiene cada competidor en un shard)")
+    parser.add_argument("--stream", action="store_true", default=os.getenv("PRICE_STREAM", "") == "1",
+                        help="Descarga en streaming y corta en cuanto casan los selectores (parser lxml)")
+    parser.add_argument("--max-page-bytes", type=int, default=int(os.getenv("PRICE_MAX_PAGE_BYTES", "10000000")),
+                        help="Tope de bytes leídos por página en modo streaming")
+    parser.add_argument("--metrics-prom", default=os.getenv("PRICE_METRICS_PROM", ""),
+                        help="Textfile de Prometheus (por defecto <outdir>/price_monitor.prom)")
+    parser.add_argument("--schedule", action="store_true",
+                        help="Sólo chequea los targets vencidos según la volatilidad de su precio")
+    parser.add_argument("--loop", action="store_true",
+                        help="Proceso continuo: repite --schedule cada --loop-every minutos")
+    parser.add_argument("--loop-every", type=float, default=float(os.getenv("PRICE_LOOP_EVERY", "15")),
+                        help="Minutos entre iteraciones del modo --loop")
+    parser.add_argument("--hourly-budget", type=float, default=float(os.getenv("PRICE_HOURLY_BUDGET", "500")),
+                        help="Máximo de peticiones (URLs) por hora en modo programado")
+    parser.add_argument("--min-recheck-hours", type=float, default=float(os.getenv("PRICE_MIN_RECHECK_H", "1")),
+                        help="Intervalo mínimo de re-chequeo de una serie muy volátil")
+    parser.add_argument("--max-recheck-hours", type=float, default=float(os.getenv("PRICE_MAX_RECHECK_H", "168")),
+                        help="Intervalo máximo de re-chequeo de una serie sin cambios")
+    parser.add_argument("--retry-hours", type=float, default=float(os.getenv("PRICE_RETRY_H", "1")),
+                        help="Espera antes de reintentar una serie cuya descarga falló")
+    args = parser.parse_args(argv)
+
+    if args.migrate_history:
+        ensure_dirs(args.outdir)
+        legacy = os.path.join(args.outdir, "price_history.csv")
+        store = PartitionedHistoryStore(os.path.join(args.outdir, "price_history"), args.history_format)
+        n = store.migrate_from_csv(legacy)
+        print(f"[OK] Migradas {n} filas de {legacy} a {store}")
+        return
+    if not args.config:
+        parser.error("--config es obligatorio")
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    scheduled = args.schedule or args.loop
+    if scheduled and shard:
+        parser.error("--schedule/--loop no se combinan con --shard")
+
+    cache_path = None
+    if not args.no_http_cache:
+        # cada shard con su propia caché: pueden ejecutarse a la vez sobre el mismo outdir
+        default_cache = f"http_cache.shard-{shard[0]}-of-{shard[1]}.json" if shard else "http_cache.json"
+        cache_path = args.http_cache or os.path.join(args.outdir, default_cache)
 
     delta_pct = float(os.getenv("PRICE_DELTA_PCT", "10"))
-    monitor(args.config, args.outdir, delta_pct)
+    options = MonitorOptions(
+        workers=args.workers,
+        per_domain=args.per_domain,
+        min_interval=args.min_interval,
+        cache_path=cache_path,
+        cache_max_entries=args.cache_max_entries,
+        parser=args.parser,
+        history_backend=args.history,
+        history_format=args.history_format,
+        alert_rules=args.alert_rules or None,
+        breaker_threshold=args.breaker_threshold,
+        retry_budget=args.retry_budget,
+        stream=args.stream,
+        max_page_bytes=args.max_page_bytes,
+        metrics_prom=args.metrics_prom or None,
+    )
+    if scheduled:
+        options.schedule = SchedulerConfig(hourly_budget=args.hourly_budget,
+                                           min_interval_h=args.min_recheck_hours,
+                                           max_interval_h=args.max_recheck_hours,
+                                           retry_interval_h=args.retry_hours)
+    if args.loop:
+        run_loop(args.config, args.outdir, delta_pct, options, args.loop_every)
+        return
+    monitor(args.config, args.outdir, delta_pct, options, shard, args.shard_by)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,272 @@
+# scripts/alert_rules.py
+# Motor de alertas vectorizado (se ejecuta tras la fase de descarga)
+# - Reglas declarativas cargadas de JSON (lista de {"type": ..., parámetros})
+# - Evalúa el lote de hoy unido al histórico con operaciones sobre DataFrames
+# - Sólo lee del histórico la ventana máxima que necesitan las reglas
+#
+# Ejemplo config/alert_rules.json:
+# [
+#   {"type": "cheaper_than_us", "threshold_pct": 10},
+#   {"type": "out_of_stock"},
+#   {"type": "drop_vs_median", "pct": 15, "window_days": 7},
+#   {"type": "consecutive_cheaper", "days": 3},
+#   {"type": "stock_flip"}
+# ]
+
+import json
+from dataclasses import dataclass, fields
+from datetime import timedelta
+from typing import Optional, List, Dict
+
+import numpy as np
+import pandas as pd
+
+ALERT_COLUMNS = ["date", "sku", "name", "our_price", "competitor_price", "delta_pct", "reason"]
+
+def _fmt_pct(v) -> str:
+    return str(abs(round(float(v), 2)))
+
+class AlertContext:
+    """
+    Lote de hoy + histórico en formato largo. Las matrices anchas fecha x serie se construyen
+    bajo demanda (sólo las que piden las reglas configuradas) con numpy.
+    Una serie es un par (sku, url): el mismo SKU puede vigilarse en varios competidores.
+    """
+    def __init__(self, today: str, batch: pd.DataFrame, n_series: int,
+                 dates: pd.Index, long: Dict[str, np.ndarray]):
+        self.today = today
+        # una fila por target, en el orden de targets.csv; columna `_col` = serie
+        self.batch = batch
+        self.n_series = n_series
+        self.dates = dates
+        self._long = long
+        self._wide: Dict[str, pd.DataFrame] = {}
+
+    def _matrix(self, value: str) -> pd.DataFrame:
+        if value not in self._wide:
+            arr = np.full((len(self.dates), self.n_series), np.nan)
+            arr[self._long["row"], self._long["col"]] = self._long[value]
+            self._wide[value] = pd.DataFrame(arr, index=self.dates)
+        return self._wide[value]
+
+    @property
+    def price(self) -> pd.DataFrame:
+        return self._matrix("competitor_price")
+
+    @property
+    def ours(self) -> pd.DataFrame:
+        return self._matrix("our_price")
+
+    @property
+    def stock(self) -> pd.DataFrame:
+        return self._matrix("in_stock")
+
+    def aligned(self, per_series: pd.Series) -> pd.Series:
+        # valores por serie alineados con las filas del lote
+        return pd.Series(per_series.to_numpy()[self.batch["_col"].to_numpy()], index=self.batch.index)
+
+    def stock_today(self) -> pd.Series:
+        return _stock_float(self.batch["in_stock"])
+
+def _stock_float(s: pd.Series) -> pd.Series:
+    return s.astype("boolean").astype("Float64").astype("float64")
+
+@dataclass
+class Rule:
+    # días de histórico previos a hoy que necesita la regla (0 = sólo el lote de hoy)
+    def lookback_days(self) -> int:
+        return 0
+
+    def evaluate(self, ctx: AlertContext) -> pd.DataFrame:
+        """
+        Devuelve las filas del lote que disparan la regla con columnas extra `delta_pct` y `reason`.
+        """
+        raise NotImplementedError
+
+def _delta_vs_ours(rows: pd.DataFrame) -> List:
+    return [round(float(v), 2) if pd.notna(v) else "" for v in rows["diff_pct"]]
+
+@dataclass
+class CheaperThanUs(Rule):
+    """Competidor más barato que nosotros por más de threshold_pct."""
+    threshold_pct: float = 10.0
+
+    def evaluate(self, ctx):
+        b = ctx.batch
+        hit = b[b["competitor_price"].notna() & (b["diff_pct"] < -abs(self.threshold_pct))].copy()
+        hit["delta_pct"] = [round(float(v), 2) for v in hit["diff_pct"]]
+        hit["reason"] = [f"Competidor más barato {_fmt_pct(v)}%" for v in hit["diff_pct"]]
+        return hit
+
+@dataclass
+class OutOfStock(Rule):
+    """Oportunidad: competidor sin stock (o no disponible)."""
+    def evaluate(self, ctx):
+        b = ctx.batch
+        hit = b[b["in_stock"].astype("boolean").eq(False).fillna(False)].copy()
+        hit["delta_pct"] = _delta_vs_ours(hit)
+        hit["reason"] = "Competidor sin stock (o no disponible)"
+        return hit
+
+@dataclass
+class DropVsMedian(Rule):
+    """Precio del competidor cae más de pct% respecto a su mediana de los últimos window_days."""
+    pct: float = 15.0
+    window_days: int = 7
+    min_observations: int = 3
+
+    def lookback_days(self):
+        return self.window_days
+
+    def evaluate(self, ctx):
+        prev = ctx.price.iloc[:-1].tail(self.window_days)
+        median = prev.median(axis=0, skipna=True).where(prev.notna().sum(axis=0) >= self.min_observations)
+        median = ctx.aligned(median)
+        today = ctx.batch["competitor_price"]
+        change = (today / median - 1.0) * 100.0
+        hit = ctx.batch[change.notna() & (change < -abs(self.pct))].copy()
+        chg = change[hit.index]
+        hit["delta_pct"] = [round(float(v), 2) for v in chg]
+        hit["reason"] = [f"Bajada {_fmt_pct(v)}% vs mediana {self.window_days}d" for v in chg]
+        return hit
+
+@dataclass
+class ConsecutiveCheaper(Rule):
+    """Competidor más barato que nosotros (más de threshold_pct) durante `days` días seguidos, hoy incluido."""
+    days: int = 3
+    threshold_pct: float = 0.0
+
+    def lookback_days(self):
+        return max(0, self.days - 1)
+
+    def evaluate(self, ctx):
+        days = max(1, self.days)
+        limit = ctx.ours.tail(days) * (1.0 - abs(self.threshold_pct) / 100.0)
+        cheaper = ctx.price.tail(days) < limit  # NaN (sin dato ese día) -> False
+        streak = cheaper.all(axis=0)
+        hit = ctx.batch[ctx.aligned(streak).fillna(False).astype(bool)].copy()
+        hit["delta_pct"] = _delta_vs_ours(hit)
+        hit["reason"] = f"Más barato que nosotros {self.days} días seguidos"
+        return hit
+
+@dataclass
+class StockFlip(Rule):
+    """Cambio de disponibilidad respecto al último estado conocido (direction: any | out | in)."""
+    direction: str = "any"
+    lookback: int = 30
+
+    def lookback_days(self):
+        return self.lookback
+
+    def evaluate(self, ctx):
+        prev = ctx.aligned(ctx.stock.iloc[:-1].ffill().iloc[-1]) if len(ctx.stock) > 1 \
+            else pd.Series(float("nan"), index=ctx.batch.index)
+        now = ctx.stock_today()
+        flip = now.notna() & prev.notna() & (now != prev)
+        if self.direction == "out":
+            flip &= now == 0.0
+        elif self.direction == "in":
+            flip &= now == 1.0
+        hit = ctx.batch[flip].copy()
+        hit["delta_pct"] = _delta_vs_ours(hit)
+        hit["reason"] = ["Stock: disponible → agotado" if v == 0.0 else "Stock: agotado → disponible"
+                         for v in now[hit.index]]
+        return hit
+
+RULE_TYPES: Dict[str, type] = {
+    "cheaper_than_us": CheaperThanUs,
+    "out_of_stock": OutOfStock,
+    "drop_vs_median": DropVsMedian,
+    "consecutive_cheaper": ConsecutiveCheaper,
+    "stock_flip": StockFlip,
+}
+
+def default_rules(delta_pct: float) -> List[Rule]:
+    # equivalentes a los criterios originales del bucle de descarga
+    return [CheaperThanUs(threshold_pct=delta_pct), OutOfStock()]
+
+def rule_from_dict(spec: dict) -> Rule:
+    spec = dict(spec)
+    kind = spec.pop("type", None)
+    if kind not in RULE_TYPES:
+        raise ValueError(f"Tipo de regla desconocido: {kind!r} (disponibles: {', '.join(RULE_TYPES)})")
+    cls = RULE_TYPES[kind]
+    allowed = {f.name for f in fields(cls)}
+    unknown = set(spec) - allowed
+    if unknown:
+        raise ValueError(f"Parámetros no válidos para {kind}: {', '.join(sorted(unknown))}")
+    return cls(**spec)
+
+def load_rules(path: Optional[str], delta_pct: float) -> List[Rule]:
+    if not path:
+        return default_rules(delta_pct)
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)
+    return [rule_from_dict(s) for s in specs]
+
+def build_context(df_today: pd.DataFrame, today: str, rules: List[Rule], history=None) -> AlertContext:
+    batch = df_today.reset_index(drop=True)
+    batch["sku"] = batch["sku"].astype(str)
+    batch["url"] = batch["url"].astype(str)
+    # código entero por serie (sku, url): evita claves de texto sobre todo el histórico
+    sku_index = pd.Index(batch["sku"].unique())
+    url_index = pd.Index(batch["url"].unique())
+
+    def series_code(df: pd.DataFrame) -> np.ndarray:
+        s = sku_index.get_indexer(df["sku"].astype(str))
+        u = url_index.get_indexer(df["url"].astype(str))
+        return np.where((s >= 0) & (u >= 0), s.astype(np.int64) * len(url_index) + u, -1)
+
+    series = pd.Index(pd.unique(series_code(batch)))
+    batch["_col"] = series.get_indexer(series_code(batch))
+    # lookback 0: las matrices tienen sólo la fila de hoy (sin leer el histórico)
+    lookback = max((max(0, r.lookback_days()) for r in rules), default=0)
+    start = (pd.Timestamp(today) - timedelta(days=lookback)).strftime("%Y-%m-%d")
+    end = (pd.Timestamp(today) - timedelta(days=1)).strftime("%Y-%m-%d")
+    cols = ["date", "sku", "url", "our_price", "competitor_price", "in_stock"]
+    if history is not None and lookback > 0:
+        hist = history.read(start=start, end=end, skus=sku_index, columns=cols)
+    else:
+        hist = pd.DataFrame(columns=cols)
+
+    dates = pd.Index(pd.date_range(start, today, freq="D").strftime("%Y-%m-%d"), name="date")
+    parts = [hist[cols], batch[cols].assign(date=today)]
+    row = np.concatenate([dates.get_indexer(p["date"].astype(str)) for p in parts])
+    col = np.concatenate([series.get_indexer(series_code(p)) if len(p) else np.array([], dtype=np.int64)
+                          for p in parts])
+    keep = (row >= 0) & (col >= 0)
+    # varias observaciones el mismo día (reejecuciones): nos quedamos con la última
+    flat = row * len(series) + col
+    last = np.zeros(len(flat), dtype=bool)
+    valid = np.flatnonzero(keep)
+    _, first_in_reversed = np.unique(flat[valid][::-1], return_index=True)
+    last[valid[len(valid) - 1 - first_in_reversed]] = True
+    keep = last
+    long = {"row": row[keep], "col": col[keep]}
+    for value in ("our_price", "competitor_price"):
+        long[value] = np.concatenate([pd.to_numeric(p[value], errors="coerce").to_numpy(dtype="float64")
+                                      for p in parts])[keep]
+    long["in_stock"] = np.concatenate([_stock_float(p["in_stock"]).to_numpy() for p in parts])[keep]
+    return AlertContext(today, batch, len(series), dates, long)
+
+def evaluate_alerts(df_today: pd.DataFrame, today: str, rules: List[Rule], history=None,
+                    with_order: bool = False) -> List[dict]:
+    """
+    Ejecuta todas las reglas sobre el lote de hoy (+ histórico) y devuelve las alertas
+    ordenadas por target y, dentro de cada target, por el orden de las reglas.
+    Con `with_order` cada alerta incluye `_pos` (fila del lote) y `_rule` (índice de la regla).
+    """
+    if df_today.empty or not rules:
+        return []
+    ctx = build_context(df_today, today, rules, history)
+    parts = []
+    for order, rule in enumerate(rules):
+        hit = rule.evaluate(ctx)
+        if not hit.empty:
+            parts.append(hit.assign(_pos=hit.index, _rule=order))
+    if not parts:
+        return []
+    out = pd.concat(parts).sort_values(["_pos", "_rule"], kind="stable")
+    out["date"] = today
+    cols = ALERT_COLUMNS + (["_pos", "_rule"] if with_order else [])
+    return out[cols].astype(object).to_dict("records")
@@ -0,0 +1,197 @@
+# scripts/history_store.py
+# Almacenamiento del histórico de precios
+# - CsvHistoryStore: fichero único outputs/price_history.csv (lee + concatena + reescribe)
+# - PartitionedHistoryStore: outputs/price_history/date=YYYY-MM-DD/part-*.parquet (o .csv)
+#   Sólo añade la partición del día; la lectura poda por fecha y filtra por SKU.
+#   La fecha sólo vive en el nombre de la partición (estilo Hive), así el directorio
+#   también se puede leer directamente con pyarrow/duckdb.
+
+import os
+import uuid
+from datetime import datetime
+from typing import Optional, List, Iterable
+
+import pandas as pd
+
+HISTORY_COLUMNS = ["date", "sku", "name", "our_price", "competitor_price",
+                   "diff_abs", "diff_pct", "in_stock", "url", "error"]
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _normalize(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    # mismo esquema en todas las particiones, aunque hoy no haya errores o stock
+    cols = columns or HISTORY_COLUMNS
+    df = df.reindex(columns=cols)
+    for c in cols:
+        if c in ("date", "sku"):
+            df[c] = df[c].astype(str)
+        elif c in ("name", "url", "error"):
+            df[c] = df[c].astype("string")
+        elif c in ("our_price", "competitor_price", "diff_abs", "diff_pct"):
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+        elif c == "in_stock":
+            df[c] = df[c].map(_to_bool).astype("boolean")
+    return df
+
+def _to_bool(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)) or v is pd.NA:
+        return pd.NA
+    if isinstance(v, str):
+        v = v.strip().lower()
+        if v in ("true", "1"):
+            return True
+        if v in ("false", "0"):
+            return False
+        return pd.NA
+    return bool(v)
+
+def _filter(df: pd.DataFrame, start: Optional[str], end: Optional[str],
+            skus: Optional[Iterable[str]]) -> pd.DataFrame:
+    if start:
+        df = df[df["date"] >= start]
+    if end:
+        df = df[df["date"] <= end]
+    if skus is not None:
+        df = df[df["sku"].isin(set(skus))]
+    return df
+
+class CsvHistoryStore:
+    """
+    Comportamiento original: un único CSV que se reescribe completo en cada ejecución.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, df_today: pd.DataFrame):
+        if os.path.exists(self.path):
+            hist = pd.read_csv(self.path)
+            hist = pd.concat([hist, df_today], ignore_index=True)
+        else:
+            hist = df_today.copy()
+        hist.to_csv(self.path, index=False)
+
+    def read(self, start: Optional[str] = None, end: Optional[str] = None,
+             skus: Optional[Iterable[str]] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return _normalize(pd.DataFrame(), columns)
+        df = pd.read_csv(self.path, dtype={"sku": str, "date": str})
+        df = _filter(df, start, end, skus).reset_index(drop=True)
+        return _normalize(df, columns)
+
+    def dates(self) -> List[str]:
+        if not os.path.exists(self.path):
+            return []
+        return sorted(pd.read_csv(self.path, usecols=["date"], dtype=str)["date"].unique())
+
+    def __str__(self):
+        return self.path
+
+class PartitionedHistoryStore:
+    """
+    Histórico append-only particionado por día.
+    Cada ejecución escribe un fichero nuevo en la partición de su fecha; nunca se reescribe lo anterior.
+    """
+    def __init__(self, root: str, fmt: str = "auto"):
+        self.root = root
+        if fmt == "auto":
+            fmt = "parquet" if parquet_available() else "csv"
+        if fmt not in ("parquet", "csv"):
+            raise ValueError(f"Formato de histórico no soportado: {fmt}")
+        self.fmt = fmt
+        os.makedirs(self.root, exist_ok=True)
+
+    def _partition_dir(self, date: str) -> str:
+        return os.path.join(self.root, f"date={date}")
+
+    def dates(self) -> List[str]:
+        out = []
+        for name in os.listdir(self.root):
+            if name.startswith("date=") and os.path.isdir(os.path.join(self.root, name)):
+                out.append(name[len("date="):])
+        return sorted(out)
+
+    def is_empty(self) -> bool:
+        return not self.dates()
+
+    def append(self, df_today: pd.DataFrame):
+        if df_today.empty:
+            return
+        df = _normalize(df_today)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        for date, part in df.groupby("date", sort=True):
+            pdir = self._partition_dir(date)
+            os.makedirs(pdir, exist_ok=True)
+            name = f"part-{stamp}-{uuid.uuid4().hex[:8]}.{self.fmt}"
+            path = os.path.join(pdir, name)
+            tmp = path + ".tmp"
+            part = part.drop(columns=["date"])
+            if self.fmt == "parquet":
+                part.to_parquet(tmp, index=False)
+            else:
+                part.to_csv(tmp, index=False)
+            # renombrado atómico: un lector nunca ve un fichero a medio escribir
+            os.replace(tmp, path)
+
+    def _read_file(self, path: str, date: str, skus: Optional[set], columns: Optional[List[str]]) -> pd.DataFrame:
+        file_cols = [c for c in columns if c != "date"] if columns else None
+        if path.endswith(".parquet"):
+            filters = [("sku", "in", list(skus))] if skus is not None else None
+            df = pd.read_parquet(path, columns=file_cols, filters=filters)
+        else:
+            df = pd.read_csv(path, usecols=file_cols, dtype={"sku": str})
+            if skus is not None:
+                df = df[df["sku"].isin(skus)]
+        # la fecha viene del nombre de la partición
+        df["date"] = date
+        return df
+
+    def read(self, start: Optional[str] = None, end: Optional[str] = None,
+             skus: Optional[Iterable[str]] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Carga un rango de fechas [start, end] y/o un subconjunto de SKUs.
+        Sólo se abren las particiones del rango; en Parquet el filtro por SKU se empuja al lector.
+        """
+        sku_set = set(map(str, skus)) if skus is not None else None
+        read_cols = None
+        if columns:
+            # necesitamos sku para filtrar en CSV; se recorta al final
+            read_cols = list(dict.fromkeys(columns + (["sku"] if sku_set is not None else [])))
+        frames = []
+        for date in self.dates():
+            if (start and date < start) or (end and date > end):
+                continue
+            pdir = self._partition_dir(date)
+            for name in sorted(os.listdir(pdir)):
+                if name.endswith(".parquet") or name.endswith(".csv"):
+                    frames.append(self._read_file(os.path.join(pdir, name), date, sku_set, read_cols))
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return _normalize(pd.DataFrame(), columns)
+        return _normalize(pd.concat(frames, ignore_index=True), columns)
+
+    def migrate_from_csv(self, csv_path: str, chunksize: int = 200_000) -> int:
+        """
+        Migración única desde price_history.csv. Lee por bloques para no cargar todo en memoria.
+        Devuelve el número de filas migradas.
+        """
+        if not self.is_empty():
+            raise RuntimeError(f"El histórico particionado {self.root} no está vacío; migración cancelada")
+        total = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype={"sku": str, "date": str}):
+            self.append(chunk)
+            total += len(chunk)
+        return total
+
+    def __str__(self):
+        return self.root
+
+def open_history_store(outdir: str, backend: str = "partitioned", fmt: str = "auto"):
+    legacy_path = os.path.join(outdir, "price_history.csv")
+    if backend == "csv":
+        return CsvHistoryStore(legacy_path)
+    return PartitionedHistoryStore(os.path.join(outdir, "price_history"), fmt)
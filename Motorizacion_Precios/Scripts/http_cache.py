@@ -0,0 +1,117 @@
+# scripts/http_cache.py
+# Caché HTTP persistente para el monitor de precios
+# - Clave: URL
+# - Guarda ETag / Last-Modified y un digest (sha256) del cuerpo
+# - Guarda el precio/stock ya extraído por combinación de selectores
+# - Límite de entradas con expulsión LRU
+# No guardamos el HTML: ante un 304 o un cuerpo idéntico reutilizamos lo extraído.
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+def body_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def selector_key(price_selector: str, stock_selector: Optional[str]) -> str:
+    return f"{price_selector}\x1f{stock_selector or ''}"
+
+class ResponseCache:
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # caché corrupta: empezamos de cero, no es un dato crítico
+            return
+        # el fichero se guarda de menos a más reciente (orden LRU)
+        for url, entry in data.get("entries", []):
+            self._entries[url] = entry
+
+    def save(self):
+        with self._lock:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            payload = {"version": 1, "entries": list(self._entries.items())}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _touch(self, url: str) -> Optional[dict]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def conditional_headers(self, url: str, keys: List[str]) -> Dict[str, str]:
+        """
+        Cabeceras If-None-Match / If-Modified-Since, sólo si tenemos extraídos
+        todos los selectores pedidos (un 304 no trae cuerpo que parsear).
+        """
+        with self._lock:
+            entry = self._touch(url)
+            if not entry or any(k not in entry.get("extracted", {}) for k in keys):
+                return {}
+            headers = {}
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            return headers
+
+    def get_extracted(self, url: str, key: str, digest: Optional[str] = None) -> Optional[Tuple]:
+        """
+        Valor extraído para `key`. Si se pasa `digest`, sólo vale si el cuerpo no ha cambiado.
+        """
+        with self._lock:
+            entry = self._touch(url)
+            if not entry:
+                return None
+            if digest is not None and entry.get("digest") != digest:
+                return None
+            value = entry.get("extracted", {}).get(key)
+            return tuple(value) if value is not None else None
+
+    def store(self, url: str, digest: str, etag: Optional[str], last_modified: Optional[str],
+              extracted: Dict[str, Tuple]):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry.get("digest") != digest:
+                # cuerpo nuevo: lo extraído antes ya no es válido
+                entry = {"digest": digest, "extracted": {}}
+            if etag:
+                entry["etag"] = etag
+            if last_modified:
+                entry["last_modified"] = last_modified
+            for k, v in extracted.items():
+                entry["extracted"][k] = list(v)
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "evictions": self.evictions}
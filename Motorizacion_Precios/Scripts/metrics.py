@@ -0,0 +1,125 @@
+# scripts/metrics.py
+# Instrumentación del camino caliente del monitor
+# - Tiempos por URL: conexión (DNS/connect + espera hasta cabeceras), descarga, parseo, extracción
+# - Bytes, reintentos, estado de caché y streaming
+# - Exporta metrics_YYYYMMDD.csv (una fila por target) y un textfile de Prometheus
+#   (node_exporter --collector.textfile.directory)
+
+import os
+import time
+import threading
+from typing import Optional, List, Dict, Iterable
+
+import pandas as pd
+
+METRIC_COLUMNS = ["date", "sku", "url", "domain", "status", "cache", "streamed", "truncated",
+                  "retries", "bytes", "wait_s", "connect_s", "download_s", "parse_s", "extract_s",
+                  "total_s", "group_size", "error"]
+
+PHASES = ["wait", "connect", "download", "parse", "extract"]
+
+class MetricsRecorder:
+    """
+    Métricas por URL (cada URL se descarga y parsea una vez para todos sus targets).
+    Se rellena desde los hilos de descarga.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._urls: Dict[str, dict] = {}
+
+    def add(self, url: str, **values):
+        # suma tiempos/bytes/reintentos (p. ej. 304 + descarga completa) y sobrescribe el resto
+        with self._lock:
+            m = self._urls.setdefault(url, {})
+            for k, v in values.items():
+                if k.endswith("_s") or k in ("bytes", "retries"):
+                    m[k] = m.get(k, 0) + v
+                else:
+                    m[k] = v
+
+    def get(self, url: str) -> dict:
+        with self._lock:
+            return dict(self._urls.get(url, {}))
+
+    def frame(self, today: str, series: Iterable[tuple], domain_of) -> pd.DataFrame:
+        """Una fila por target (sku, url) con las métricas de su URL."""
+        series = list(series)
+        sizes: Dict[str, int] = {}
+        for _, url in series:
+            sizes[url] = sizes.get(url, 0) + 1
+        rows = []
+        for sku, url in series:
+            m = self.get(url)
+            rows.append({
+                "date": today,
+                "sku": sku,
+                "url": url,
+                "domain": domain_of(url),
+                "status": m.get("status"),
+                "cache": m.get("cache", "off"),
+                "streamed": bool(m.get("streamed", False)),
+                "truncated": bool(m.get("truncated", False)),
+                "retries": int(m.get("retries", 0)),
+                "bytes": int(m.get("bytes", 0)),
+                **{f"{p}_s": round(float(m.get(f"{p}_s", 0.0)), 6) for p in PHASES + ["total"]},
+                "group_size": sizes[url],
+                "error": m.get("error", ""),
+            })
+        out = pd.DataFrame(rows, columns=METRIC_COLUMNS)
+        out["status"] = out["status"].astype("Int64")
+        return out
+
+def write_metrics_csv(path: str, metrics: pd.DataFrame):
+    metrics.to_csv(path, index=False)
+
+def _label(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _sample(name: str, labels: Dict[str, object], value: float) -> str:
+    lab = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+    return f"{name}{{{lab}}} {value}" if lab else f"{name} {value}"
+
+def prometheus_text(metrics: pd.DataFrame, stats: dict, n_alerts: int, finished: Optional[float] = None) -> str:
+    """
+    Métricas de la última ejecución en formato de exposición de Prometheus.
+    Por dominio (no por target) para no disparar la cardinalidad.
+    """
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str, samples: List[tuple]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(_sample(name, labels, value))
+
+    metric("price_monitor_last_run_timestamp_seconds", "gauge", "Fin de la última ejecución (epoch)",
+           [({}, round(finished or time.time(), 3))])
+    metric("price_monitor_last_run_duration_seconds", "gauge", "Duración de la fase de descarga",
+           [({}, round(float(stats.get("elapsed", 0.0)), 3))])
+    metric("price_monitor_last_run_targets", "gauge", "Targets procesados", [({}, stats["targets"])])
+    metric("price_monitor_last_run_alerts", "gauge", "Alertas generadas", [({}, n_alerts)])
+
+    # por URL (no por target): una descarga compartida cuenta una vez
+    urls = metrics.drop_duplicates("url") if not metrics.empty else metrics
+    if not urls.empty:
+        outcome = urls["cache"].where(urls["error"].fillna("").eq(""), "error")
+        by_outcome = urls.assign(outcome=outcome).groupby(["domain", "outcome"]).size()
+        metric("price_monitor_last_run_urls", "gauge", "URLs por dominio y resultado (hit/miss/off/error)",
+               [({"domain": d, "outcome": o}, int(n)) for (d, o), n in by_outcome.items()])
+        g = urls.groupby("domain")
+        metric("price_monitor_last_run_phase_seconds", "gauge", "Segundos acumulados por fase y dominio",
+               [({"domain": d, "phase": p}, round(float(v), 6))
+                for p in PHASES for d, v in g[f"{p}_s"].sum().items()])
+        metric("price_monitor_last_run_bytes", "gauge", "Bytes leídos por dominio",
+               [({"domain": d}, int(v)) for d, v in g["bytes"].sum().items()])
+        metric("price_monitor_last_run_retries", "gauge", "Reintentos por dominio",
+               [({"domain": d}, int(v)) for d, v in g["retries"].sum().items()])
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path: str, metrics: pd.DataFrame, stats: dict, n_alerts: int):
+    # escritura atómica: el collector de textfile nunca debe leer un fichero a medias
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(metrics, stats, n_alerts))
+    os.replace(tmp, path)
@@ -0,0 +1,163 @@
+# scripts/scheduler.py
+# Programador adaptativo de re-chequeos para el monitor de precios
+# - Frecuencia de cambio de cada serie (sku, url) a partir del histórico
+# - Intervalo de re-chequeo = 24h / (cambios por día * muestras por cambio), acotado [min, max]
+# - Sólo se descargan las URLs vencidas, las más atrasadas primero
+# - Presupuesto global de peticiones por hora (token bucket persistido entre ejecuciones)
+
+import os
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict
+
+import numpy as np
+import pandas as pd
+
+@dataclass
+class SchedulerConfig:
+    # peticiones (URLs) por hora como máximo; también es la ráfaga máxima acumulable
+    hourly_budget: float = 500.0
+    min_interval_h: float = 1.0
+    max_interval_h: float = 168.0
+    # series con poco histórico se siguen chequeando a diario
+    default_interval_h: float = 24.0
+    min_observations: int = 3
+    # cuántas veces queremos observar cada serie entre dos cambios de precio
+    samples_per_change: float = 2.0
+    lookback_days: int = 90
+    # tras un fallo (5xx, timeout, circuito abierto) se reintenta pronto, sin esperar al intervalo de la serie
+    retry_interval_h: float = 1.0
+
+def series_key(sku: str, url: str) -> str:
+    return f"{sku}\x1f{url}"
+
+class RecheckScheduler:
+    def __init__(self, state_path: str, config: Optional[SchedulerConfig] = None):
+        self.state_path = state_path
+        self.config = config or SchedulerConfig()
+        self.last_check: Dict[str, str] = {}
+        self.last_failure: Dict[str, str] = {}
+        self.tokens = float(self.config.hourly_budget)
+        self.tokens_at: Optional[datetime] = None
+        self.last_selection: dict = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.last_check = data.get("last_check", {})
+        self.last_failure = data.get("last_failure", {})
+        self.tokens = float(data.get("tokens", self.config.hourly_budget))
+        if data.get("tokens_at"):
+            self.tokens_at = datetime.fromisoformat(data["tokens_at"])
+
+    def save(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": 1,
+                "tokens": self.tokens,
+                "tokens_at": self.tokens_at.isoformat() if self.tokens_at else None,
+                "last_check": self.last_check,
+                "last_failure": self.last_failure,
+            }, f, ensure_ascii=False)
+        os.replace(tmp, self.state_path)
+
+    def _refill(self, now: datetime):
+        cap = float(self.config.hourly_budget)
+        if self.tokens_at is not None:
+            hours = max(0.0, (now - self.tokens_at).total_seconds() / 3600.0)
+            self.tokens = min(cap, self.tokens + hours * cap)
+        else:
+            self.tokens = cap
+        self.tokens_at = now
+
+    def intervals(self, series: pd.DataFrame, history, now: datetime) -> pd.Series:
+        """
+        Intervalo de re-chequeo (horas) por serie, indexado por clave (sku, url).
+        """
+        cfg = self.config
+        keys = pd.Index([series_key(s, u) for s, u in zip(series["sku"], series["url"])]).unique()
+        out = pd.Series(cfg.default_interval_h, index=keys, dtype="float64")
+        if history is None:
+            return out
+
+        start = (now - timedelta(days=cfg.lookback_days)).strftime("%Y-%m-%d")
+        hist = history.read(start=start, skus=series["sku"].astype(str).unique(),
+                            columns=["date", "sku", "url", "competitor_price"])
+        hist = hist[hist["competitor_price"].notna()]
+        if hist.empty:
+            return out
+        hist = hist.assign(_key=hist["sku"].astype(str) + "\x1f" + hist["url"].astype(str))
+        hist = hist[hist["_key"].isin(keys)]
+        # orden estable por fecha: dentro del mismo día se respeta el orden de escritura
+        hist = hist.sort_values(["_key", "date"], kind="stable")
+
+        same_key = hist["_key"].eq(hist["_key"].shift())
+        changed = same_key & hist["competitor_price"].ne(hist["competitor_price"].shift())
+        g = hist.assign(_changed=changed.astype("int64"), _d=pd.to_datetime(hist["date"])).groupby("_key")
+        stats = pd.DataFrame({
+            "n": g.size(),
+            "changes": g["_changed"].sum(),
+            "span_days": (g["_d"].max() - g["_d"].min()).dt.days + 1,
+        })
+        rate = stats["changes"] / stats["span_days"]  # cambios por día
+        with np.errstate(divide="ignore"):
+            hours = 24.0 / (rate * cfg.samples_per_change)
+        hours = hours.where(rate > 0, cfg.max_interval_h).clip(cfg.min_interval_h, cfg.max_interval_h)
+        hours = hours.where(stats["n"] >= cfg.min_observations, cfg.default_interval_h)
+        out.loc[hours.index] = hours
+        return out
+
+    def select_due(self, series: pd.DataFrame, history, now: Optional[datetime] = None) -> List[int]:
+        """
+        Posiciones (filas de `series`, con columnas sku y url) a chequear ahora.
+        Se decide por URL: si alguna serie de la URL vence, se descarga la URL entera
+        (el parseo único por documento hace que el resto de SKUs salga gratis).
+        """
+        now = now or datetime.utcnow()
+        self._refill(now)
+        keys = [series_key(s, u) for s, u in zip(series["sku"], series["url"])]
+        interval = self.intervals(series, history, now)
+
+        df = pd.DataFrame({"url": series["url"].to_numpy(), "key": keys})
+        last = pd.to_datetime(pd.Series([self.last_check.get(k) for k in keys], dtype="object"))
+        elapsed_h = (pd.Timestamp(now) - last).dt.total_seconds() / 3600.0
+        # nunca chequeada -> máxima prioridad
+        df["overdue"] = (elapsed_h / interval.reindex(keys).to_numpy()).fillna(np.inf).to_numpy()
+        # fallo reciente: espera retry_interval_h antes de volver a intentarlo
+        failed = pd.to_datetime(pd.Series([self.last_failure.get(k) for k in keys], dtype="object"))
+        retry_wait = (pd.Timestamp(now) - failed).dt.total_seconds() / 3600.0 < self.config.retry_interval_h
+        df.loc[retry_wait.to_numpy(), "overdue"] = 0.0
+
+        per_url = df.groupby("url", sort=False)["overdue"].max()
+        due_urls = per_url[per_url >= 1.0].sort_values(ascending=False, kind="stable")
+        take = int(self.tokens)
+        selected = set(due_urls.index[:take])
+        self.tokens -= len(selected)
+
+        self.last_selection = {
+            "series": len(keys),
+            "due_urls": int(len(due_urls)),
+            "selected_urls": len(selected),
+            "deferred_urls": int(max(0, len(due_urls) - len(selected))),
+            "tokens_left": round(self.tokens, 1),
+            "median_interval_h": float(interval.median()) if len(interval) else None,
+        }
+        return [i for i, u in enumerate(df["url"]) if u in selected]
+
+    def mark_checked(self, series: pd.DataFrame, now: Optional[datetime] = None):
+        ts = (now or datetime.utcnow()).isoformat(timespec="seconds")
+        for s, u in zip(series["sku"], series["url"]):
+            key = series_key(s, u)
+            self.last_check[key] = ts
+            self.last_failure.pop(key, None)
+
+    def mark_failed(self, series: pd.DataFrame, now: Optional[datetime] = None):
+        """La descarga falló: la serie sigue vencida y se reintenta tras retry_interval_h."""
+        ts = (now or datetime.utcnow()).isoformat(timespec="seconds")
+        for s, u in zip(series["sku"], series["url"]):
+            self.last_failure[series_key(s, u)] = ts
@@ -0,0 +1,90 @@
+# benchmarks/bench_extract.py
+# Micro-benchmark de extracción sobre HTML guardado en fixtures/
+# Compara:
+#   - bs4_per_target : un BeautifulSoup por target (comportamiento original)
+#   - bs4_grouped    : un BeautifulSoup por documento, todos los selectores sobre el mismo árbol
+#   - lxml_grouped   : un árbol lxml por documento con selectores CSS precompilados
+# Uso: python benchmarks/bench_extract.py [--repeat 20]
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Scripts"))
+
+import Motorizacion as pm  # noqa: E402
+
+def load_fixtures(fixtures_dir: str):
+    sel = pd.read_csv(os.path.join(fixtures_dir, "selectors.csv")).fillna("")
+    docs = {}
+    for name in sel["fixture"].unique():
+        with open(os.path.join(fixtures_dir, name), encoding="utf-8") as f:
+            docs[name] = f.read()
+    pairs = {}
+    for _, r in sel.iterrows():
+        pairs.setdefault(r["fixture"], []).append((r["price_selector"], r["stock_selector"] or None))
+    return docs, pairs
+
+def run_per_target(docs, pairs):
+    out = []
+    for name, ps in pairs.items():
+        for price_selector, stock_selector in ps:
+            out.append(pm.extract_price_and_stock(docs[name], price_selector, stock_selector))
+    return out
+
+def run_grouped(docs, pairs, parser):
+    out = []
+    for name, ps in pairs.items():
+        out.extend(pm.extract_many(docs[name], ps, parser))
+    return out
+
+def timeit(fn, repeat: int):
+    fn()  # calentamiento (y compilación de selectores en lxml)
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de precios")
+    parser.add_argument("--fixtures", default=os.path.join(HERE, "fixtures"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs, pairs = load_fixtures(args.fixtures)
+    n_targets = sum(len(p) for p in pairs.values())
+    size_kb = sum(len(d.encode("utf-8")) for d in docs.values()) / 1024
+
+    cases = {
+        "bs4_per_target": lambda: run_per_target(docs, pairs),
+        "bs4_grouped": lambda: run_grouped(docs, pairs, "bs4"),
+    }
+    if pm.lxml_available():
+        cases["lxml_grouped"] = lambda: run_grouped(docs, pairs, "lxml")
+    else:
+        print("[WARN] cssselect no instalado: se omite lxml_grouped")
+
+    # todos los backends deben devolver exactamente lo mismo
+    reference = cases["bs4_per_target"]()
+    for name, fn in cases.items():
+        if fn() != reference:
+            raise SystemExit(f"[ERROR] {name} no coincide con bs4_per_target")
+
+    print(f"Fixtures: {len(docs)} documentos ({size_kb:.0f} KB) · {n_targets} targets · repeat={args.repeat}\n")
+    print(f"{'caso':<16} {'mediana ms':>11} {'mín ms':>9} {'targets/s':>11} {'speedup':>8}")
+    base = None
+    for name, fn in cases.items():
+        samples = timeit(fn, args.repeat)
+        med = statistics.median(samples)
+        base = base or med
+        print(f"{name:<16} {med*1000:>11.2f} {min(samples)*1000:>9.2f} {n_targets/med:>11.0f} {base/med:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# benchmarks/bench_fetch.py
+# Benchmark de descarga + extracción contra un servidor local (standin_server.py), sin red
+# Casos (mismos targets, mismo servidor):
+#   - bs4          : descarga completa + BeautifulSoup
+#   - lxml         : descarga completa + lxml con selectores precompilados
+#   - lxml_stream  : streaming con corte anticipado
+#   - lxml_cache   : segunda ejecución con caché HTTP caliente (ETag / 304)
+# Usa las métricas por target del monitor (conexión, descarga, parseo, extracción).
+# Uso:
+#   python benchmarks/bench_fetch.py --urls 200 --latency-ms 40 --fail-rate 0.02 --json bench.json
+#   python benchmarks/bench_fetch.py ... --compare bench_anterior.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Scripts"))
+
+import Motorizacion as pm  # noqa: E402
+from history_store import CsvHistoryStore  # noqa: E402
+from metrics import PHASES  # noqa: E402
+from standin_server import StandInServer, StandInConfig  # noqa: E402
+
+def build_targets(servers, fixtures_dir: str, n_urls: int):
+    sel = pd.read_csv(os.path.join(fixtures_dir, "selectors.csv")).fillna("")
+    by_fixture = {name: g for name, g in sel.groupby("fixture", sort=True)}
+    names = sorted(by_fixture)
+    targets = []
+    for k in range(n_urls):
+        name = names[k % len(names)]
+        url = servers[k % len(servers)].url(k, name)
+        for j, r in enumerate(by_fixture[name].itertuples()):
+            targets.append(pm.Target(sku=f"B{k}-{j}", name=f"Bench {k}-{j}", our_price=100.0, url=url,
+                                     price_selector=r.price_selector, stock_selector=r.stock_selector or None))
+    return targets
+
+def run_case(targets, options: pm.MonitorOptions, workdir: str) -> dict:
+    store = CsvHistoryStore(os.path.join(workdir, "history.csv"))
+    today = time.strftime("%Y-%m-%d")
+    t0 = time.perf_counter()
+    df_today, alerts, stats, metrics = pm.collect(targets, options, today, 10.0, store)
+    wall = time.perf_counter() - t0
+    urls = metrics.drop_duplicates("url")
+    out = {
+        "wall_s": round(wall, 4),
+        "urls": len(urls),
+        "targets": len(targets),
+        "urls_per_s": round(len(urls) / wall, 2),
+        "errors": int(urls["error"].fillna("").ne("").sum()),
+        "retries": int(urls["retries"].sum()),
+        "mb": round(urls["bytes"].sum() / 1e6, 3),
+        "url_p50_ms": round(urls["total_s"].median() * 1000, 2),
+        "url_p95_ms": round(urls["total_s"].quantile(0.95) * 1000, 2),
+        # CPU/espera acumulada por fase (suma sobre URLs)
+        "phases_s": {p: round(float(urls[f"{p}_s"].sum()), 4) for p in PHASES},
+        "price_ok": int(df_today["competitor_price"].notna().sum()),
+    }
+    if stats.get("stream"):
+        out["stream"] = stats["stream"]
+    if stats.get("cache"):
+        out["cache"] = stats["cache"]
+    return out
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de descarga y parseo contra un servidor local")
+    parser.add_argument("--fixtures", default=os.path.join(HERE, "fixtures"))
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--domains", type=int, default=4, help="Servidores (puertos) distintos = dominios")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-domain", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--bytes-per-sec", type=float, default=0.0)
+    parser.add_argument("--retry-budget", type=float, default=5.0)
+    parser.add_argument("--cases", default="bs4,lxml,lxml_stream,lxml_cache")
+    parser.add_argument("--json", default="", help="Guarda los resultados en JSON")
+    parser.add_argument("--compare", default="", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    cfg = StandInConfig(args.fixtures, args.latency_ms, args.jitter_ms, args.fail_rate,
+                        args.bytes_per_sec, etag=True)
+    servers = [StandInServer(cfg).start() for _ in range(max(1, args.domains))]
+    targets = build_targets(servers, args.fixtures, args.urls)
+    base = dict(workers=max(2, args.workers), per_domain=args.per_domain, min_interval=0.0,
+                retry_budget=args.retry_budget)
+    cases = {
+        "bs4": dict(parser="bs4"),
+        "lxml": dict(parser="lxml"),
+        "lxml_stream": dict(parser="lxml", stream=True),
+        "lxml_cache": dict(parser="lxml"),
+    }
+    selected = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(selected) - set(cases)
+    if unknown:
+        raise SystemExit(f"[ERROR] Casos desconocidos: {', '.join(sorted(unknown))}")
+    if not pm.lxml_available():
+        print("[WARN] cssselect no instalado: se omiten los casos lxml")
+        selected = [c for c in selected if not c.startswith("lxml")]
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bench_fetch_")
+    try:
+        for name in selected:
+            options = pm.MonitorOptions(**base, **cases[name])
+            if name == "lxml_cache":
+                options.cache_path = os.path.join(workdir, "http_cache.json")
+                run_case(targets, options, workdir)  # calentamiento de la caché
+            results[name] = run_case(targets, options, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        for s in servers:
+            s.stop()
+
+    print(f"URLs: {args.urls} · targets: {len(targets)} · dominios: {len(servers)} · workers: {base['workers']} · "
+          f"latencia: {args.latency_ms} ms · fallos: {args.fail_rate:.0%}\n")
+    print(f"{'caso':<12} {'wall s':>8} {'URLs/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'MB':>7} "
+          f"{'err':>4} {'retry':>6} {'parse s':>8} {'extract s':>9}")
+    for name, r in results.items():
+        ph = r["phases_s"]
+        print(f"{name:<12} {r['wall_s']:>8.2f} {r['urls_per_s']:>8.1f} {r['url_p50_ms']:>8.1f} "
+              f"{r['url_p95_ms']:>8.1f} {r['mb']:>7.2f} {r['errors']:>4} {r['retries']:>6} "
+              f"{ph['parse']:>8.3f} {ph['extract']:>9.3f}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            prev = json.load(f)
+        print(f"\nComparación con {prev['meta'].get('git', '?')} (URLs/s, >1 = más rápido ahora):")
+        for name, r in results.items():
+            old = prev["cases"].get(name)
+            if old:
+                print(f"  {name:<12} {r['urls_per_s'] / old['urls_per_s']:.2f}x")
+
+    if args.json:
+        meta = {"git": git_rev(), "python": platform.python_version(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "args": vars(args), "targets": len(targets)}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "cases": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/bench_rules.py
+# Benchmark del motor de alertas sobre un histórico particionado sintético (sin red)
+# Casos (mismo lote de hoy, mismo histórico):
+#   - defaults   : cheaper_than_us + out_of_stock (sin histórico)
+#   - today_only : reglas con histórico configuradas con ventana 0/1 (sólo el lote de hoy)
+#   - window_7d  : drop_vs_median 7d + consecutive_cheaper 3d
+#   - all        : todas las reglas, stock_flip con 30 días
+# Uso: python benchmarks/bench_rules.py --series 20000 --days 30 --repeat 5
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Scripts"))
+
+from alert_rules import evaluate_alerts, rule_from_dict  # noqa: E402
+from history_store import PartitionedHistoryStore  # noqa: E402
+
+CASES = {
+    "defaults": [{"type": "cheaper_than_us", "threshold_pct": 10}, {"type": "out_of_stock"}],
+    "today_only": [{"type": "consecutive_cheaper", "days": 1}, {"type": "stock_flip", "lookback": 0},
+                   {"type": "drop_vs_median", "window_days": 0}],
+    "window_7d": [{"type": "drop_vs_median", "pct": 15, "window_days": 7},
+                  {"type": "consecutive_cheaper", "days": 3}],
+    "all": [{"type": "cheaper_than_us", "threshold_pct": 10}, {"type": "out_of_stock"},
+            {"type": "drop_vs_median", "pct": 15, "window_days": 7}, {"type": "consecutive_cheaper", "days": 3},
+            {"type": "stock_flip", "lookback": 30}],
+}
+
+def synthetic_day(date: str, n_series: int, rng: np.random.Generator) -> pd.DataFrame:
+    ours = np.round(rng.uniform(5, 500, n_series), 2)
+    comp = np.round(ours * rng.normal(1.0, 0.12, n_series), 2)
+    return pd.DataFrame({
+        "date": date,
+        "sku": [f"SKU{i:06d}" for i in range(n_series)],
+        "name": "producto",
+        "our_price": ours,
+        "competitor_price": comp,
+        "diff_abs": np.round(comp - ours, 2),
+        "diff_pct": np.round((comp / ours - 1.0) * 100.0, 2),
+        "in_stock": rng.random(n_series) > 0.05,
+        "url": [f"https://competidor{i % 3}.example/p/{i}" for i in range(n_series)],
+        "error": "",
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de alertas")
+    parser.add_argument("--series", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=30, help="Días de histórico previos a hoy")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    today = pd.Timestamp("2024-06-30")
+    workdir = tempfile.mkdtemp(prefix="bench_rules_")
+    try:
+        store = PartitionedHistoryStore(os.path.join(workdir, "price_history"))
+        for d in range(args.days, 0, -1):
+            store.append(synthetic_day((today - timedelta(days=d)).strftime("%Y-%m-%d"), args.series, rng))
+        batch = synthetic_day(today.strftime("%Y-%m-%d"), args.series, rng)
+
+        print(f"Series: {args.series} · histórico: {args.days} días ({store}) · repeat={args.repeat}\n")
+        print(f"{'caso':<12} {'alertas':>8} {'mediana s':>10} {'min s':>8}")
+        for name, specs in CASES.items():
+            rules = [rule_from_dict(s) for s in specs]
+            alerts = evaluate_alerts(batch, today.strftime("%Y-%m-%d"), rules, store)
+            samples = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                evaluate_alerts(batch, today.strftime("%Y-%m-%d"), rules, store)
+                samples.append(time.perf_counter() - t0)
+            print(f"{name:<12} {len(alerts):>8} {statistics.median(samples):>10.3f} {min(samples):>8.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/standin_server.py
+# Servidor HTTP local que imita a los competidores sirviendo los HTML de fixtures/
+# - /p/<n>/<fixture>  -> el fixture tal cual (n sólo cambia la URL)
+# - Latencia hasta cabeceras configurable (+ jitter) y ancho de banda limitado opcional
+# - Fallos deterministas (HTTP 503) con una proporción dada
+# - ETag opcional para probar la caché condicional (304)
+# Uso: python benchmarks/standin_server.py --port 8800 --latency-ms 80 --fail-rate 0.05
+
+import os
+import sys
+import time
+import random
+import zlib
+import argparse
+import threading
+import http.server
+from dataclasses import dataclass
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@dataclass
+class StandInConfig:
+    fixtures_dir: str = os.path.join(HERE, "fixtures")
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    fail_rate: float = 0.0
+    # 0 = sin límite
+    bytes_per_sec: float = 0.0
+    etag: bool = False
+    seed: int = 0
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StandInConfig = StandInConfig()
+    pages: dict = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _fails(self) -> bool:
+        # determinista por ruta + semilla: la misma URL falla siempre igual entre versiones
+        if self.config.fail_rate <= 0:
+            return False
+        h = zlib.crc32(f"{self.config.seed}:{self.path}".encode("utf-8"))
+        return (h % 10_000) / 10_000 < self.config.fail_rate
+
+    def do_GET(self):
+        cfg = self.config
+        delay = cfg.latency_ms + (random.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        name = self.path.split("?")[0].rstrip("/").split("/")[-1]
+        body = self.pages.get(name)
+        if body is None:
+            self.send_error(404)
+            return
+        if self._fails():
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{zlib.crc32(body):08x}"'
+        if cfg.etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if cfg.etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        try:
+            if cfg.bytes_per_sec > 0:
+                step = 16 * 1024
+                for i in range(0, len(body), step):
+                    self.wfile.write(body[i:i + step])
+                    time.sleep(step / cfg.bytes_per_sec)
+            else:
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # el cliente en streaming corta en cuanto tiene lo que necesita
+            pass
+
+def load_pages(fixtures_dir: str) -> dict:
+    pages = {}
+    for name in os.listdir(fixtures_dir):
+        if name.endswith(".html"):
+            with open(os.path.join(fixtures_dir, name), "rb") as f:
+                pages[name] = f.read()
+    return pages
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # conexiones cortadas por el cliente (streaming) no son errores del servidor
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+class StandInServer:
+    """Servidor en un hilo daemon; `port=0` elige un puerto libre."""
+    def __init__(self, config: StandInConfig, port: int = 0):
+        handler = type("Handler", (_Handler,), {"config": config, "pages": load_pages(config.fixtures_dir)})
+        self.httpd = _QuietServer(("127.0.0.1", port), handler)
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, n: int, fixture: str) -> str:
+        return f"http://127.0.0.1:{self.port}/p/{n}/{fixture}"
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de fixtures para benchmarks")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--fixtures", default=os.path.join(HERE, "fixtures"))
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--bytes-per-sec", type=float, default=0.0)
+    parser.add_argument("--etag", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    cfg = StandInConfig(args.fixtures, args.latency_ms, args.jitter_ms, args.fail_rate,
+                        args.bytes_per_sec, args.etag, args.seed)
+    server = StandInServer(cfg, args.port)
+    print(f"Sirviendo {args.fixtures} en http://127.0.0.1:{server.port}/p/<n>/<fixture>")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()